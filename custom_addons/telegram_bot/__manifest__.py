@@ -16,6 +16,7 @@
     'license': 'LGPL-3',
     'depends': [
         'base',
+        'bus',
         'sale',
         'mail',
         'crm',
@@ -31,6 +32,7 @@
         'views/telegram_bot_config_views.xml',
         'views/telegram_user_views.xml',
         'views/telegram_message_views.xml',
+        'views/telegram_broadcast_views.xml',
         'views/res_partner_views.xml',
         'views/sale_order_views.xml',
         'views/crm_lead_views.xml',
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from . import telegram_poll
+from . import telegram_bench
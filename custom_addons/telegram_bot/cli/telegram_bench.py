@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from werkzeug.test import Client
+
+from odoo import api, http, SUPERUSER_ID
+from odoo.cli import Command
+from odoo.modules.registry import Registry
+from odoo.tools import config
+
+from ..models.telegram_bot_config import fetch_updates
+
+# Сколько обновлений отдает getUpdates за один запрос (как Telegram)
+GET_UPDATES_LIMIT = 100
+# Обновлений на одну обработку входящей очереди webhook
+WEBHOOK_BATCH_SIZE = 100
+DEFAULT_MIX = 'new_user=10,verify=10,orders=20,text=60'
+# Синтетические Telegram ID (поля Integer в базе - 32 бита)
+BENCH_TELEGRAM_ID_START = 2_000_000_000
+
+
+class FakeBotApi:
+    """Локальная заглушка Telegram Bot API (getUpdates, sendMessage, editMessageText, setWebhook ...)
+
+    Обновления для getUpdates добавляются через push_updates, вызовы
+    считаются по методам.
+    """
+
+    def __init__(self):
+        self.updates = []
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, name='telegram_bench_api', daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_updates(self, updates):
+        with self.lock:
+            self.updates.extend(updates)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+    def handle(self, method, payload):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method == 'getUpdates':
+                offset = payload.get('offset') or 0
+                limit = payload.get('limit') or GET_UPDATES_LIMIT
+                self.updates = [update for update in self.updates if update['update_id'] >= offset]
+                return self.updates[:limit]
+            if method in ('sendMessage', 'editMessageText'):
+                return {'message_id': payload.get('message_id') or self.calls[method],
+                        'chat': {'id': payload.get('chat_id')}}
+            if method in ('setWebhook', 'deleteWebhook', 'answerCallbackQuery'):
+                return True
+        return None
+
+    def _make_handler(self):
+        fake_api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                result = fake_api.handle(method, payload)
+                if result is None:
+                    body = {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+                    status = 404
+                else:
+                    body = {'ok': True, 'result': result}
+                    status = 200
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class TrafficGenerator:
+    """Синтетические обновления Telegram с заданной долей каждого вида трафика
+
+    Виды: new_user - первое сообщение нового пользователя, verify - ввод кода
+    верификации (верного или неверного), orders - команда /orders,
+    page - листание списка заказов кнопкой, text - свободный текст оператору.
+    """
+    KINDS = ('new_user', 'verify', 'orders', 'page', 'text')
+    TEXTS = (
+        'Здравствуйте, когда будет готов мой заказ?',
+        'Подскажите, пожалуйста, стоимость установки окна',
+        'Can you send me the invoice?',
+        'Спасибо, все получили',
+        'Нужен замерщик на следующей неделе',
+    )
+
+    def __init__(self, mix, verified_users, unverified_users, seed=None):
+        """
+        :param mix: {вид: вес}
+        :param verified_users: [(telegram_id, chat_id)]
+        :param unverified_users: [(telegram_id, chat_id, verification_code)]
+        """
+        self.random = random.Random(seed)
+        self.kinds = [kind for kind in self.KINDS if mix.get(kind)]
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.verified_users = verified_users
+        self.unverified_users = unverified_users
+        self.next_telegram_id = BENCH_TELEGRAM_ID_START
+        self.next_message_id = 1
+
+    def generate(self, count, first_update_id):
+        updates = []
+        for update_id in range(first_update_id, first_update_id + count):
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            if kind == 'new_user' or (kind == 'verify' and not self.unverified_users) \
+                    or (kind in ('orders', 'page', 'text') and not self.verified_users):
+                self.next_telegram_id += 1
+                telegram_id = chat_id = self.next_telegram_id
+                text = self.random.choice(self.TEXTS)
+            elif kind == 'verify':
+                telegram_id, chat_id, code = self.random.choice(self.unverified_users)
+                # Примерно каждая третья попытка с верным кодом
+                text = code if self.random.random() < 0.3 else f'{self.random.randint(0, 999999):06d}'
+            elif kind == 'page':
+                telegram_id, chat_id = self.random.choice(self.verified_users)
+                updates.append(self._make_callback(update_id, telegram_id, chat_id, f'orders:{self.random.randint(0, 3)}'))
+                continue
+            else:
+                telegram_id, chat_id = self.random.choice(self.verified_users)
+                text = '/orders' if kind == 'orders' else self.random.choice(self.TEXTS)
+            updates.append(self._make_update(update_id, telegram_id, chat_id, text))
+        return updates
+
+    def _make_callback(self, update_id, telegram_id, chat_id, data):
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': {'id': telegram_id, 'first_name': 'Bench', 'last_name': str(telegram_id)},
+                'message': {'message_id': self.next_message_id, 'chat': {'id': chat_id, 'type': 'private'}},
+                'data': data,
+            },
+        }
+
+    def _make_update(self, update_id, telegram_id, chat_id, text):
+        self.next_message_id += 1
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': self.next_message_id,
+                'date': int(time.time()),
+                'from': {'id': telegram_id, 'first_name': 'Bench', 'last_name': str(telegram_id)},
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': text,
+            },
+        }
+
+
+class TelegramBenchmark:
+    """Замер пропускной способности обработки обновлений Telegram
+
+    Все данные создаются в одной транзакции, которая в конце откатывается,
+    каждый сценарий выполняется в своей точке сохранения и начинает с
+    одинакового состояния базы.
+    """
+
+    def __init__(self, env, fake_api, opts):
+        self.env = env
+        self.fake_api = fake_api
+        self.opts = opts
+        self.bot = None
+        self.generator = None
+
+    def setup(self):
+        env = self.env
+        params = env['ir.config_parameter'].sudo()
+        params.set_param('telegram_bot.api_base_url', self.fake_api.base_url)
+        params.set_param('telegram_bot.api_read_timeout', 5)
+        self.bot = env['telegram.bot.config'].create({
+            'bot_name': 'Benchmark',
+            'bot_token': 'bench:token',
+            'webhook_secret': 'bench-secret',
+            'use_webhook': False,
+        })
+        partners = env['res.partner'].create([
+            {'name': f'Telegram Bench {index}'} for index in range(self.opts.users)
+        ])
+        orders_vals = [
+            {'partner_id': partner.id} for partner in partners for _index in range(self.opts.orders_per_user)
+        ]
+        if orders_vals:
+            env['sale.order'].create(orders_vals)
+        users = env['telegram.user'].create([{
+            'bot_config_id': self.bot.id,
+            'telegram_id': BENCH_TELEGRAM_ID_START - index - 1,
+            'chat_id': BENCH_TELEGRAM_ID_START - index - 1,
+            'partner_id': partner.id,
+            'first_name': partner.name,
+            # Каждый пятый пользователь еще не прошел верификацию
+            'is_verified': bool(index % 5),
+        } for index, partner in enumerate(partners)])
+        self.generator = TrafficGenerator(
+            self.opts.mix,
+            [(user.telegram_id, user.chat_id) for user in users if user.is_verified],
+            [(user.telegram_id, user.chat_id, user.verification_code) for user in users if not user.is_verified],
+            seed=self.opts.seed,
+        )
+        env.cr.flush()
+
+    def run_scenario(self, name):
+        cr = self.env.cr
+        cr.execute('SAVEPOINT telegram_bench')
+        try:
+            return getattr(self, f'_run_{name}')()
+        finally:
+            cr.execute('ROLLBACK TO SAVEPOINT telegram_bench')
+            self.env.invalidate_all()
+            self.env.registry.clear_cache()
+            self.fake_api.reset_calls()
+
+    def _run_polling(self):
+        """getUpdates из заглушки и обработка так же, как в polling-воркере"""
+        cr = self.env.cr
+        updates = self.generator.generate(self.opts.updates, self.bot.last_update_id + 1)
+        self.fake_api.push_updates(updates)
+        api_client = self.bot._get_api()
+        result = BenchResult('polling')
+        started = time.monotonic()
+        while True:
+            batch_started = time.monotonic()
+            queries = cr.sql_log_count
+            batch = fetch_updates(api_client, self.bot.last_update_id + 1, 0)
+            if not batch:
+                break
+            self.bot._process_updates(batch)
+            # Хуки коммита (очередь отправки, шина) входят в стоимость обработки
+            cr.flush()
+            result.add_batch(len(batch), time.monotonic() - batch_started, cr.sql_log_count - queries)
+        result.finish(time.monotonic() - started, self._count_outgoing(), self.fake_api.calls)
+        return result
+
+    def _run_webhook(self):
+        """POST обновлений в маршрут /telegram/webhook и обработка входящей очереди
+
+        Запросы проходят через WSGI-приложение Odoo (маршрутизация, сессия,
+        контроллер) без сетевого сервера. Реестр на время запросов переводится
+        в тестовый режим: курсоры запросов работают внутри транзакции бенчмарка
+        и откатываются вместе с ней.
+        """
+        cr = self.env.cr
+        TelegramUpdate = self.env['telegram.update']
+        self.bot.use_webhook = True
+        self.bot.action_set_webhook()
+        cr.flush()
+        updates = self.generator.generate(self.opts.updates, 1)
+        result = BenchResult('webhook')
+        receive = BenchResult('webhook (HTTP-ответ Telegram)')
+        client = Client(http.root)
+        rejected = 0
+        registry = self.env.registry
+        registry.enter_test_mode(cr)
+        started = time.monotonic()
+        try:
+            for update in updates:
+                update_started = time.monotonic()
+                queries = cr.sql_log_count
+                response = client.post('/telegram/webhook/bench-secret', json=update)
+                if response.status_code != 200 or not json.loads(response.get_data()).get('ok'):
+                    rejected += 1
+                receive.add_batch(1, time.monotonic() - update_started, cr.sql_log_count - queries)
+        finally:
+            registry.leave_test_mode()
+        receive.finish(time.monotonic() - started, 0, {})
+        if rejected:
+            print(f"webhook: отклонено запросов {rejected}", file=sys.stderr)
+        self.env.invalidate_all()
+        while True:
+            batch_started = time.monotonic()
+            queries = cr.sql_log_count
+            batch = TelegramUpdate.search([('state', '=', 'pending')], order='id', limit=WEBHOOK_BATCH_SIZE)
+            if not batch:
+                break
+            batch._process()
+            cr.flush()
+            result.add_batch(len(batch), time.monotonic() - batch_started, cr.sql_log_count - queries)
+        result.finish(time.monotonic() - started, self._count_outgoing(), self.fake_api.calls)
+        return [receive, result]
+
+    def _count_outgoing(self):
+        """Ответы бота, поставленные в очередь (и отправленные в заглушку с --dispatch)"""
+        Queue = self.env['telegram.message.queue']
+        count = Queue.search_count([('bot_config_id', '=', self.bot.id)])
+        if self.opts.dispatch:
+            Queue._cron_dispatch(time_limit=self.opts.dispatch, auto_commit=False)
+        return count
+
+
+class BenchResult:
+    """Пропускная способность, задержки и число SQL-запросов сценария
+
+    Задержка обновления - время обработки пачки, в которой оно пришло
+    (от запроса getUpdates до готовности к коммиту).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.queries = 0
+        self.latencies = []
+        self.duration = 0
+        self.outgoing = 0
+        self.api_calls = {}
+
+    def add_batch(self, count, duration, queries):
+        self.count += count
+        self.queries += queries
+        self.latencies.extend([duration] * count)
+
+    def finish(self, duration, outgoing, api_calls):
+        self.duration = duration
+        self.outgoing = outgoing
+        self.api_calls = dict(api_calls)
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(round(percent / 100 * (len(latencies) - 1))))]
+
+    def format(self):
+        duration = max(self.duration, 0.001)
+        lines = [
+            f"{self.name}: обновлений {self.count} за {self.duration:.2f} с - {self.count / duration:.0f} в секунду",
+            f"  задержка p50 {self.percentile(50) * 1000:.1f} мс, p99 {self.percentile(99) * 1000:.1f} мс",
+            f"  SQL-запросов на обновление {self.queries / max(self.count, 1):.1f}",
+        ]
+        if self.outgoing:
+            lines.append(f"  ответов бота в очереди {self.outgoing}")
+        if self.api_calls:
+            lines.append('  вызовы Bot API: ' + ', '.join(
+                f'{method} {count}' for method, count in sorted(self.api_calls.items())))
+        return '\n'.join(lines)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _sep, weight = part.partition('=')
+        if kind.strip() not in TrafficGenerator.KINDS:
+            raise argparse.ArgumentTypeError(f'неизвестный вид трафика: {kind}')
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+class TelegramBench(Command):
+    """Бенчмарк обработки обновлений Telegram на локальной заглушке Bot API
+
+    Изменения в базе откатываются, но запускайте на копии базы: бенчмарк
+    нагружает ее так же, как реальный поток сообщений.
+    """
+    name = 'telegram_bench'
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog=f'{Path(sys.argv[0]).name} {self.name}',
+            description=self.__doc__,
+            epilog='Остальные параметры передаются Odoo (-c, -d, --db_host ...)',
+        )
+        parser.add_argument('--updates', type=int, default=1000, help='обновлений в каждом сценарии')
+        parser.add_argument('--users', type=int, default=200, help='существующих Telegram пользователей')
+        parser.add_argument('--orders-per-user', type=int, default=3, help='заказов у каждого клиента')
+        parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                            help=f'доли видов трафика (по умолчанию {DEFAULT_MIX})')
+        parser.add_argument('--scenario', choices=['polling', 'webhook', 'all'], default='all')
+        parser.add_argument('--dispatch', type=int, default=0, metavar='SECONDS',
+                            help='после сценария отправлять очередь в заглушку указанное число секунд')
+        parser.add_argument('--seed', type=int, default=None, help='seed генератора трафика')
+        opts, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config(odoo_args)
+
+        dbname = config['db_name']
+        if not dbname or ',' in dbname:
+            sys.exit('Укажите одну базу данных: -d <db_name>')
+
+        fake_api = FakeBotApi()
+        fake_api.start()
+        threading.current_thread().dbname = dbname
+        registry = Registry(dbname)
+        try:
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                if 'telegram.bot.config' not in env:
+                    sys.exit(f'Модуль telegram_bot не установлен в базе {dbname}')
+                try:
+                    benchmark = TelegramBenchmark(env, fake_api, opts)
+                    benchmark.setup()
+                    scenarios = ['polling', 'webhook'] if opts.scenario == 'all' else [opts.scenario]
+                    for scenario in scenarios:
+                        results = benchmark.run_scenario(scenario)
+                        for result in results if isinstance(results, list) else [results]:
+                            print(result.format())
+                finally:
+                    cr.rollback()
+                    registry.clear_cache()
+        finally:
+            fake_api.stop()
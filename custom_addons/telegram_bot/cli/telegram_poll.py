@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import signal
+import sys
+import threading
+from pathlib import Path
+
+from odoo import api, fields, SUPERUSER_ID
+from odoo.cli import Command
+from odoo.modules.registry import Registry
+from odoo.tools import config
+
+from ..models.telegram_bot_api import TelegramApiError
+from ..models.telegram_bot_config import LONG_POLL_TIMEOUT, fetch_updates
+
+_logger = logging.getLogger(__name__)
+
+# Как часто проверять список ботов (новые, отключенные, переведенные на webhook)
+BOT_RESCAN_INTERVAL = 60
+# Пауза после ошибки Telegram API или обработки
+ERROR_DELAY = 5
+
+
+class TelegramPoller:
+    """Непрерывный long polling для всех активных ботов без webhook
+
+    Для каждого бота работает отдельный поток: запрос getUpdates выполняется
+    вне транзакции, а обработка обновлений и новый last_update_id
+    сохраняются одним коммитом.
+    """
+
+    def __init__(self, dbname, timeout=LONG_POLL_TIMEOUT):
+        self.dbname = dbname
+        self.timeout = timeout
+        self.stop_event = threading.Event()
+        self.threads = {}
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                for bot_id in self._get_bot_ids():
+                    thread = self.threads.get(bot_id)
+                    if thread is None or not thread.is_alive():
+                        thread = threading.Thread(
+                            target=self._poll_bot, args=(bot_id,),
+                            name=f'telegram_poll_{bot_id}', daemon=True)
+                        self.threads[bot_id] = thread
+                        thread.start()
+            except Exception as e:
+                _logger.error(f"Ошибка получения списка Telegram ботов: {str(e)}", exc_info=True)
+            self.stop_event.wait(BOT_RESCAN_INTERVAL)
+        for thread in self.threads.values():
+            thread.join(self.timeout + 10)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _get_bot_ids(self):
+        registry = Registry(self.dbname).check_signaling()
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            return env['telegram.bot.config'].search([('use_webhook', '=', False)]).ids
+
+    def _poll_bot(self, bot_id):
+        threading.current_thread().dbname = self.dbname
+        _logger.info(f"Запущен long polling Telegram бота {bot_id}")
+        while not self.stop_event.is_set():
+            try:
+                if not self._poll_once(bot_id):
+                    break
+            except TelegramApiError as e:
+                _logger.error(f"Ошибка получения обновлений бота {bot_id}: {e.description}")
+                self.stop_event.wait(e.retry_after or ERROR_DELAY)
+            except Exception as e:
+                _logger.error(f"Ошибка обработки обновлений бота {bot_id}: {str(e)}", exc_info=True)
+                self.stop_event.wait(ERROR_DELAY)
+        _logger.info(f"Остановлен long polling Telegram бота {bot_id}")
+
+    def _poll_once(self, bot_id):
+        """Один запрос getUpdates и обработка полученных обновлений
+
+        :return: False, если бот отключен или переведен на webhook
+        """
+        registry = Registry(self.dbname).check_signaling()
+        with registry.manage_changes(), registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            bot_config = env['telegram.bot.config'].browse(bot_id).exists()
+            if not bot_config or not bot_config.active or bot_config.use_webhook:
+                return False
+            # Отметка для cron: обновления этого бота получает воркер
+            bot_config.polling_worker_date = fields.Datetime.now()
+            api_client = bot_config._get_api()
+            offset = bot_config.last_update_id + 1
+
+        # Запрос висит до timeout секунд, поэтому транзакцию на это время не держим
+        updates = fetch_updates(api_client, offset, self.timeout)
+        if not updates:
+            return True
+
+        with registry.manage_changes(), registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            bot_config = env['telegram.bot.config'].browse(bot_id)
+            bot_config._process_updates(updates, auto_commit=True)
+        return True
+
+
+class TelegramPoll(Command):
+    """Long polling Telegram ботов в отдельном процессе (вместо cron)"""
+    name = 'telegram_poll'
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog=f'{Path(sys.argv[0]).name} {self.name}',
+            description=self.__doc__,
+            epilog='Остальные параметры передаются Odoo (-c, -d, --db_host ...)',
+        )
+        parser.add_argument('--timeout', type=int, default=LONG_POLL_TIMEOUT,
+                            help='таймаут запроса getUpdates в секундах')
+        opts, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config(odoo_args)
+
+        dbname = config['db_name']
+        if not dbname or ',' in dbname:
+            sys.exit('Укажите одну базу данных: -d <db_name>')
+
+        poller = TelegramPoller(dbname, opts.timeout)
+        signal.signal(signal.SIGINT, lambda sig, frame: poller.stop())
+        signal.signal(signal.SIGTERM, lambda sig, frame: poller.stop())
+        poller.run()
@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 
+from . import telegram_bot_api
 from . import telegram_user
 from . import telegram_message
+from . import telegram_message_archive
+from . import telegram_message_queue
+from . import telegram_update
+from . import telegram_broadcast
+from . import telegram_notification
+from . import telegram_inbox
 from . import res_partner
+from . import telegram_order_summary
 from . import sale_order
 from . import telegram_bot_config
 from . import telegram_message_handler
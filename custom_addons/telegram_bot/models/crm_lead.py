@@ -2,6 +2,7 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools import column_exists, table_exists
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -12,6 +13,29 @@ class CrmLead(models.Model):
 
     telegram_user_id = fields.Many2one('telegram.user', string='Telegram пользователь', ondelete='set null')
     telegram_message_ids = fields.One2many('telegram.message', 'crm_lead_id', string='Telegram сообщения')
+    # Счетчики поддерживает telegram.message при создании и прочтении сообщений; сообщения,
+    # перенесенные в архив, в них не входят (см. telegram_archive_ids)
+    telegram_message_count = fields.Integer(string='Сообщений Telegram', readonly=True,
+                                            help='Без сообщений, перенесенных в архив')
+    telegram_unread_count = fields.Integer(string='Непрочитанных в Telegram', readonly=True)
+    telegram_last_incoming_date = fields.Datetime(string='Последнее входящее в Telegram', readonly=True)
+    telegram_last_outgoing_date = fields.Datetime(string='Последнее исходящее в Telegram', readonly=True)
+    telegram_archive_ids = fields.Many2many('telegram.message.archive', 'telegram_message_archive_crm_lead_rel',
+                                            'lead_id', 'archive_id', string='Архив Telegram', readonly=True)
+    telegram_archive_count = fields.Integer(string='Месяцев в архиве Telegram', compute='_compute_telegram_archive_count')
+
+    def _auto_init(self):
+        new_counters = not column_exists(self.env.cr, 'crm_lead', 'telegram_unread_count')
+        result = super()._auto_init()
+        if new_counters and table_exists(self.env.cr, 'telegram_message'):
+            self.env['telegram.message']._recompute_counters({self._name: None})
+        return result
+
+    def _compute_telegram_archive_count(self):
+        counts = dict(self.env['telegram.message.archive']._read_group(
+            [('crm_lead_ids', 'in', self.ids)], ['crm_lead_ids'], ['__count']))
+        for lead in self:
+            lead.telegram_archive_count = counts.get(lead._origin, 0)
 
     @api.onchange('partner_id')
     def _onchange_partner_id_telegram(self):
@@ -33,7 +57,10 @@ class CrmLead(models.Model):
         return result
 
     def _send_stage_notification(self):
-        """Отправить уведомление об изменении стадии лида"""
+        """Добавить уведомление об изменении стадии лида в сводку клиента
+
+        Сообщение формируется при коммите, одно на клиента для всех измененных лидов.
+        """
         self.ensure_one()
         
         # Найти Telegram пользователя
@@ -54,19 +81,19 @@ class CrmLead(models.Model):
         if self.expected_revenue:
             message += f"\n\nОжидаемая выручка: {self.company_currency_id.symbol} {self.expected_revenue:.2f}"
         
-        try:
-            telegram_user._send_telegram_message(message)
-            
-            # Сохранить в истории сообщений и привязать к лиду
-            self.env['telegram.message'].create({
-                'telegram_user_id': telegram_user.id,
-                'crm_lead_id': self.id,
-                'message_date': fields.Datetime.now(),
-                'text': message,
-                'direction': 'outgoing',
-            })
-        except Exception as e:
-            _logger.error(f"Ошибка отправки уведомления о стадии лида в Telegram: {str(e)}")
+        self.env['telegram.notification']._add(telegram_user, (self._name, self.id), message, crm_lead=self)
+
+    def action_view_telegram_archive(self):
+        """Открыть архив переписки по лиду"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Архив Telegram'),
+            'res_model': 'telegram.message.archive',
+            'domain': [('crm_lead_ids', 'in', self.ids)],
+            'view_mode': 'tree,form',
+            'target': 'current',
+        }
 
     def action_send_telegram_message(self):
         """Открыть форму отправки сообщения в Telegram"""
@@ -1,22 +1,51 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api
+from odoo.tools import column_exists, create_column, table_exists
 
 
 class ResPartner(models.Model):
     _inherit = 'res.partner'
 
     telegram_user_ids = fields.One2many('telegram.user', 'partner_id', string='Telegram пользователи')
-    telegram_user_id = fields.Many2one('telegram.user', string='Основной Telegram', compute='_compute_telegram_user', store=False)
-    has_telegram = fields.Boolean(string='Есть Telegram', compute='_compute_has_telegram', store=False)
-
+    telegram_user_id = fields.Many2one(
+        'telegram.user', string='Основной Telegram', compute='_compute_telegram_user', store=True,
+        index='btree_not_null')
+    has_telegram = fields.Boolean(string='Есть Telegram', compute='_compute_telegram_user', store=True, index=True)
+
+    def _auto_init(self):
+        # Заполнить новые колонки одним UPDATE, а не пересчетом по всем партнерам
+        if not column_exists(self.env.cr, 'res_partner', 'has_telegram'):
+            create_column(self.env.cr, 'res_partner', 'telegram_user_id', 'int4')
+            create_column(self.env.cr, 'res_partner', 'has_telegram', 'boolean')
+            if table_exists(self.env.cr, 'telegram_user'):
+                self.env.cr.execute("""
+                    UPDATE res_partner partner
+                       SET telegram_user_id = verified.id,
+                           has_telegram = TRUE
+                      FROM (
+                            SELECT DISTINCT ON (partner_id) partner_id, id
+                              FROM telegram_user
+                             WHERE is_verified
+                          ORDER BY partner_id, id
+                           ) verified
+                     WHERE verified.partner_id = partner.id
+                """)
+        return super()._auto_init()
+
+    @api.depends('telegram_user_ids.is_verified')
     def _compute_telegram_user(self):
         for record in self:
             record.telegram_user_id = record.telegram_user_ids.filtered(lambda u: u.is_verified)[:1]
-
-    def _compute_has_telegram(self):
-        for record in self:
-            record.has_telegram = bool(record.telegram_user_ids.filtered(lambda u: u.is_verified))
+            record.has_telegram = bool(record.telegram_user_id)
+
+    def unlink(self):
+        has_telegram_users = bool(self.sudo().telegram_user_ids)
+        result = super().unlink()
+        if has_telegram_users:
+            # Telegram пользователи удаляются каскадом в базе, минуя кеш _get_cached_user
+            self.env['telegram.user']._invalidate_user_cache()
+        return result
 
     def action_view_telegram_users(self):
         """Открыть Telegram пользователей"""
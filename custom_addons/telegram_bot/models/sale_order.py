@@ -3,13 +3,27 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 
+from .telegram_order_summary import ORDER_SUMMARY_FIELDS
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        self.env['telegram.order.summary']._invalidate(orders.partner_id.ids)
+        return orders
+
     def write(self, vals):
         """Отслеживать изменение статуса и отправлять уведомления"""
+        summary_changed = ORDER_SUMMARY_FIELDS.intersection(vals)
+        if summary_changed:
+            # Прежний клиент заказа тоже теряет строку сводки
+            self.env['telegram.order.summary']._invalidate(self.partner_id.ids)
         result = super().write(vals)
+        if summary_changed:
+            self.env['telegram.order.summary']._invalidate(self.partner_id.ids)
         
         # Если изменился статус заказа
         if 'state' in vals:
@@ -18,8 +32,21 @@ class SaleOrder(models.Model):
         
         return result
 
+    def unlink(self):
+        self.env['telegram.order.summary']._invalidate(self.partner_id.ids)
+        return super().unlink()
+
+    def _compute_amounts(self):
+        super()._compute_amounts()
+        # Суммы пересчитываются из строк заказа без вызова write
+        orders = self.filtered(lambda order: not isinstance(order.id, models.NewId))
+        self.env['telegram.order.summary']._invalidate(orders.partner_id.ids)
+
     def _send_status_notification(self, new_state):
-        """Отправить уведомление об изменении статуса заказа"""
+        """Добавить уведомление об изменении статуса заказа в сводку клиента
+
+        Сообщение формируется при коммите, одно на клиента для всех измененных заказов.
+        """
         self.ensure_one()
         
         # Найти Telegram пользователя клиента
@@ -45,21 +72,7 @@ class SaleOrder(models.Model):
             f"Сумма: {self.currency_id.symbol} {self.amount_total:.2f}"
         )
         
-        try:
-            telegram_user._send_telegram_message(message)
-            
-            # Сохранить в истории сообщений
-            self.env['telegram.message'].create({
-                'telegram_user_id': telegram_user.id,
-                'message_date': fields.Datetime.now(),
-                'text': message,
-                'direction': 'outgoing',
-            })
-        except Exception as e:
-            # Логируем ошибку, но не прерываем выполнение
-            import logging
-            _logger = logging.getLogger(__name__)
-            _logger.error(f"Ошибка отправки уведомления в Telegram: {str(e)}")
+        self.env['telegram.notification']._add(telegram_user, (self._name, self.id), message)
 
     def action_view_telegram_users(self):
         """Открыть Telegram пользователей клиента"""
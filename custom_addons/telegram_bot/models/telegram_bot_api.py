@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.telegram.org'
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+POOL_MAXSIZE = 10
+
+# Сессии и метрики общие для всех потоков процесса (воркера)
+_sessions = {}
+_metrics = {}
+_lock = threading.Lock()
+
+
+class TelegramApiError(Exception):
+    """Ошибка вызова Telegram Bot API
+
+    :param status_code: HTTP статус ответа (None при сетевой ошибке)
+    :param retry_after: пауза в секундах, которую запросил Telegram (ответ 429)
+    """
+
+    def __init__(self, description, status_code=None, retry_after=None):
+        super().__init__(description)
+        self.description = description
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TelegramBotApi:
+    """Клиент Telegram Bot API с пулом keep-alive соединений
+
+    Для каждой пары (base_url, token) в процессе создается одна
+    requests.Session, поэтому повторные вызовы используют уже открытое
+    TLS-соединение.
+    """
+
+    def __init__(self, token, base_url=DEFAULT_BASE_URL,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.token = token
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    @property
+    def session(self):
+        key = (self.base_url, self.token)
+        session = _sessions.get(key)
+        if session is None:
+            with _lock:
+                session = _sessions.get(key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    _sessions[key] = session
+        return session
+
+    def call(self, method, payload=None, read_timeout=None):
+        """Вызвать метод Bot API и вернуть поле result ответа
+
+        :param read_timeout: таймаут чтения, если он больше обычного (long polling)
+        :raises TelegramApiError: при сетевой ошибке или ответе ok=false
+        """
+        started = time.monotonic()
+        status_code = None
+        try:
+            response = self.session.post(
+                f"{self.base_url}/bot{self.token}/{method}",
+                json=payload or {},
+                timeout=(self.connect_timeout, read_timeout or self.read_timeout),
+            )
+            status_code = response.status_code
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise TelegramApiError(str(e), status_code) from e
+        finally:
+            _record_metric(method, time.monotonic() - started, status_code)
+
+        if not result.get('ok'):
+            raise TelegramApiError(
+                result.get('description', f'HTTP {status_code}'),
+                status_code,
+                result.get('parameters', {}).get('retry_after'),
+            )
+        return result.get('result')
+
+
+def _record_metric(method, duration, status_code):
+    with _lock:
+        metric = _metrics.setdefault(method, {'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0})
+        metric['count'] += 1
+        metric['total_time'] += duration
+        metric['max_time'] = max(metric['max_time'], duration)
+        if status_code != 200:
+            metric['errors'] += 1
+    _logger.debug(f"Telegram API {method}: {duration * 1000:.0f} мс, HTTP {status_code}")
+
+
+def get_metrics():
+    """Метрики вызовов Bot API в текущем процессе: {метод: {count, errors, avg_time, max_time}}"""
+    with _lock:
+        return {
+            method: {
+                'count': metric['count'],
+                'errors': metric['errors'],
+                'avg_time': metric['total_time'] / metric['count'] if metric['count'] else 0,
+                'max_time': metric['max_time'],
+            }
+            for method, metric in _metrics.items()
+        }
@@ -1,8 +1,39 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError
 
+from .telegram_bot_api import (
+    TelegramBotApi, TelegramApiError, DEFAULT_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+)
+
+_logger = logging.getLogger(__name__)
+
+# Таймаут long polling запроса getUpdates (секунды)
+LONG_POLL_TIMEOUT = 25
+# Если воркер не отмечался дольше этого времени, обновления снова получает cron
+POLLING_WORKER_TIMEOUT = 2 * LONG_POLL_TIMEOUT + 30
+# Сколько ботов cron опрашивает одновременно
+UPDATES_MAX_WORKERS = 8
+# Сколько обновлений обрабатывается в одной транзакции
+UPDATES_CHUNK_SIZE = 200
+# Поля, от которых зависит кеш webhook secret
+WEBHOOK_CACHE_FIELDS = {'webhook_secret', 'active', 'use_webhook'}
+
+
+def fetch_updates(api_client, offset, timeout=LONG_POLL_TIMEOUT):
+    """Запрос getUpdates без обращения к базе (можно вызывать из других потоков)"""
+    return api_client.call('getUpdates', {
+        'offset': offset,
+        'timeout': timeout,
+        'allowed_updates': ['message', 'callback_query']
+    }, read_timeout=timeout + 5)
+
 
 class TelegramBotConfig(models.Model):
     _name = 'telegram.bot.config'
@@ -15,6 +46,9 @@ class TelegramBotConfig(models.Model):
     webhook_secret = fields.Char(string='Webhook Secret', help='Секретный ключ для проверки webhook (только для webhook режима)')
     use_webhook = fields.Boolean(string='Использовать Webhook', default=False, help='Если выключено, используется long polling (getUpdates)')
     last_update_id = fields.Integer(string='Последний Update ID', default=0, help='Для long polling режима')
+    polling_worker_date = fields.Datetime(
+        string='Polling-воркер активен', readonly=True,
+        help='Время последнего запроса getUpdates от polling-воркера (odoo-bin telegram_poll)')
     active = fields.Boolean(string='Активен', default=True)
     operator_user_ids = fields.Many2many(
         'res.users',
@@ -35,6 +69,50 @@ class TelegramBotConfig(models.Model):
             else:
                 record.webhook_url = False
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        bots = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return bots
+
+    def write(self, vals):
+        result = super().write(vals)
+        if WEBHOOK_CACHE_FIELDS.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env.registry.clear_cache()
+        return result
+
+    @api.model
+    def _get_webhook_bot_id(self, secret):
+        """ID активного бота по webhook secret или False"""
+        return self._get_webhook_bots().get(secret, False)
+
+    @api.model
+    @tools.ormcache()
+    def _get_webhook_bots(self):
+        """{webhook secret: ID бота} активных ботов (кешируется в памяти воркера)
+
+        Кешируется весь словарь, а не ответ на каждый secret: secret приходит
+        из публичного URL, и перебор неверных значений не должен заполнять кеш.
+        """
+        bots = self.sudo().search_read([('webhook_secret', '!=', False), ('active', '=', True)], ['webhook_secret'])
+        return tools.frozendict((bot['webhook_secret'], bot['id']) for bot in reversed(bots))
+
+    def _get_api(self):
+        """Клиент Bot API для этого бота (настройки в системных параметрах telegram_bot.*)"""
+        self.ensure_one()
+        params = self.env['ir.config_parameter'].sudo()
+        return TelegramBotApi(
+            self.bot_token,
+            base_url=params.get_param('telegram_bot.api_base_url', DEFAULT_BASE_URL),
+            connect_timeout=float(params.get_param('telegram_bot.api_connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+            read_timeout=float(params.get_param('telegram_bot.api_read_timeout', DEFAULT_READ_TIMEOUT)),
+        )
+
     def action_set_webhook(self):
         """Установить webhook для бота"""
         self.ensure_one()
@@ -43,33 +121,25 @@ class TelegramBotConfig(models.Model):
         if not self.webhook_secret:
             raise UserError(_('Укажите Webhook Secret'))
 
-        import requests
         base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
         webhook_url = f"{base_url}/telegram/webhook/{self.webhook_secret}"
 
         try:
-            response = requests.post(
-                f"https://api.telegram.org/bot{self.bot_token}/setWebhook",
-                json={'url': webhook_url},
-                timeout=10
-            )
-            response.raise_for_status()
-            result = response.json()
-            if result.get('ok'):
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'display_notification',
-                    'params': {
-                        'title': _('Успешно'),
-                        'message': _('Webhook установлен'),
-                        'type': 'success',
-                        'sticky': False,
-                    }
-                }
-            else:
-                raise UserError(_('Ошибка установки webhook: %s') % result.get('description', 'Unknown error'))
-        except requests.exceptions.RequestException as e:
-            raise UserError(_('Ошибка подключения к Telegram API: %s') % str(e))
+            self._get_api().call('setWebhook', {'url': webhook_url})
+        except TelegramApiError as e:
+            if e.status_code is None:
+                raise UserError(_('Ошибка подключения к Telegram API: %s') % e.description)
+            raise UserError(_('Ошибка установки webhook: %s') % e.description)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Успешно'),
+                'message': _('Webhook установлен'),
+                'type': 'success',
+                'sticky': False,
+            }
+        }
 
     def action_delete_webhook(self):
         """Удалить webhook"""
@@ -77,87 +147,93 @@ class TelegramBotConfig(models.Model):
         if not self.bot_token:
             raise UserError(_('Укажите Bot Token'))
 
-        import requests
         try:
-            response = requests.post(
-                f"https://api.telegram.org/bot{self.bot_token}/deleteWebhook",
-                timeout=10
-            )
-            response.raise_for_status()
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Успешно'),
-                    'message': _('Webhook удален'),
-                    'type': 'success',
-                    'sticky': False,
-                }
+            self._get_api().call('deleteWebhook')
+        except TelegramApiError as e:
+            raise UserError(_('Ошибка подключения к Telegram API: %s') % e.description)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Успешно'),
+                'message': _('Webhook удален'),
+                'type': 'success',
+                'sticky': False,
             }
-        except requests.exceptions.RequestException as e:
-            raise UserError(_('Ошибка подключения к Telegram API: %s') % str(e))
+        }
 
     def get_active_bot(self):
-        """Получить активного бота"""
+        """Получить активного бота (по умолчанию для новых пользователей)"""
         return self.search([('active', '=', True)], limit=1)
 
     @api.model
     def process_updates(self):
-        """Обработать обновления через getUpdates (long polling) - вызывается из cron"""
-        bot_config = self.get_active_bot()
-        if not bot_config or bot_config.use_webhook:
+        """Обработать обновления через getUpdates (long polling) - вызывается из cron
+
+        Обновления всех активных ботов без webhook запрашиваются параллельно,
+        затем обрабатываются по очереди, у каждого бота свой last_update_id.
+        Боты, которые обслуживает polling-воркер (odoo-bin telegram_poll), cron пропускает.
+        """
+        bots = self.search([('use_webhook', '=', False)]).filtered(lambda bot: not bot._is_polled_by_worker())
+        if not bots:
             return
-        
-        import requests
-        import logging
-        _logger = logging.getLogger(__name__)
-        
-        try:
-            # Получить обновления
-            response = requests.get(
-                f"https://api.telegram.org/bot{bot_config.bot_token}/getUpdates",
-                params={
-                    'offset': bot_config.last_update_id + 1,
-                    'timeout': 10,
-                    'allowed_updates': ['message', 'callback_query']
-                },
-                timeout=15
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            if not result.get('ok'):
-                _logger.error(f"Ошибка получения обновлений: {result.get('description')}")
-                return
-            
-            updates = result.get('result', [])
-            if not updates:
-                return
-            
-            # Обработать каждое обновление
-            from odoo.addons.telegram_bot.models.telegram_message_handler import TelegramMessageHandler
-            
-            max_update_id = bot_config.last_update_id
-            for update in updates:
-                update_id = update.get('update_id')
-                max_update_id = max(max_update_id, update_id)
-                
-                try:
-                    # Обработать сообщение
-                    if 'message' in update:
-                        TelegramMessageHandler.process_message(bot_config, update['message'], self.env)
-                    elif 'callback_query' in update:
-                        TelegramMessageHandler._process_callback_query(bot_config, update['callback_query'], self.env)
-                except Exception as e:
-                    _logger.error(f"Ошибка обработки обновления {update_id}: {str(e)}", exc_info=True)
-            
-            # Сохранить последний обработанный update_id
-            bot_config.sudo().write({'last_update_id': max_update_id})
-            
-        except requests.exceptions.RequestException as e:
-            _logger.error(f"Ошибка подключения к Telegram API: {str(e)}")
-        except Exception as e:
-            _logger.error(f"Ошибка обработки обновлений: {str(e)}", exc_info=True)
+
+        # В потоках только HTTP-запросы, без обращений к базе
+        requests_by_bot = {bot: (bot._get_api(), bot.last_update_id + 1) for bot in bots}
+        with ThreadPoolExecutor(max_workers=min(len(bots), UPDATES_MAX_WORKERS)) as executor:
+            futures = {
+                bot: executor.submit(fetch_updates, api_client, offset, 10)
+                for bot, (api_client, offset) in requests_by_bot.items()
+            }
+        for bot, future in futures.items():
+            try:
+                updates = future.result()
+            except TelegramApiError as e:
+                _logger.error(f"Ошибка получения обновлений бота {bot.bot_name}: {e.description}")
+                continue
+            bot._process_updates(updates, auto_commit=True)
+
+    def _is_polled_by_worker(self):
+        """Бот обслуживается запущенным polling-воркером"""
+        self.ensure_one()
+        return bool(self.polling_worker_date) and (
+            fields.Datetime.now() - self.polling_worker_date < timedelta(seconds=POLLING_WORKER_TIMEOUT))
+
+    def _fetch_updates(self, timeout=LONG_POLL_TIMEOUT):
+        """Получить неподтвержденные обновления, начиная с last_update_id + 1"""
+        self.ensure_one()
+        return fetch_updates(self._get_api(), self.last_update_id + 1, timeout)
+
+    def _process_updates(self, updates, auto_commit=False):
+        """Обработать обновления пачками и сохранить last_update_id вместе с каждой пачкой
+
+        Telegram подтверждает обновления только следующим запросом с большим offset,
+        поэтому при сбое до коммита те же обновления придут повторно, а уже
+        обработанные (update_id <= last_update_id) пропускаются.
+
+        :param auto_commit: коммитить после каждой пачки (cron и polling-воркер)
+        :return: количество обработанных обновлений
+        """
+        self.ensure_one()
+        from odoo.addons.telegram_bot.models.telegram_message_handler import TelegramMessageHandler
+
+        started = time.monotonic()
+        updates = sorted(
+            (update for update in updates if update.get('update_id', 0) > self.last_update_id),
+            key=lambda update: update['update_id'])
+        for start in range(0, len(updates), UPDATES_CHUNK_SIZE):
+            chunk = updates[start:start + UPDATES_CHUNK_SIZE]
+            TelegramMessageHandler.process_updates_batch(self, chunk, self.env)
+            self.sudo().write({'last_update_id': chunk[-1]['update_id']})
+            if auto_commit:
+                self.env.cr.commit()
+
+        if updates:
+            duration = max(time.monotonic() - started, 0.001)
+            _logger.info(
+                f"Telegram бот {self.bot_name}: обработано обновлений {len(updates)} "
+                f"за {duration:.2f} с ({len(updates) / duration:.0f} в секунду)")
+        return len(updates)
 
     def action_process_updates(self):
         """Ручной запуск обработки обновлений (для тестирования)"""
@@ -165,7 +241,11 @@ class TelegramBotConfig(models.Model):
         if self.use_webhook:
             raise UserError(_('Включен режим webhook. Для ручной проверки отключите webhook.'))
         
-        self.env['telegram.bot.config'].process_updates()
+        try:
+            updates = self._fetch_updates(timeout=0)
+        except TelegramApiError as e:
+            raise UserError(_('Ошибка получения обновлений: %s') % e.description)
+        self._process_updates(updates)
         
         return {
             'type': 'ir.actions.client',
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+from odoo.tools.safe_eval import safe_eval, datetime
+
+_logger = logging.getLogger(__name__)
+
+BROADCAST_BATCH_SIZE = 500
+BROADCAST_TIME_LIMIT = 50
+# Рассылка не добавляет сообщения, пока в очереди отправки их больше этого числа,
+# чтобы ответы клиентам и уведомления о заказах не ждали за рассылкой
+BROADCAST_QUEUE_LIMIT = 600
+BROADCAST_RETRY_DELAY = 30
+
+
+class TelegramBroadcast(models.Model):
+    """Массовая рассылка верифицированным клиентам Telegram
+
+    Получатели фиксируются при запуске, сообщения рендерятся и ставятся
+    в очередь отправки пачками. Если процесс прервется, следующий запуск
+    cron продолжит с получателей, которым сообщение еще не поставлено.
+    """
+    _name = 'telegram.broadcast'
+    _description = 'Рассылка Telegram'
+    _order = 'id desc'
+
+    name = fields.Char(string='Название', required=True)
+    bot_config_id = fields.Many2one(
+        'telegram.bot.config', string='Бот',
+        help='Только пользователи этого бота. Если не указан - все боты, каждому через его бота')
+    target_model = fields.Selection([
+        ('res.partner', 'Клиенты'),
+        ('telegram.user', 'Telegram пользователи'),
+    ], string='Получатели', required=True, default='res.partner')
+    domain = fields.Char(string='Фильтр', default='[]', required=True)
+    body = fields.Text(
+        string='Текст сообщения', required=True,
+        help='Шаблон для каждого получателя, например: Здравствуйте, {{ object.partner_id.name }}!')
+    parse_mode = fields.Selection([
+        ('Markdown', 'Markdown'),
+        ('HTML', 'HTML'),
+    ], string='Разметка', required=True, default='Markdown')
+    state = fields.Selection([
+        ('draft', 'Черновик'),
+        ('running', 'Отправляется'),
+        ('done', 'Поставлена в очередь'),
+        ('cancel', 'Отменена'),
+    ], string='Статус', required=True, default='draft', index=True)
+    start_date = fields.Datetime(string='Дата запуска', readonly=True)
+    recipient_ids = fields.One2many('telegram.broadcast.recipient', 'broadcast_id', string='Получатели')
+    recipient_count = fields.Integer(string='Всего получателей', compute='_compute_progress')
+    queued_count = fields.Integer(string='В очереди', compute='_compute_progress')
+    sent_count = fields.Integer(string='Доставлено', compute='_compute_progress')
+    failed_count = fields.Integer(string='Ошибки', compute='_compute_progress')
+    progress = fields.Float(string='Прогресс (%)', compute='_compute_progress')
+
+    def _compute_progress(self):
+        counts = {}
+        for broadcast, delivery_state, count in self.env['telegram.broadcast.recipient']._read_group(
+                [('broadcast_id', 'in', self.ids)], ['broadcast_id', 'delivery_state'], ['__count']):
+            counts.setdefault(broadcast.id, {})[delivery_state] = count
+        for broadcast in self:
+            broadcast_counts = counts.get(broadcast.id, {})
+            total = sum(broadcast_counts.values())
+            broadcast.recipient_count = total
+            broadcast.queued_count = broadcast_counts.get('queued', 0)
+            broadcast.sent_count = broadcast_counts.get('sent', 0)
+            broadcast.failed_count = broadcast_counts.get('failed', 0)
+            broadcast.progress = (broadcast.sent_count + broadcast.failed_count) * 100 / total if total else 0
+
+    def _get_recipient_domain(self):
+        """Домен telegram.user для получателей рассылки"""
+        self.ensure_one()
+        domain = safe_eval(self.domain or '[]', {
+            'datetime': datetime,
+            'relativedelta': relativedelta,
+            'context_today': lambda: fields.Date.context_today(self),
+            'uid': self.env.uid,
+        })
+        if self.target_model == 'res.partner':
+            domain = [('partner_id', 'any', domain)]
+        domain = domain + [('is_verified', '=', True), ('chat_id', '!=', False)]
+        if self.bot_config_id:
+            domain.append(('bot_config_id', '=', self.bot_config_id.id))
+        return domain
+
+    def action_start(self):
+        """Зафиксировать получателей и начать рассылку"""
+        for broadcast in self:
+            if broadcast.state != 'draft':
+                raise UserError(_('Рассылка уже запущена'))
+            query = self.env['telegram.user'].sudo()._search(broadcast._get_recipient_domain())
+            self.env.cr.execute(SQL("""
+                INSERT INTO telegram_broadcast_recipient (broadcast_id, telegram_user_id, create_uid, create_date,
+                                                          write_uid, write_date)
+                SELECT %s, id, %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC'
+                  FROM telegram_user
+                 WHERE id IN %s
+            """, broadcast.id, self.env.uid, self.env.uid, query.subselect()))
+            if not self.env.cr.rowcount:
+                raise UserError(_('Нет получателей, подходящих под фильтр'))
+            # Проверить шаблон до запуска, чтобы не упасть в cron
+            first_recipient = self.env['telegram.broadcast.recipient'].search(
+                [('broadcast_id', '=', broadcast.id)], limit=1)
+            broadcast._render_body(first_recipient.telegram_user_id.ids)
+        self.write({'state': 'running', 'start_date': fields.Datetime.now()})
+        self.env.ref('telegram_bot.ir_cron_telegram_broadcast').sudo()._trigger()
+
+    def action_cancel(self):
+        """Остановить рассылку: новые сообщения не ставятся, неотправленные снимаются с очереди"""
+        self.write({'state': 'cancel'})
+        queue_items = self.env['telegram.message.queue'].sudo().search([
+            ('telegram_message_id', 'in', self.recipient_ids.message_id.ids),
+            ('state', '=', 'pending'),
+        ])
+        queue_items.write({'state': 'failed', 'last_error': _('Рассылка отменена')})
+        queue_items.telegram_message_id.write({'delivery_state': 'failed', 'delivery_error': _('Рассылка отменена')})
+
+    def action_draft(self):
+        self.recipient_ids.filtered(lambda recipient: not recipient.message_id).unlink()
+        self.write({'state': 'draft'})
+
+    def action_view_recipients(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Получатели'),
+            'res_model': 'telegram.broadcast.recipient',
+            'domain': [('broadcast_id', '=', self.id)],
+            'view_mode': 'tree',
+            'target': 'current',
+        }
+
+    def _render_body(self, telegram_user_ids):
+        """Текст сообщения для каждого получателя: {telegram_user_id: текст}"""
+        self.ensure_one()
+        try:
+            return self.env['mail.render.mixin'].sudo()._render_template(
+                self.body, 'telegram.user', telegram_user_ids, engine='inline_template')
+        except Exception as e:
+            raise UserError(_('Ошибка в шаблоне сообщения: %s') % str(e))
+
+    @api.model
+    def _cron_send(self, batch_size=BROADCAST_BATCH_SIZE, time_limit=BROADCAST_TIME_LIMIT, auto_commit=True):
+        """Ставить сообщения запущенных рассылок в очередь отправки пачками"""
+        started = time.monotonic()
+        Queue = self.env['telegram.message.queue'].sudo()
+        for broadcast in self.search([('state', '=', 'running')], order='id'):
+            while time.monotonic() - started < time_limit:
+                # Рассылку могли отменить в другой транзакции
+                broadcast.invalidate_recordset(['state'])
+                if broadcast.state != 'running':
+                    break
+                if Queue.search_count([('state', '=', 'pending')]) >= BROADCAST_QUEUE_LIMIT:
+                    # Очередь заполнена - продолжим, когда диспетчер ее разберет
+                    self.env.ref('telegram_bot.ir_cron_telegram_broadcast')._trigger(
+                        fields.Datetime.now() + timedelta(seconds=BROADCAST_RETRY_DELAY))
+                    return
+                if not broadcast._enqueue_next_batch(batch_size):
+                    broadcast.state = 'done'
+                    _logger.info(f"Рассылка Telegram «{broadcast.name}» поставлена в очередь")
+                    break
+                if auto_commit:
+                    self.env.cr.commit()
+            else:
+                self.env.ref('telegram_bot.ir_cron_telegram_broadcast')._trigger()
+                return
+            if auto_commit:
+                self.env.cr.commit()
+
+    def _enqueue_next_batch(self, batch_size):
+        """Поставить в очередь следующую пачку получателей
+
+        :return: количество поставленных сообщений (0 - получатели закончились)
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT id FROM telegram_broadcast_recipient
+             WHERE broadcast_id = %s AND message_id IS NULL
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [self.id, batch_size])
+        recipients = self.env['telegram.broadcast.recipient'].browse([row[0] for row in self.env.cr.fetchall()])
+        if not recipients:
+            return 0
+
+        users = recipients.telegram_user_id
+        bodies = self._render_body(users.ids)
+        now = fields.Datetime.now()
+        messages = self.env['telegram.message'].sudo().create([{
+            'telegram_user_id': recipient.telegram_user_id.id,
+            'message_date': now,
+            'text': bodies[recipient.telegram_user_id.id],
+            'direction': 'outgoing',
+            'delivery_state': 'queued',
+        } for recipient in recipients])
+
+        self.env.cr.execute("""
+            UPDATE telegram_broadcast_recipient recipient
+               SET message_id = linked.message_id,
+                   delivery_state = 'queued'
+              FROM (SELECT unnest(%s::int[]) AS id, unnest(%s::int[]) AS message_id) linked
+             WHERE recipient.id = linked.id
+        """, [recipients.ids, messages.ids])
+        recipients.invalidate_recordset(['message_id', 'delivery_state'])
+
+        queue_vals = []
+        for recipient, message in zip(recipients, messages):
+            user = recipient.telegram_user_id
+            bot_config = user._get_bot_config()
+            if not bot_config:
+                message.write({'delivery_state': 'failed', 'delivery_error': _('Активный бот не найден')})
+                continue
+            queue_vals.append({
+                'bot_config_id': bot_config.id,
+                'chat_id': user.chat_id,
+                'text': message.text,
+                'parse_mode': self.parse_mode,
+                'telegram_message_id': message.id,
+            })
+        self.env['telegram.message.queue']._enqueue_batch(queue_vals)
+        return len(recipients)
+
+
+class TelegramBroadcastRecipient(models.Model):
+    _name = 'telegram.broadcast.recipient'
+    _description = 'Получатель рассылки Telegram'
+    _order = 'id'
+
+    broadcast_id = fields.Many2one('telegram.broadcast', string='Рассылка', required=True, ondelete='cascade',
+                                   index=True)
+    telegram_user_id = fields.Many2one('telegram.user', string='Telegram пользователь', required=True,
+                                       ondelete='cascade')
+    partner_id = fields.Many2one(related='telegram_user_id.partner_id', string='Клиент')
+    message_id = fields.Many2one('telegram.message', string='Сообщение', ondelete='set null', index=True)
+    delivery_state = fields.Selection(related='message_id.delivery_state', store=True, string='Статус доставки')
+    delivery_error = fields.Text(related='message_id.delivery_error', string='Ошибка доставки')
+
+    _sql_constraints = [
+        ('broadcast_user_unique', 'unique(broadcast_id, telegram_user_id)', 'Получатель уже добавлен в рассылку'),
+    ]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+# Сколько символов текста сообщения передавать в событии, полный текст клиент читает сам
+INBOX_TEXT_LIMIT = 500
+INBOX_LIMIT = 50
+CONVERSATION_FIELDS = [
+    'display_name', 'partner_id', 'bot_config_id', 'unread_count', 'last_incoming_date',
+    'operator_id', 'claim_date',
+]
+MESSAGE_FIELDS = ['telegram_user_id', 'crm_lead_id', 'message_date', 'text']
+
+
+class TelegramInbox(models.AbstractModel):
+    """Входящие операторов Telegram в реальном времени
+
+    Новые входящие сообщения и изменения переписок (прочтение, назначение
+    оператора) копятся до конца транзакции и перед коммитом уходят в шину
+    одним событием 'telegram_bot/inbox' на оператора. Сообщения переписки,
+    взятой в работу, получает только ее оператор, остальные - все операторы бота.
+    После переподключения клиент догружает пропущенное через get_inbox,
+    передавая id последнего полученного сообщения.
+    """
+    _name = 'telegram.inbox'
+    _description = 'Входящие операторов Telegram'
+
+    @api.model
+    def _collect(self, telegram_users, messages=None):
+        """Добавить изменившиеся переписки и новые сообщения в событие транзакции"""
+        if not telegram_users:
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get('telegram_inbox.pending')
+        if pending is None:
+            pending = data['telegram_inbox.pending'] = {'users': set(), 'messages': set()}
+            self.env.cr.precommit.add(self._publish)
+        pending['users'].update(telegram_users.ids)
+        if messages:
+            pending['messages'].update(messages.ids)
+
+    def _publish(self):
+        pending = self.env.cr.precommit.data.pop('telegram_inbox.pending', None)
+        if not pending:
+            return
+        self.env.flush_all()
+        users = self.env['telegram.user'].sudo().browse(pending['users']).exists()
+        conversations = {conversation['id']: conversation for conversation in users.read(CONVERSATION_FIELDS)}
+        messages = self.env['telegram.message'].sudo().browse(sorted(pending['messages'])).exists()
+        message_values = self._read_messages(messages)
+
+        recipients = {}
+        for user in users:
+            operators = user.bot_config_id.operator_user_ids
+            for operator in operators:
+                event = recipients.setdefault(operator, {'conversations': [], 'messages': []})
+                event['conversations'].append(conversations[user.id])
+            # Сообщения переписки в работе видит только ее оператор
+            if user.operator_id in operators:
+                operators = user.operator_id
+            for values in message_values:
+                if values['telegram_user_id'][0] == user.id:
+                    for operator in operators:
+                        recipients[operator]['messages'].append(values)
+        if not recipients:
+            return
+
+        counters = self._get_counters(recipients)
+        self.env['bus.bus']._sendmany([
+            (operator.partner_id, 'telegram_bot/inbox', dict(event, counters=counters[operator.id]))
+            for operator, event in recipients.items()
+        ])
+
+    @api.model
+    def get_inbox(self, last_message_id=0, limit=INBOX_LIMIT):
+        """Входящие текущего оператора
+
+        :param last_message_id: id последнего сообщения, полученного клиентом;
+            при 0 возвращаются только переписки и счетчики для первой загрузки
+        :return: {'conversations': переписки с непрочитанными или в работе у оператора,
+                  'messages': входящие сообщения новее last_message_id,
+                  'last_message_id': id для следующего вызова,
+                  'counters': счетчики непрочитанных}
+        """
+        bots = self.env['telegram.bot.config'].sudo().search([('operator_user_ids', 'in', self.env.uid)])
+        available = [
+            ('bot_config_id', 'in', bots.ids),
+            '|', ('operator_id', '=', False), ('operator_id', '=', self.env.uid),
+        ]
+        TelegramUser = self.env['telegram.user'].sudo()
+        conversations = TelegramUser.search_read(
+            available + ['|', ('unread_count', '>', 0), ('operator_id', '=', self.env.uid)],
+            CONVERSATION_FIELDS, order='last_incoming_date desc', limit=limit)
+
+        Message = self.env['telegram.message'].sudo()
+        messages = []
+        if last_message_id:
+            messages = self._read_messages(Message.search([
+                ('id', '>', last_message_id),
+                ('direction', '=', 'incoming'),
+                ('telegram_user_id', 'any', available),
+            ], order='id', limit=limit))
+            last_message_id = messages[-1]['id'] if messages else last_message_id
+        else:
+            last_message_id = Message.search([], order='id desc', limit=1).id or 0
+        return {
+            'conversations': conversations,
+            'messages': messages,
+            'last_message_id': last_message_id,
+            'counters': self._get_counters([self.env.user])[self.env.uid],
+        }
+
+    @api.model
+    def _read_messages(self, messages):
+        values_list = messages.read(MESSAGE_FIELDS)
+        for values in values_list:
+            values['text'] = (values['text'] or '')[:INBOX_TEXT_LIMIT]
+        return values_list
+
+    @api.model
+    def _get_counters(self, operators):
+        """Непрочитанные операторов: {id пользователя: {'mine': в его переписках,
+        'unassigned': в переписках без оператора на его ботах}}"""
+        operator_ids = [operator.id for operator in operators]
+        counters = {operator_id: {'mine': 0, 'unassigned': 0} for operator_id in operator_ids}
+        self.env.cr.execute("""
+            SELECT rel.user_id,
+                   COALESCE(SUM(tu.unread_count) FILTER (WHERE tu.operator_id = rel.user_id), 0),
+                   COALESCE(SUM(tu.unread_count) FILTER (WHERE tu.operator_id IS NULL), 0)
+              FROM telegram_bot_operator_rel rel
+              JOIN telegram_user tu ON tu.bot_config_id = rel.bot_id AND tu.unread_count > 0
+             WHERE rel.user_id IN %s
+          GROUP BY rel.user_id
+        """, [tuple(operator_ids)])
+        for operator_id, mine, unassigned in self.env.cr.fetchall():
+            counters[operator_id] = {'mine': mine, 'unassigned': unassigned}
+        return counters
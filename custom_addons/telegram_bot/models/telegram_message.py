@@ -1,6 +1,42 @@
 # -*- coding: utf-8 -*-
 
+from markupsafe import Markup, escape
+
 from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+# Счетчики сообщений: (модель, поле сообщения, префикс колонок счетчиков)
+COUNTER_TARGETS = (
+    ('telegram.user', 'telegram_user_id', ''),
+    ('crm.lead', 'crm_lead_id', 'telegram_'),
+)
+COUNTER_FIELDS = ('message_count', 'unread_count', 'last_incoming_date', 'last_outgoing_date')
+# Изменение этих полей требует полного пересчета счетчиков затронутых записей
+COUNTER_KEY_FIELDS = {'telegram_user_id', 'crm_lead_id', 'direction', 'message_date'}
+
+# Полнотекстовый поиск. Конфигурация russian стеммит кириллицу русским стеммером,
+# а латиницу - английским, поэтому одного индекса достаточно для обоих языков
+TEXT_SEARCH_CONFIG = 'russian'
+# Маркеры совпадений в ts_headline: текст экранируется, затем маркеры заменяются на <b>
+SNIPPET_START = '\x01'
+SNIPPET_STOP = '\x02'
+SNIPPET_OPTIONS = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxFragments=2, MinWords=5, MaxWords=20'
+
+
+def text_search_vector(column):
+    """tsvector колонки; выражение должно совпадать с выражением GIN-индекса"""
+    return SQL(f"to_tsvector('{TEXT_SEARCH_CONFIG}', COALESCE(%s, ''))", column)
+
+
+def text_search_query(query):
+    """tsquery из строки пользователя (синтаксис websearch: "фраза", -слово, or)"""
+    return SQL(f"websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %s)", query)
+
+
+def highlight_snippet(snippet):
+    """HTML фрагмента ts_headline с выделенными совпадениями"""
+    return str(escape(snippet or '').replace(SNIPPET_START, Markup('<b>')).replace(SNIPPET_STOP, Markup('</b>')))
 
 
 class TelegramMessage(models.Model):
@@ -8,19 +44,291 @@ class TelegramMessage(models.Model):
     _description = 'Сообщение Telegram'
     _order = 'message_date desc, id desc'
 
-    telegram_user_id = fields.Many2one('telegram.user', string='Telegram пользователь', required=True, ondelete='cascade', index=True)
+    # Одиночные индексы по telegram_user_id и crm_lead_id не нужны: их покрывают
+    # составные индексы истории из init()
+    telegram_user_id = fields.Many2one('telegram.user', string='Telegram пользователь', required=True, ondelete='cascade')
     partner_id = fields.Many2one('res.partner', string='Клиент', related='telegram_user_id.partner_id', store=True, index=True)
-    crm_lead_id = fields.Many2one('crm.lead', string='Лид', ondelete='cascade', index=True, help='Лид, к которому относится сообщение')
+    crm_lead_id = fields.Many2one('crm.lead', string='Лид', ondelete='cascade', help='Лид, к которому относится сообщение')
     message_id = fields.Integer(string='Message ID', help='ID сообщения в Telegram')
     message_date = fields.Datetime(string='Дата сообщения', required=True, index=True)
-    text = fields.Text(string='Текст сообщения')
+    # Триграммный индекс ускоряет поиск ilike по подстроке
+    text = fields.Text(string='Текст сообщения', index='trigram')
+    text_search = fields.Char(
+        string='Поиск по словам', compute='_compute_text_search', search='_search_text_search',
+        help='Полнотекстовый поиск по тексту сообщения с учетом словоформ')
     direction = fields.Selection([
         ('incoming', 'Входящее'),
         ('outgoing', 'Исходящее'),
     ], string='Направление', required=True, default='incoming')
     user_id = fields.Many2one('res.users', string='Оператор', help='Оператор, который отправил ответ')
     is_read = fields.Boolean(string='Прочитано', default=False)
-    reply_to_message_id = fields.Many2one('telegram.message', string='Ответ на сообщение')
+    # Индекс нужен внешнему ключу при удалении и архивации сообщений
+    reply_to_message_id = fields.Many2one('telegram.message', string='Ответ на сообщение', index='btree_not_null')
+    delivery_state = fields.Selection([
+        ('queued', 'В очереди'),
+        ('sent', 'Доставлено'),
+        ('failed', 'Ошибка'),
+    ], string='Статус доставки', help='Для исходящих сообщений')
+    delivery_error = fields.Text(string='Ошибка доставки')
+
+    def init(self):
+        # История чата читается по пользователю или лиду в порядке _order:
+        # индексы отдают последние сообщения без сортировки всей переписки
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS telegram_message_user_date_idx
+                ON telegram_message (telegram_user_id, message_date DESC, id DESC)
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS telegram_message_lead_date_idx
+                ON telegram_message (crm_lead_id, message_date DESC, id DESC)
+             WHERE crm_lead_id IS NOT NULL
+        """)
+        # Индекс по выражению PostgreSQL обновляет сам при создании и изменении сообщений
+        self.env.cr.execute(SQL(
+            "CREATE INDEX IF NOT EXISTS telegram_message_text_fts_idx ON telegram_message USING gin (%s)",
+            text_search_vector(SQL.identifier('text')),
+        ))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        messages = super().create(vals_list)
+        messages._increment_counters()
+        incoming = messages.filtered(lambda m: m.direction == 'incoming')
+        self.env['telegram.inbox']._collect(incoming.telegram_user_id, incoming)
+        return messages
+
+    def write(self, vals):
+        if COUNTER_KEY_FIELDS.intersection(vals):
+            targets = self._get_counter_targets()
+            result = super().write(vals)
+            for model_name, ids in self._get_counter_targets().items():
+                targets[model_name] |= ids
+            self._recompute_counters(targets)
+            return result
+        if 'is_read' in vals:
+            # Только сообщения, у которых флаг действительно меняется
+            changed = self.filtered(lambda m: m.direction == 'incoming' and m.is_read != bool(vals['is_read']))
+            result = super().write(vals)
+            changed._increment_counters(count=0, unread_sign=-1 if vals['is_read'] else 1)
+            self.env['telegram.inbox']._collect(changed.telegram_user_id)
+            return result
+        return super().write(vals)
+
+    def unlink(self):
+        targets = self._get_counter_targets()
+        result = super().unlink()
+        self._recompute_counters(targets)
+        return result
+
+    def _get_counter_targets(self):
+        """{модель: множество id записей со счетчиками этих сообщений}"""
+        return {
+            model_name: set(self.mapped(field_name).ids)
+            for model_name, field_name, _prefix in COUNTER_TARGETS
+        }
+
+    def _increment_counters(self, count=1, unread_sign=1):
+        """Инкрементально обновить счетчики получателей одним UPDATE на таблицу
+
+        :param count: изменение общего количества на каждое сообщение
+        :param unread_sign: изменение количества непрочитанных на каждое непрочитанное входящее
+        """
+        for model_name, field_name, prefix in COUNTER_TARGETS:
+            deltas = {}
+            for message in self:
+                record_id = message[field_name].id
+                if not record_id:
+                    continue
+                delta = deltas.setdefault(record_id, [0, 0, None, None])
+                delta[0] += count
+                if message.direction == 'incoming':
+                    if not count or not message.is_read:
+                        delta[1] += unread_sign
+                    if count:
+                        delta[2] = max(filter(None, (delta[2], message.message_date)))
+                elif count:
+                    delta[3] = max(filter(None, (delta[3], message.message_date)))
+            if not deltas:
+                continue
+            Model = self.env[model_name]
+            fnames = [prefix + fname for fname in COUNTER_FIELDS]
+            Model.flush_model(fnames)
+            ids, counts, unreads, last_incoming, last_outgoing = zip(*(
+                (record_id, *delta) for record_id, delta in deltas.items()))
+            self.env.cr.execute(SQL("""
+                UPDATE %(table)s target
+                   SET %(count)s = COALESCE(target.%(count)s, 0) + delta.count,
+                       %(unread)s = COALESCE(target.%(unread)s, 0) + delta.unread,
+                       %(last_incoming)s = GREATEST(target.%(last_incoming)s, delta.last_incoming),
+                       %(last_outgoing)s = GREATEST(target.%(last_outgoing)s, delta.last_outgoing)
+                       %(extra)s
+                  FROM (SELECT unnest(%(ids)s::int[]) AS id,
+                               unnest(%(counts)s::int[]) AS count,
+                               unnest(%(unreads)s::int[]) AS unread,
+                               unnest(%(last_incomings)s::timestamp[]) AS last_incoming,
+                               unnest(%(last_outgoings)s::timestamp[]) AS last_outgoing) delta
+                 WHERE target.id = delta.id
+            """,
+                table=SQL.identifier(Model._table),
+                count=SQL.identifier(fnames[0]),
+                unread=SQL.identifier(fnames[1]),
+                last_incoming=SQL.identifier(fnames[2]),
+                last_outgoing=SQL.identifier(fnames[3]),
+                extra=SQL(
+                    ", last_message_date = GREATEST(target.last_message_date, delta.last_incoming, delta.last_outgoing)"
+                ) if model_name == 'telegram.user' else SQL(),
+                ids=list(ids), counts=list(counts), unreads=list(unreads),
+                last_incomings=list(last_incoming), last_outgoings=list(last_outgoing),
+            ))
+            Model.invalidate_model(fnames + (['last_message_date'] if model_name == 'telegram.user' else []))
+
+    @api.model
+    def _recompute_counters(self, targets=None):
+        """Пересчитать счетчики по оперативной истории сообщений
+
+        Сообщения, перенесенные в telegram.message.archive, не учитываются.
+
+        :param targets: {модель: id записей или None для всех записей модели};
+            None - все записи всех моделей (разовый пересчет)
+        """
+        self.flush_model()
+        for model_name, field_name, prefix in COUNTER_TARGETS:
+            if targets is None or targets.get(model_name, ()) is None:
+                ids = None
+            else:
+                ids = list(targets.get(model_name, ()))
+                if not ids:
+                    continue
+            Model = self.env[model_name]
+            fnames = [prefix + fname for fname in COUNTER_FIELDS]
+            table = SQL.identifier(Model._table)
+            if ids is None:
+                target_ids = SQL("SELECT id FROM %s", table)
+            else:
+                target_ids = SQL("SELECT unnest(%s::int[]) AS id", ids)
+            self.env.cr.execute(SQL("""
+                UPDATE %(table)s target
+                   SET %(count)s = COALESCE(stats.count, 0),
+                       %(unread)s = COALESCE(stats.unread, 0),
+                       %(last_incoming)s = stats.last_incoming,
+                       %(last_outgoing)s = stats.last_outgoing
+                       %(extra)s
+                  FROM (%(target_ids)s) ids
+             LEFT JOIN (
+                        SELECT %(fk)s AS id,
+                               COUNT(*) AS count,
+                               COUNT(*) FILTER (WHERE direction = 'incoming' AND NOT COALESCE(is_read, FALSE)) AS unread,
+                               MAX(message_date) FILTER (WHERE direction = 'incoming') AS last_incoming,
+                               MAX(message_date) FILTER (WHERE direction = 'outgoing') AS last_outgoing
+                          FROM telegram_message
+                         WHERE %(fk)s IN (%(target_ids)s)
+                      GROUP BY %(fk)s
+                       ) stats ON stats.id = ids.id
+                 WHERE target.id = ids.id
+                   AND (target.%(count)s IS DISTINCT FROM COALESCE(stats.count, 0)
+                        OR target.%(unread)s IS DISTINCT FROM COALESCE(stats.unread, 0)
+                        OR target.%(last_incoming)s IS DISTINCT FROM stats.last_incoming
+                        OR target.%(last_outgoing)s IS DISTINCT FROM stats.last_outgoing)
+            """,
+                table=table,
+                target_ids=target_ids,
+                fk=SQL.identifier(field_name),
+                count=SQL.identifier(fnames[0]),
+                unread=SQL.identifier(fnames[1]),
+                last_incoming=SQL.identifier(fnames[2]),
+                last_outgoing=SQL.identifier(fnames[3]),
+                extra=SQL(
+                    ", last_message_date = GREATEST(stats.last_incoming, stats.last_outgoing)"
+                ) if model_name == 'telegram.user' else SQL(),
+            ))
+            Model.invalidate_model(fnames + (['last_message_date'] if model_name == 'telegram.user' else []))
+
+    def _compute_text_search(self):
+        self.text_search = False
+
+    def _search_text_search(self, operator, value):
+        if operator not in ('ilike', 'like', '=') or not value or not isinstance(value, str):
+            return [('text', operator, value)]
+        query = self._search([])
+        query.add_where(SQL(
+            "%s @@ %s", text_search_vector(SQL.identifier(self._table, 'text')), text_search_query(value)))
+        return [('id', 'in', query)]
+
+    @api.model
+    def search_conversations(self, query, group_by='telegram.user', limit=20, include_archive=True):
+        """Найти переписки по тексту сообщений
+
+        :param query: поисковый запрос (синтаксис websearch: "фраза", -слово, or)
+        :param group_by: 'telegram.user' или 'crm.lead'
+        :param include_archive: искать также в архиве сообщений (только для telegram.user)
+        :return: переписки по убыванию релевантности, список словарей с ключами
+            id, name, rank, match_count, last_date, message_id, archive_id, snippet
+            (HTML с выделенными совпадениями)
+        """
+        field_name = {model_name: fname for model_name, fname, _prefix in COUNTER_TARGETS}[group_by]
+        if not query or not query.strip():
+            return []
+        self.env[group_by].check_access_rights('read')
+
+        column = lambda fname: SQL.identifier(self._table, fname)
+        vector = text_search_vector(column('text'))
+        tsquery = text_search_query(query)
+        messages = self._search([(field_name, '!=', False)])
+        messages.add_where(SQL("%s @@ %s", vector, tsquery))
+        # Ранг переписки - сумма рангов совпавших сообщений, фрагмент берется из лучшего
+        self.env.cr.execute(SQL("""
+            SELECT %(key)s,
+                   SUM(ts_rank(%(vector)s, %(tsquery)s)) AS rank,
+                   COUNT(*),
+                   MAX(%(date)s) AS last_date,
+                   (ARRAY_AGG(%(id)s ORDER BY ts_rank(%(vector)s, %(tsquery)s) DESC, %(date)s DESC))[1]
+              FROM %(from)s
+             WHERE %(where)s
+          GROUP BY %(key)s
+          ORDER BY rank DESC, last_date DESC
+             LIMIT %(limit)s
+        """,
+            key=column(field_name), vector=vector, tsquery=tsquery, date=column('message_date'),
+            id=column('id'), limit=limit, **{'from': messages.from_clause, 'where': messages.where_clause},
+        ))
+        results = {}
+        for record_id, rank, count, last_date, message_id in self.env.cr.fetchall():
+            results[record_id] = {
+                'id': record_id, 'rank': rank, 'match_count': count, 'last_date': last_date,
+                'message_id': message_id, 'archive_id': False,
+            }
+        snippets = self._get_snippets(
+            self._table, 'text', [result['message_id'] for result in results.values()], tsquery)
+        for result in results.values():
+            result['snippet'] = snippets.get(result['message_id'], '')
+
+        if include_archive and group_by == 'telegram.user':
+            for result in self.env['telegram.message.archive']._search_conversations(query, limit):
+                current = results.get(result['id'])
+                if current:
+                    current['rank'] += result['rank']
+                    current['match_count'] += result['match_count']
+                    current['archive_id'] = result['archive_id']
+                else:
+                    results[result['id']] = dict(result, message_id=False)
+
+        records = self.env[group_by].browse(list(results)).exists()._filter_access_rules('read')
+        names = {record.id: record.display_name for record in records}
+        conversations = [dict(result, name=names[record_id])
+                         for record_id, result in results.items() if record_id in names]
+        conversations.sort(key=lambda result: (result['rank'], result['last_date']), reverse=True)
+        return conversations[:limit]
+
+    @api.model
+    def _get_snippets(self, table, column, ids, tsquery):
+        """Фрагменты текста с выделенными совпадениями: {id записи: HTML}"""
+        if not ids:
+            return {}
+        self.env.cr.execute(SQL(
+            f"SELECT id, ts_headline('{TEXT_SEARCH_CONFIG}', %s, %s, %s) FROM %s WHERE id IN %s",
+            SQL.identifier(column), tsquery, SNIPPET_OPTIONS, SQL.identifier(table), tuple(ids),
+        ))
+        return {record_id: highlight_snippet(snippet) for record_id, snippet in self.env.cr.fetchall()}
 
     def action_send_reply(self):
         """Отправить ответ клиенту"""
@@ -53,11 +361,12 @@ class TelegramMessageWizard(models.TransientModel):
         if not self.text:
             raise UserError(_('Введите текст сообщения'))
         
-        # Отправить через Telegram API
-        self.telegram_user_id._send_telegram_message(self.text)
-        
+        # Ответ берет переписку в работу, если ее не ведет другой оператор
+        if self.telegram_user_id._claim():
+            raise UserError(_('Переписку уже ведет оператор %s') % self.telegram_user_id.sudo().operator_id.name)
+
         # Сохранить в истории
-        self.env['telegram.message'].create({
+        message = self.env['telegram.message'].create({
             'telegram_user_id': self.telegram_user_id.id,
             'crm_lead_id': self.crm_lead_id.id if self.crm_lead_id else False,
             'message_date': fields.Datetime.now(),
@@ -67,12 +376,15 @@ class TelegramMessageWizard(models.TransientModel):
             'reply_to_message_id': self.reply_to_message_id.id if self.reply_to_message_id else False,
         })
         
+        # Поставить в очередь отправки через Telegram API
+        self.telegram_user_id._send_telegram_message(self.text, message=message)
+        
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
                 'title': _('Успешно'),
-                'message': _('Сообщение отправлено'),
+                'message': _('Сообщение поставлено в очередь отправки'),
                 'type': 'success',
                 'sticky': False,
             }
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import timedelta
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .telegram_message import text_search_query, text_search_vector
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 365
+ARCHIVE_BATCH_SIZE = 10000
+ARCHIVE_TIME_LIMIT = 300
+
+
+class TelegramMessageArchive(models.Model):
+    """Архив истории сообщений Telegram
+
+    Одна строка - переписка пользователя за месяц: сообщения хранятся
+    одним jsonb-массивом (PostgreSQL сжимает его в TOAST), текст переписки -
+    отдельным полем для поиска. Старые сообщения переносятся сюда из
+    telegram.message, поэтому оперативная таблица не растет бесконечно.
+    """
+    _name = 'telegram.message.archive'
+    _description = 'Архив сообщений Telegram'
+    _order = 'period desc, id desc'
+    _rec_name = 'telegram_user_id'
+
+    telegram_user_id = fields.Many2one('telegram.user', string='Telegram пользователь', required=True,
+                                       ondelete='cascade', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Клиент', index=True, readonly=True)
+    period = fields.Date(string='Месяц', required=True, readonly=True, index=True)
+    date_from = fields.Datetime(string='Первое сообщение', readonly=True)
+    date_to = fields.Datetime(string='Последнее сообщение', readonly=True)
+    message_count = fields.Integer(string='Сообщений', readonly=True)
+    body = fields.Text(string='Текст переписки', readonly=True, index='trigram')
+    messages = fields.Json(string='Сообщения', readonly=True)
+    crm_lead_ids = fields.Many2many('crm.lead', 'telegram_message_archive_crm_lead_rel', 'archive_id', 'lead_id',
+                                    string='Лиды', readonly=True, help='Лиды, к которым относились сообщения')
+
+    _sql_constraints = [
+        ('user_period_unique', 'unique(telegram_user_id, period)', 'Архив за месяц уже существует'),
+    ]
+
+    def init(self):
+        self.env.cr.execute(SQL(
+            "CREATE INDEX IF NOT EXISTS telegram_message_archive_body_fts_idx ON telegram_message_archive USING gin (%s)",
+            text_search_vector(SQL.identifier('body')),
+        ))
+        # Архивы, созданные до связи с лидами: лиды берутся из сообщений архива
+        self.env.cr.execute("SELECT 1 FROM telegram_message_archive_crm_lead_rel LIMIT 1")
+        if not self.env.cr.fetchone():
+            self.env.cr.execute("""
+                INSERT INTO telegram_message_archive_crm_lead_rel (archive_id, lead_id)
+                SELECT DISTINCT archive.id, lead.id
+                  FROM telegram_message_archive archive,
+                       jsonb_array_elements(archive.messages) message
+                  JOIN crm_lead lead ON lead.id = (message->>'crm_lead_id')::integer
+                ON CONFLICT DO NOTHING
+            """)
+
+    @api.model
+    def _search_conversations(self, query, limit):
+        """Переписки пользователей из архива для telegram.message.search_conversations"""
+        column = lambda fname: SQL.identifier(self._table, fname)
+        vector = text_search_vector(column('body'))
+        tsquery = text_search_query(query)
+        archives = self._search([])
+        archives.add_where(SQL("%s @@ %s", vector, tsquery))
+        self.env.cr.execute(SQL("""
+            SELECT %(key)s,
+                   SUM(ts_rank(%(vector)s, %(tsquery)s)) AS rank,
+                   COUNT(*),
+                   MAX(%(date)s) AS last_date,
+                   (ARRAY_AGG(%(id)s ORDER BY ts_rank(%(vector)s, %(tsquery)s) DESC, %(date)s DESC))[1]
+              FROM %(from)s
+             WHERE %(where)s
+          GROUP BY %(key)s
+          ORDER BY rank DESC, last_date DESC
+             LIMIT %(limit)s
+        """,
+            key=column('telegram_user_id'), vector=vector, tsquery=tsquery, date=column('date_to'),
+            id=column('id'), limit=limit, **{'from': archives.from_clause, 'where': archives.where_clause},
+        ))
+        results = [{
+            'id': user_id, 'rank': rank, 'match_count': count, 'last_date': last_date, 'archive_id': archive_id,
+        } for user_id, rank, count, last_date, archive_id in self.env.cr.fetchall()]
+        snippets = self.env['telegram.message']._get_snippets(
+            self._table, 'body', [result['archive_id'] for result in results], tsquery)
+        for result in results:
+            result['snippet'] = snippets.get(result['archive_id'], '')
+        return results
+
+    @api.model
+    def _cron_archive(self, batch_size=ARCHIVE_BATCH_SIZE, time_limit=ARCHIVE_TIME_LIMIT, auto_commit=True):
+        """Перенести в архив сообщения старше срока хранения
+
+        Непрочитанные входящие и еще не отправленные исходящие остаются в истории.
+        Срок хранения в днях - системный параметр telegram_bot.message_retention_days.
+        """
+        retention_days = int(self.env['ir.config_parameter'].sudo().get_param(
+            'telegram_bot.message_retention_days', DEFAULT_RETENTION_DAYS))
+        if retention_days <= 0:
+            return
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        Message = self.env['telegram.message']
+        started = time.monotonic()
+        archived = 0
+        while time.monotonic() - started < time_limit:
+            Message.flush_model()
+            self.flush_model()
+            self.env.cr.execute("""
+                WITH moved AS (
+                    DELETE FROM telegram_message
+                     WHERE id IN (
+                            SELECT id FROM telegram_message
+                             WHERE message_date < %s
+                               AND (direction = 'outgoing' OR is_read)
+                               AND COALESCE(delivery_state, 'sent') != 'queued'
+                             LIMIT %s
+                           )
+                 RETURNING *
+                ), archived AS (
+                    INSERT INTO telegram_message_archive (telegram_user_id, partner_id, period, date_from, date_to,
+                                                          message_count, body, messages, create_date, write_date)
+                    SELECT telegram_user_id,
+                           MAX(partner_id),
+                           date_trunc('month', message_date)::date,
+                           MIN(message_date),
+                           MAX(message_date),
+                           COUNT(*),
+                           string_agg(text, E'\\n' ORDER BY message_date, id),
+                           jsonb_agg(jsonb_build_object(
+                               'id', id,
+                               'date', message_date,
+                               'direction', direction,
+                               'text', text,
+                               'crm_lead_id', crm_lead_id,
+                               'user_id', user_id,
+                               'message_id', message_id
+                           ) ORDER BY message_date, id),
+                           NOW() AT TIME ZONE 'UTC',
+                           NOW() AT TIME ZONE 'UTC'
+                      FROM moved
+                  GROUP BY telegram_user_id, date_trunc('month', message_date)
+                    ON CONFLICT (telegram_user_id, period) DO UPDATE
+                       SET date_from = LEAST(telegram_message_archive.date_from, EXCLUDED.date_from),
+                           date_to = GREATEST(telegram_message_archive.date_to, EXCLUDED.date_to),
+                           message_count = telegram_message_archive.message_count + EXCLUDED.message_count,
+                           body = concat_ws(E'\\n', telegram_message_archive.body, EXCLUDED.body),
+                           messages = telegram_message_archive.messages || EXCLUDED.messages,
+                           write_date = EXCLUDED.write_date
+                 RETURNING id, telegram_user_id, period
+                ), linked AS (
+                    INSERT INTO telegram_message_archive_crm_lead_rel (archive_id, lead_id)
+                    SELECT DISTINCT archived.id, moved.crm_lead_id
+                      FROM moved
+                      JOIN archived ON archived.telegram_user_id = moved.telegram_user_id
+                                   AND archived.period = date_trunc('month', moved.message_date)::date
+                     WHERE moved.crm_lead_id IS NOT NULL
+                    ON CONFLICT DO NOTHING
+                )
+                SELECT array_agg(DISTINCT telegram_user_id), array_agg(DISTINCT crm_lead_id), COUNT(*)
+                  FROM moved
+            """, [cutoff, batch_size])
+            user_ids, lead_ids, count = self.env.cr.fetchone()
+            if not count:
+                break
+            Message.invalidate_model()
+            self.invalidate_model()
+            self.env['crm.lead'].invalidate_model(['telegram_archive_ids'])
+            # Счетчики отражают только оперативную историю, архив лида - crm.lead.telegram_archive_ids
+            Message._recompute_counters({
+                'telegram.user': user_ids,
+                'crm.lead': [lead_id for lead_id in lead_ids if lead_id],
+            })
+            archived += count
+            if auto_commit:
+                self.env.cr.commit()
+        if archived:
+            _logger.info(f"Telegram: в архив перенесено сообщений {archived}")
+
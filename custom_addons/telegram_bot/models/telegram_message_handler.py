@@ -6,135 +6,245 @@ from odoo import fields, api
 
 _logger = logging.getLogger(__name__)
 
+# Заказов на одной странице ответа на /orders
+ORDERS_PAGE_SIZE = 5
+
 
 class TelegramMessageHandler:
     """Класс для обработки сообщений Telegram (используется и в webhook, и в long polling)"""
     
     @staticmethod
     def process_message(bot_config, message_data, env):
-        """Обработать входящее сообщение"""
+        """Обработать входящее сообщение (ошибка записывается в лог)"""
         try:
-            chat_id = message_data.get('chat', {}).get('id')
-            user_data = message_data.get('from', {})
-            telegram_id = user_data.get('id')
-            text = message_data.get('text', '')
-            message_id = message_data.get('message_id')
-            message_date = message_data.get('date')
-            
-            if not telegram_id or not chat_id:
-                return
-            
-            # Найти или создать Telegram пользователя
-            telegram_user = env['telegram.user'].sudo().search([
-                ('telegram_id', '=', telegram_id)
-            ], limit=1)
+            TelegramMessageHandler._process_message(bot_config, message_data, env)
+        except Exception as e:
+            _logger.error(f"Ошибка обработки сообщения: {str(e)}", exc_info=True)
+
+    @staticmethod
+    def _process_message(bot_config, message_data, env):
+        """Обработать входящее сообщение
+
+        Исключения передаются вызывающему: пакетная обработка откатывает
+        точку сохранения обновления и возвращает ошибку.
+        """
+        chat_id = message_data.get('chat', {}).get('id')
+        user_data = message_data.get('from', {})
+        telegram_id = user_data.get('id')
+        text = message_data.get('text', '')
+        message_id = message_data.get('message_id')
+        message_date = message_data.get('date')
+        
+        if not telegram_id or not chat_id:
+            return
+        
+        # Найти Telegram пользователя (кеш воркера) или создать нового
+        cached_user = env['telegram.user']._get_cached_user(bot_config.id, telegram_id)
+        
+        if not cached_user:
+            # Создать нового пользователя (пока не верифицирован)
+            telegram_user = env['telegram.user'].sudo().create({
+                'bot_config_id': bot_config.id,
+                'telegram_id': telegram_id,
+                'username': user_data.get('username'),
+                'first_name': user_data.get('first_name'),
+                'last_name': user_data.get('last_name'),
+                'chat_id': chat_id,
+            })
             
-            if not telegram_user:
-                # Создать нового пользователя (пока не верифицирован)
-                telegram_user = env['telegram.user'].sudo().create({
-                    'telegram_id': telegram_id,
-                    'username': user_data.get('username'),
-                    'first_name': user_data.get('first_name'),
-                    'last_name': user_data.get('last_name'),
-                    'chat_id': chat_id,
-                })
-                
-                # Отправить приветственное сообщение с инструкцией
-                TelegramMessageHandler._send_message(
-                    bot_config.bot_token,
-                    chat_id,
-                    (
-                        "👋 Добро пожаловать!\n\n"
-                        "Для идентификации введите ваш код верификации.\n"
-                        "Если у вас нет кода, обратитесь к менеджеру.\n\n"
-                        f"Ваш код верификации: **{telegram_user.verification_code}**\n\n"
-                        "Введите этот код в системе Odoo для завершения идентификации."
-                    )
+            # Отправить приветственное сообщение с инструкцией
+            TelegramMessageHandler._send_message(
+                bot_config,
+                chat_id,
+                (
+                    "👋 Добро пожаловать!\n\n"
+                    "Для идентификации введите ваш код верификации.\n"
+                    "Если у вас нет кода, обратитесь к менеджеру.\n\n"
+                    f"Ваш код верификации: **{telegram_user.verification_code}**\n\n"
+                    "Введите этот код в системе Odoo для завершения идентификации."
                 )
-                return
-            
-            # Обновить chat_id если изменился
-            if telegram_user.chat_id != chat_id:
-                telegram_user.sudo().write({'chat_id': chat_id})
-            
-            # Обработать команды
-            if text.startswith('/'):
-                TelegramMessageHandler._process_command(bot_config, telegram_user, text, env)
-                return
-            
-            # Если пользователь не верифицирован, проверить код верификации
-            if not telegram_user.is_verified:
-                # Проверить, не является ли текст кодом верификации (6 цифр)
-                if text.strip().isdigit() and len(text.strip()) == 6:
-                    if text.strip() == telegram_user.verification_code:
-                        # Верифицировать пользователя
-                        telegram_user.sudo().write({
-                            'is_verified': True,
-                            'verified_date': fields.Datetime.now(),
-                        })
-                        # Перечитать запись для получения актуальных данных
-                        telegram_user = env['telegram.user'].sudo().browse(telegram_user.id)
-                        TelegramMessageHandler._send_message(
-                            bot_config.bot_token,
-                            chat_id,
-                            (
-                                f"✅ Вы успешно идентифицированы как {telegram_user.partner_id.name}.\n\n"
-                                "Теперь вы будете получать уведомления об изменении статуса ваших заказов.\n\n"
-                                "Доступные команды:\n"
-                                "/orders - список ваших заказов\n"
-                                "/help - помощь"
-                            )
-                        )
-                        return
-                    else:
-                        TelegramMessageHandler._send_message(
-                            bot_config.bot_token,
-                            chat_id,
-                            "❌ Неверный код верификации. Попробуйте еще раз."
-                        )
-                        return
-                else:
+            )
+            return
+        
+        user_id, partner_id, cached_chat_id, is_verified = cached_user
+        telegram_user = env['telegram.user'].sudo().browse(user_id)
+        
+        # Обновить chat_id если изменился
+        if cached_chat_id != chat_id:
+            telegram_user.write({'chat_id': chat_id})
+        
+        # Обработать команды
+        if text.startswith('/'):
+            TelegramMessageHandler._process_command(bot_config, telegram_user, text, env)
+            return
+        
+        # Если пользователь не верифицирован, проверить код верификации
+        if not is_verified:
+            # Проверить, не является ли текст кодом верификации (6 цифр)
+            if text.strip().isdigit() and len(text.strip()) == 6:
+                if text.strip() == telegram_user.verification_code:
+                    # Верифицировать пользователя
+                    telegram_user.sudo().write({
+                        'is_verified': True,
+                        'verified_date': fields.Datetime.now(),
+                    })
+                    # Перечитать запись для получения актуальных данных
+                    telegram_user = env['telegram.user'].sudo().browse(telegram_user.id)
                     TelegramMessageHandler._send_message(
-                        bot_config.bot_token,
+                        bot_config,
                         chat_id,
                         (
-                            "⚠️ Вы еще не идентифицированы.\n\n"
-                            f"Ваш код верификации: **{telegram_user.verification_code}**\n\n"
-                            "Введите этот 6-значный код для завершения идентификации."
+                            f"✅ Вы успешно идентифицированы как {telegram_user.partner_id.name}.\n\n"
+                            "Теперь вы будете получать уведомления об изменении статуса ваших заказов.\n\n"
+                            "Доступные команды:\n"
+                            "/orders - список ваших заказов\n"
+                            "/help - помощь"
                         )
                     )
                     return
-            
-            # Сохранить сообщение в истории
-            message_date_dt = datetime.fromtimestamp(message_date) if message_date else datetime.now()
-            
-            # Найти лид по партнеру (берем первый активный лид)
-            crm_lead_id = False
-            if telegram_user.partner_id:
-                lead = env['crm.lead'].sudo().search([
-                    ('partner_id', '=', telegram_user.partner_id.id),
+                else:
+                    TelegramMessageHandler._send_message(
+                        bot_config,
+                        chat_id,
+                        "❌ Неверный код верификации. Попробуйте еще раз."
+                    )
+                    return
+            else:
+                TelegramMessageHandler._send_message(
+                    bot_config,
+                    chat_id,
+                    (
+                        "⚠️ Вы еще не идентифицированы.\n\n"
+                        f"Ваш код верификации: **{telegram_user.verification_code}**\n\n"
+                        "Введите этот 6-значный код для завершения идентификации."
+                    )
+                )
+                return
+        
+        # Сохранить сообщение в истории
+        message_date_dt = datetime.fromtimestamp(message_date) if message_date else datetime.now()
+        
+        # Найти лид по партнеру (берем первый активный лид)
+        crm_lead_id = False
+        if partner_id:
+            lead = env['crm.lead'].sudo().search([
+                ('partner_id', '=', partner_id),
+                ('active', '=', True),
+            ], order='create_date desc', limit=1)
+            if lead:
+                crm_lead_id = lead.id
+                # Если у лида еще не привязан Telegram пользователь, привязать
+                if not lead.telegram_user_id:
+                    lead.sudo().write({'telegram_user_id': telegram_user.id})
+        
+        # Операторов уведомляет telegram.inbox при создании сообщения
+        env['telegram.message'].sudo().create({
+            'telegram_user_id': telegram_user.id,
+            'crm_lead_id': crm_lead_id,
+            'message_id': message_id,
+            'message_date': message_date_dt,
+            'text': text,
+            'direction': 'incoming',
+        })
+
+    @staticmethod
+    def process_updates_batch(bot_config, updates, env):
+        """Обработать пачку обновлений одного бота
+
+        Пользователи и их лиды выбираются одним запросом на пачку, входящие
+        сообщения верифицированных пользователей создаются одним create.
+        Команды, новые и неверифицированные пользователи и callback
+        обрабатываются по одному, каждое обновление в своей точке сохранения.
+
+        :return: {update_id: текст ошибки} для необработанных обновлений
+        """
+        errors = {}
+        TelegramUser = env['telegram.user'].sudo()
+        telegram_ids = {
+            update['message'].get('from', {}).get('id') for update in updates if 'message' in update
+        } - {None}
+        # Известные пользователи берутся из кеша воркера, в базу идут только новые
+        users = {}
+        for telegram_id in telegram_ids:
+            cached_user = TelegramUser._get_cached_user(bot_config.id, telegram_id)
+            if cached_user:
+                users[telegram_id] = cached_user
+        lead_partner_ids = {cached_user[1] for cached_user in users.values()}
+        leads = {}
+        for lead in env['crm.lead'].sudo().search_fetch([
+            ('partner_id', 'in', list(lead_partner_ids)),
+            ('active', '=', True),
+        ], ['partner_id', 'telegram_user_id'], order='create_date desc'):
+            leads.setdefault(lead.partner_id.id, lead)
+
+        def get_lead(partner_id):
+            if partner_id not in lead_partner_ids:
+                # Пользователь появился или сменил партнера внутри пачки
+                lead_partner_ids.add(partner_id)
+                leads[partner_id] = env['crm.lead'].sudo().search([
+                    ('partner_id', '=', partner_id),
                     ('active', '=', True),
                 ], order='create_date desc', limit=1)
-                if lead:
-                    crm_lead_id = lead.id
-                    # Если у лида еще не привязан Telegram пользователь, привязать
-                    if not lead.telegram_user_id:
-                        lead.sudo().write({'telegram_user_id': telegram_user.id})
-            
-            env['telegram.message'].sudo().create({
+            return leads.get(partner_id)
+
+        message_vals = []
+        message_update_ids = []
+        for update in updates:
+            update_id = update.get('update_id')
+            message_data = update.get('message')
+            telegram_id = message_data and message_data.get('from', {}).get('id')
+            chat_id = message_data and message_data.get('chat', {}).get('id')
+            text = message_data and message_data.get('text', '') or ''
+            cached_user = users.get(telegram_id)
+
+            if not (cached_user and cached_user[3] and chat_id and not text.startswith('/')):
+                try:
+                    with env.cr.savepoint():
+                        if message_data:
+                            TelegramMessageHandler._process_message(bot_config, message_data, env)
+                        elif 'callback_query' in update:
+                            TelegramMessageHandler._process_callback_query(bot_config, update['callback_query'], env)
+                except Exception as e:
+                    _logger.error(f"Ошибка обработки обновления {update_id}: {str(e)}", exc_info=True)
+                    errors[update_id] = str(e)
+                if telegram_id:
+                    # Пользователь мог быть создан или верифицирован
+                    users[telegram_id] = TelegramUser._get_cached_user(bot_config.id, telegram_id)
+                continue
+
+            user_id, partner_id, cached_chat_id, verified = cached_user
+            telegram_user = TelegramUser.browse(user_id)
+            if cached_chat_id != chat_id:
+                telegram_user.write({'chat_id': chat_id})
+                users[telegram_id] = (user_id, partner_id, chat_id, verified)
+            lead = get_lead(partner_id)
+            if lead and not lead.telegram_user_id:
+                lead.write({'telegram_user_id': telegram_user.id})
+            message_date = message_data.get('date')
+            message_vals.append({
                 'telegram_user_id': telegram_user.id,
-                'crm_lead_id': crm_lead_id,
-                'message_id': message_id,
-                'message_date': message_date_dt,
+                'crm_lead_id': lead.id if lead else False,
+                'message_id': message_data.get('message_id'),
+                'message_date': datetime.fromtimestamp(message_date) if message_date else datetime.now(),
                 'text': text,
                 'direction': 'incoming',
             })
-            
-            # Уведомить операторов
-            TelegramMessageHandler._notify_operators(bot_config, telegram_user, text, env)
-            
-        except Exception as e:
-            _logger.error(f"Ошибка обработки сообщения: {str(e)}", exc_info=True)
+            message_update_ids.append(update_id)
+
+        if message_vals:
+            try:
+                with env.cr.savepoint():
+                    env['telegram.message'].sudo().create(message_vals)
+            except Exception:
+                # По одному, чтобы ошибка в одном сообщении не отменила остальные
+                for update_id, vals in zip(message_update_ids, message_vals):
+                    try:
+                        with env.cr.savepoint():
+                            env['telegram.message'].sudo().create(vals)
+                    except Exception as e:
+                        _logger.error(f"Ошибка обработки обновления {update_id}: {str(e)}", exc_info=True)
+                        errors[update_id] = str(e)
+        return errors
 
     @staticmethod
     def _process_command(bot_config, telegram_user, text, env):
@@ -157,38 +267,15 @@ class TelegramMessageHandler:
                     f"Ваш код верификации: **{telegram_user.verification_code}**\n\n"
                     "Введите этот код в системе Odoo для завершения идентификации."
                 )
-            TelegramMessageHandler._send_message(bot_config.bot_token, chat_id, message)
+            TelegramMessageHandler._send_message(bot_config, chat_id, message)
             
         elif command == '/orders':
             if not telegram_user.is_verified:
-                TelegramMessageHandler._send_message(bot_config.bot_token, chat_id, "⚠️ Вы не идентифицированы.")
-                return
-            
-            # Получить заказы клиента
-            orders = env['sale.order'].sudo().search([
-                ('partner_id', '=', telegram_user.partner_id.id),
-                ('state', '!=', 'cancel')
-            ], limit=10, order='date_order desc')
-            
-            if not orders:
-                TelegramMessageHandler._send_message(bot_config.bot_token, chat_id, "У вас пока нет заказов.")
+                TelegramMessageHandler._send_message(bot_config, chat_id, "⚠️ Вы не идентифицированы.")
                 return
             
-            message_parts = ["📦 Ваши заказы:\n"]
-            for order in orders:
-                state_names = {
-                    'draft': 'Черновик',
-                    'sent': 'Отправлено',
-                    'sale': 'Подтверждено',
-                    'cancel': 'Отменено',
-                }
-                state_name = state_names.get(order.state, order.state)
-                message_parts.append(
-                    f"• {order.name} - {state_name}\n"
-                    f"  Сумма: {order.currency_id.symbol} {order.amount_total:.2f}"
-                )
-            
-            TelegramMessageHandler._send_message(bot_config.bot_token, chat_id, '\n'.join(message_parts))
+            text, reply_markup = TelegramMessageHandler._render_orders_page(telegram_user.partner_id, 0)
+            TelegramMessageHandler._send_message(bot_config, chat_id, text, reply_markup=reply_markup)
             
         elif command == '/help':
             message = (
@@ -198,41 +285,87 @@ class TelegramMessageHandler:
                 "/help - эта справка\n\n"
                 "Вы также можете написать сообщение оператору."
             )
-            TelegramMessageHandler._send_message(bot_config.bot_token, chat_id, message)
+            TelegramMessageHandler._send_message(bot_config, chat_id, message)
 
     @staticmethod
     def _process_callback_query(bot_config, callback_data, env):
-        """Обработать callback query (нажатие на кнопку)"""
-        # Можно добавить обработку кнопок в будущем
-        pass
+        """Обработать callback query (нажатие на кнопку)
+
+        Кнопки листания списка заказов (orders:<страница>) редактируют
+        исходное сообщение бота.
+        """
+        TelegramMessageHandler._answer_callback_query(bot_config, callback_data, env)
+        data = callback_data.get('data') or ''
+        message = callback_data.get('message') or {}
+        chat_id = message.get('chat', {}).get('id')
+        if not data.startswith('orders:') or not chat_id or not message.get('message_id'):
+            return
+        try:
+            page = int(data.split(':', 1)[1])
+        except ValueError:
+            return
+
+        cached_user = env['telegram.user']._get_cached_user(bot_config.id, callback_data.get('from', {}).get('id'))
+        if not cached_user or not cached_user[3]:
+            return
+        partner = env['res.partner'].sudo().browse(cached_user[1])
+        text, reply_markup = TelegramMessageHandler._render_orders_page(partner, page)
+        env['telegram.message.queue']._enqueue(
+            bot_config, chat_id, text, method='editMessageText',
+            extra_params={'message_id': message['message_id'], 'reply_markup': reply_markup or {'inline_keyboard': []}})
 
     @staticmethod
-    def _notify_operators(bot_config, telegram_user, text, env):
-        """Уведомить операторов о новом сообщении от клиента"""
-        if not bot_config.operator_user_ids:
+    def _answer_callback_query(bot_config, callback_data, env):
+        """Подтвердить нажатие кнопки, чтобы Telegram убрал индикатор загрузки
+
+        Ответ отправляет диспетчер очереди после коммита, а не HTTP-вызов внутри транзакции.
+        """
+        chat_id = (callback_data.get('message') or {}).get('chat', {}).get('id')
+        if not callback_data.get('id') or not chat_id:
             return
-        
-        # Здесь можно добавить уведомление операторов через Odoo
-        # Например, создать задачу или отправить email
-        pass
+        env['telegram.message.queue']._enqueue(
+            bot_config, chat_id, False, parse_mode=False, method='answerCallbackQuery',
+            extra_params={'callback_query_id': callback_data['id']})
 
     @staticmethod
-    def _send_message(bot_token, chat_id, text, parse_mode='Markdown'):
-        """Отправить сообщение в Telegram"""
-        import requests
+    def _render_orders_page(partner, page):
+        """Текст и клавиатура страницы списка заказов из сводки клиента (telegram.order.summary)
+
+        :return: (текст, reply_markup или None, если страница одна)
+        """
+        summary = partner.env['telegram.order.summary'].sudo()._get(partner)
+        orders = summary['orders']
+        if not orders:
+            return "У вас пока нет заказов.", None
+
+        pages = (len(orders) + ORDERS_PAGE_SIZE - 1) // ORDERS_PAGE_SIZE
+        # Кнопка могла остаться от более длинного списка
+        if not 0 <= page < pages:
+            page = 0
+        message_parts = [f"📦 Ваши заказы ({summary['total']}):\n"]
+        for name, state_name, amount in orders[page * ORDERS_PAGE_SIZE:(page + 1) * ORDERS_PAGE_SIZE]:
+            message_parts.append(f"• {name} - {state_name}\n  Сумма: {amount}")
+        if page == pages - 1 and summary['total'] > len(orders):
+            message_parts.append(f"\nПоказаны последние {len(orders)} заказов")
+        if pages == 1:
+            return '\n'.join(message_parts), None
+
+        buttons = []
+        if page > 0:
+            buttons.append({'text': '◀️', 'callback_data': f'orders:{page - 1}'})
+        # Номер страницы - кнопка без действия
+        buttons.append({'text': f'{page + 1}/{pages}', 'callback_data': 'noop'})
+        if page < pages - 1:
+            buttons.append({'text': '▶️', 'callback_data': f'orders:{page + 1}'})
+        return '\n'.join(message_parts), {'inline_keyboard': [buttons]}
+
+    @staticmethod
+    def _send_message(bot_config, chat_id, text, parse_mode='Markdown', reply_markup=None):
+        """Поставить ответ бота в очередь отправки в Telegram"""
         try:
-            response = requests.post(
-                f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                json={
-                    'chat_id': chat_id,
-                    'text': text,
-                    'parse_mode': parse_mode,
-                },
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
+            return bot_config.env['telegram.message.queue']._enqueue(
+                bot_config, chat_id, text, parse_mode,
+                extra_params={'reply_markup': reply_markup} if reply_markup else None)
         except Exception as e:
-            _logger.error(f"Ошибка отправки сообщения в Telegram: {str(e)}")
+            _logger.error(f"Ошибка постановки сообщения в очередь Telegram: {str(e)}")
             return None
-
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+from .telegram_bot_api import TelegramApiError
+
+_logger = logging.getLogger(__name__)
+
+# Ограничения Telegram Bot API: ~30 сообщений в секунду на бота и 1 в секунду в один чат
+GLOBAL_RATE_LIMIT = 30
+PER_CHAT_INTERVAL = 1.0
+# Задержки между повторными попытками (секунды), после последней - ошибка доставки
+RETRY_DELAYS = (10, 30, 120, 600, 1800)
+DISPATCH_BATCH_SIZE = 100
+DISPATCH_TIME_LIMIT = 50
+# Методы, которые отправляют сообщение в чат: только к ним относятся text/parse_mode
+# и ограничение частоты на чат (answerCallbackQuery и т.п. передают только extra_params)
+MESSAGE_METHODS = ('sendMessage', 'editMessageText')
+
+
+class TelegramMessageQueue(models.Model):
+    """Очередь исходящих сообщений Telegram
+
+    Записи создаются в той же транзакции, что и бизнес-операция, поэтому
+    отправляются только после ее коммита. Отправку выполняет cron-диспетчер,
+    лимиты Telegram учитываются отдельно для каждого бота.
+    """
+    _name = 'telegram.message.queue'
+    _description = 'Очередь исходящих сообщений Telegram'
+    _order = 'id'
+
+    bot_config_id = fields.Many2one('telegram.bot.config', string='Бот', required=True, ondelete='cascade')
+    chat_id = fields.Integer(string='Chat ID', required=True)
+    telegram_message_id = fields.Many2one('telegram.message', string='Сообщение', ondelete='set null', index=True)
+    text = fields.Text(string='Текст сообщения', help='Для sendMessage и editMessageText')
+    parse_mode = fields.Char(string='Режим разметки', default='Markdown')
+    method = fields.Char(string='Метод Bot API', required=True, default='sendMessage',
+                         help='sendMessage, editMessageText (листание списков кнопками) или answerCallbackQuery')
+    extra_params = fields.Json(string='Дополнительные параметры', help='reply_markup, message_id и т.п.')
+    state = fields.Selection([
+        ('pending', 'В очереди'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Ошибка'),
+    ], string='Статус', required=True, default='pending', index=True)
+    attempt_count = fields.Integer(string='Попыток', default=0)
+    next_attempt_date = fields.Datetime(string='Следующая попытка', default=fields.Datetime.now, index=True)
+    sent_date = fields.Datetime(string='Дата отправки')
+    last_error = fields.Text(string='Последняя ошибка')
+
+    @api.model
+    def _enqueue(self, bot_config, chat_id, text, parse_mode='Markdown', message=None,
+                 method='sendMessage', extra_params=None):
+        """Поставить сообщение в очередь и разбудить диспетчер после коммита
+
+        :param extra_params: дополнительные параметры вызова Bot API (reply_markup, message_id)
+        """
+        item = self.sudo().create({
+            'bot_config_id': bot_config.id,
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': parse_mode,
+            'telegram_message_id': message.id if message else False,
+            'method': method,
+            'extra_params': extra_params or False,
+        })
+        if message:
+            message.sudo().write({'delivery_state': 'queued'})
+        self._trigger_dispatch()
+        return item
+
+    @api.model
+    def _enqueue_batch(self, vals_list):
+        """Поставить в очередь много сообщений одним create (рассылки)
+
+        :param vals_list: значения для create, telegram_message_id обязателен
+        """
+        items = self.sudo().create(vals_list)
+        items.telegram_message_id.filtered(lambda m: m.delivery_state != 'queued').write({'delivery_state': 'queued'})
+        self._trigger_dispatch()
+        return items
+
+    @api.model
+    def _trigger_dispatch(self):
+        """Разбудить диспетчер один раз за транзакцию, сколько бы сообщений в ней ни было поставлено"""
+        precommit = self.env.cr.precommit
+        if not precommit.data.get('telegram_message_queue.trigger'):
+            precommit.data['telegram_message_queue.trigger'] = True
+            precommit.add(self.env.ref('telegram_bot.ir_cron_telegram_dispatch_queue').sudo()._trigger)
+
+    @api.model
+    def _cron_dispatch(self, batch_size=DISPATCH_BATCH_SIZE, time_limit=DISPATCH_TIME_LIMIT, auto_commit=True):
+        """Отправить сообщения из очереди пачками с учетом ограничений Telegram"""
+        started = time.monotonic()
+        chat_last_sent = {}
+        bot_last_sent = {}
+        # Ближайшая попытка сообщений, отложенных в этом запуске из-за лимита на чат
+        deferred_until = None
+        while time.monotonic() - started < time_limit:
+            # Сообщения разных ботов чередуются, чтобы очередь одного бота не задерживала
+            # остальных; SKIP LOCKED позволяет нескольким диспетчерам работать параллельно
+            self.env.cr.execute("""
+                SELECT q.id
+                  FROM telegram_message_queue q
+                  JOIN (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY bot_config_id ORDER BY id) AS position
+                          FROM telegram_message_queue
+                         WHERE state = 'pending' AND next_attempt_date <= %s
+                       ) pending ON pending.id = q.id
+                 WHERE pending.position <= %s
+              ORDER BY pending.position, q.bot_config_id
+                 LIMIT %s
+                   FOR UPDATE OF q SKIP LOCKED
+            """, [fields.Datetime.now(), batch_size, batch_size])
+            items = self.browse([row[0] for row in self.env.cr.fetchall()])
+            if not items:
+                if not deferred_until:
+                    break
+                # Дождаться отложенных сообщений, если они успевают в лимит времени запуска
+                wait = (deferred_until - fields.Datetime.now()).total_seconds()
+                deferred_until = None
+                if wait >= time_limit - (time.monotonic() - started):
+                    break
+                if auto_commit:
+                    self.env.cr.commit()
+                time.sleep(max(wait, 0))
+                continue
+            for item in items:
+                chat_key = (item.bot_config_id.id, item.chat_id)
+                is_message = item.method in MESSAGE_METHODS
+                if is_message and time.monotonic() - chat_last_sent.get(chat_key, 0) < PER_CHAT_INTERVAL:
+                    item.next_attempt_date = fields.Datetime.now() + timedelta(seconds=PER_CHAT_INTERVAL)
+                    deferred_until = min(deferred_until or item.next_attempt_date, item.next_attempt_date)
+                    continue
+                wait = bot_last_sent.get(item.bot_config_id.id, 0) + 1.0 / GLOBAL_RATE_LIMIT - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    # Ошибка одного сообщения не откатывает статусы уже отправленных в пачке
+                    with self.env.cr.savepoint():
+                        item._deliver()
+                except Exception as e:
+                    _logger.error(f"Ошибка отправки сообщения очереди {item.id}: {str(e)}", exc_info=True)
+                    item.attempt_count += 1
+                    item._mark_retry(str(e))
+                bot_last_sent[item.bot_config_id.id] = time.monotonic()
+                if is_message:
+                    chat_last_sent[chat_key] = bot_last_sent[item.bot_config_id.id]
+            if auto_commit:
+                self.env.cr.commit()
+        self._schedule_next_dispatch()
+
+    def _schedule_next_dispatch(self):
+        """Запланировать запуск диспетчера к ближайшей отложенной попытке"""
+        next_item = self.search([('state', '=', 'pending')], order='next_attempt_date', limit=1)
+        if next_item:
+            self.env.ref('telegram_bot.ir_cron_telegram_dispatch_queue')._trigger(
+                max(next_item.next_attempt_date, fields.Datetime.now()))
+
+    def _deliver(self):
+        """Отправить одно сообщение и записать результат"""
+        self.ensure_one()
+        self.attempt_count += 1
+        try:
+            result = self.bot_config_id._get_api().call(self.method or 'sendMessage', self._get_payload())
+        except TelegramApiError as e:
+            if e.status_code == 429:
+                self._mark_retry(e.description, e.retry_after)
+            elif e.status_code and 400 <= e.status_code < 500:
+                # Неверный chat_id, бот заблокирован и т.п. - повтор не поможет
+                self._mark_failed(e.description)
+            else:
+                self._mark_retry(e.description)
+            return
+        self._mark_sent(result.get('message_id') if isinstance(result, dict) else None)
+
+    def _get_payload(self):
+        """Параметры вызова Bot API"""
+        payload = {}
+        if (self.method or 'sendMessage') in MESSAGE_METHODS:
+            payload.update(chat_id=self.chat_id, text=self.text, parse_mode=self.parse_mode)
+        payload.update(self.extra_params or {})
+        return payload
+
+    def _mark_sent(self, telegram_message_id=None):
+        self.write({
+            'state': 'sent',
+            'sent_date': fields.Datetime.now(),
+            'last_error': False,
+        })
+        if self.telegram_message_id:
+            vals = {'delivery_state': 'sent', 'delivery_error': False}
+            if telegram_message_id:
+                vals['message_id'] = telegram_message_id
+            self.telegram_message_id.write(vals)
+
+    def _mark_retry(self, error, retry_after=None):
+        if self.attempt_count > len(RETRY_DELAYS):
+            self._mark_failed(error)
+            return
+        delay = retry_after or RETRY_DELAYS[self.attempt_count - 1]
+        _logger.warning(f"Ошибка отправки сообщения в Telegram (попытка {self.attempt_count}): {error}")
+        self.write({
+            'next_attempt_date': fields.Datetime.now() + timedelta(seconds=delay),
+            'last_error': error,
+        })
+
+    def _mark_failed(self, error):
+        _logger.error(f"Сообщение в Telegram не доставлено: {error}")
+        self.write({
+            'state': 'failed',
+            'last_error': error,
+        })
+        if self.telegram_message_id:
+            self.telegram_message_id.write({'delivery_state': 'failed', 'delivery_error': error})
+
+    def action_retry(self):
+        """Повторить отправку вручную"""
+        self.write({
+            'state': 'pending',
+            'attempt_count': 0,
+            'next_attempt_date': fields.Datetime.now(),
+        })
+        self.telegram_message_id.write({'delivery_state': 'queued', 'delivery_error': False})
+        self.env.ref('telegram_bot.ir_cron_telegram_dispatch_queue')._trigger()
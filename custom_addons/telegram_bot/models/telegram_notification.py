@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину сообщения
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Сколько изменений показывать в одном сводном сообщении, остальные только считаются
+NOTIFICATION_MAX_ITEMS = 10
+
+
+def telegram_length(text):
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16: эмодзи - две)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class TelegramNotification(models.AbstractModel):
+    """Сводные уведомления клиентам об изменениях документов
+
+    Уведомления копятся до конца транзакции и при коммите превращаются
+    в одно сообщение на получателя, поэтому массовое изменение заказов
+    или лидов дает клиенту одно сообщение, а не по сообщению на запись.
+    """
+    _name = 'telegram.notification'
+    _description = 'Сводные уведомления Telegram'
+
+    @api.model
+    def _add(self, telegram_user, key, text, crm_lead=None):
+        """Добавить уведомление в сводку получателя
+
+        :param key: ключ документа; повторное изменение того же документа
+            в транзакции заменяет предыдущее уведомление
+        """
+        data = self.env.cr.precommit.data
+        pending = data.get('telegram_notification.pending')
+        if pending is None:
+            pending = data['telegram_notification.pending'] = {}
+            self.env.cr.precommit.add(self._flush)
+        pending.setdefault(telegram_user.id, {})[key] = (text, crm_lead.id if crm_lead else False)
+
+    def _flush(self):
+        """Создать сводные сообщения и поставить их в очередь отправки"""
+        pending = self.env.cr.precommit.data.pop('telegram_notification.pending', {})
+        if not pending:
+            return
+        try:
+            with self.env.cr.savepoint():
+                self._send_pending(pending)
+        except Exception as e:
+            # Ошибка уведомлений не должна отменять бизнес-операцию
+            _logger.error(f"Ошибка отправки уведомлений в Telegram: {str(e)}", exc_info=True)
+
+    def _send_pending(self, pending):
+        users = self.env['telegram.user'].sudo().browse(list(pending)).exists()
+        now = fields.Datetime.now()
+        message_vals = []
+        for user in users:
+            notifications = list(pending[user.id].values())
+            lead_ids = {lead_id for _text, lead_id in notifications if lead_id}
+            message_vals.append({
+                'telegram_user_id': user.id,
+                'crm_lead_id': lead_ids.pop() if len(lead_ids) == 1 else False,
+                'message_date': now,
+                'text': self._combine([text for text, _lead_id in notifications]),
+                'direction': 'outgoing',
+                'delivery_state': 'queued',
+            })
+        messages = self.env['telegram.message'].sudo().create(message_vals)
+
+        queue_vals = []
+        for user, message in zip(users, messages):
+            bot_config = user._get_bot_config()
+            if not bot_config or not user.chat_id:
+                message.write({'delivery_state': 'failed', 'delivery_error': _('Активный бот или Chat ID не найден')})
+                continue
+            queue_vals.append({
+                'bot_config_id': bot_config.id,
+                'chat_id': user.chat_id,
+                'text': message.text,
+                'parse_mode': 'Markdown',
+                'telegram_message_id': message.id,
+            })
+        if queue_vals:
+            self.env['telegram.message.queue']._enqueue_batch(queue_vals)
+        self.env.flush_all()
+
+    @api.model
+    def _combine(self, texts):
+        """Одно сообщение из нескольких уведомлений с учетом лимита длины Telegram
+
+        Уведомления не обрезаются посередине, чтобы не ломать разметку и эмодзи:
+        не поместившиеся отбрасываются целиком и учитываются строкой "…и еще N".
+        """
+        if len(texts) == 1:
+            return self._truncate_lines(texts[0])
+        header = f"🔔 **Изменений: {len(texts)}**"
+        # Место под строку остатка резервируется сразу
+        length = telegram_length(header) + telegram_length(f"\n\n…и еще {len(texts)}")
+        shown = []
+        for text in texts[:NOTIFICATION_MAX_ITEMS]:
+            length += telegram_length(text) + 2
+            if length > TELEGRAM_MESSAGE_LIMIT:
+                break
+            shown.append(text)
+        parts = [header] + shown
+        if len(shown) < len(texts):
+            parts.append(f"…и еще {len(texts) - len(shown)}")
+        return '\n\n'.join(parts)
+
+    @api.model
+    def _truncate_lines(self, text):
+        """Обрезать одно уведомление по границе строки, если оно длиннее лимита Telegram"""
+        if telegram_length(text) <= TELEGRAM_MESSAGE_LIMIT:
+            return text
+        lines = []
+        length = telegram_length('\n…')
+        for line in text.split('\n'):
+            length += telegram_length(line) + 1
+            if length > TELEGRAM_MESSAGE_LIMIT:
+                break
+            lines.append(line)
+        return '\n'.join(lines + ['…'])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from psycopg2 import errors
+from psycopg2.extras import Json
+
+from odoo import models, api
+
+_logger = logging.getLogger(__name__)
+
+# Сколько последних заказов хранится в сводке для команды бота /orders
+ORDER_SUMMARY_LIMIT = 50
+ORDER_STATE_NAMES = {
+    'draft': 'Черновик',
+    'sent': 'Отправлено',
+    'sale': 'Подтверждено',
+    'cancel': 'Отменено',
+}
+# Поля заказа, от которых зависит сводка
+ORDER_SUMMARY_FIELDS = {'state', 'amount_total', 'partner_id'}
+
+
+class TelegramOrderSummary(models.AbstractModel):
+    """Сводка заказов клиента для команды бота /orders
+
+    Отрисованные строки последних заказов хранятся в отдельной таблице
+    telegram_order_summary (строка на клиента), а не в res.partner: изменение
+    заказа не переписывает строку партнера. Листание страниц читает только
+    сводку. Изменение статуса, суммы или клиента заказа после коммита
+    помечает сводку клиента устаревшей, следующий запрос /orders строит ее заново.
+    """
+    _name = 'telegram.order.summary'
+    _description = 'Сводка заказов для Telegram'
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS telegram_order_summary (
+                partner_id integer PRIMARY KEY REFERENCES res_partner(id) ON DELETE CASCADE,
+                summary jsonb,
+                invalidated_at timestamptz
+            )
+        """)
+
+    @api.model
+    def _get(self, partner):
+        """Сводка клиента: {'total': всего заказов, 'orders': [[номер, статус, сумма]]}"""
+        self.env.cr.execute("""
+            SELECT summary, invalidated_at IS NULL OR invalidated_at < now()
+              FROM telegram_order_summary
+             WHERE partner_id = %s
+        """, [partner.id])
+        row = self.env.cr.fetchone()
+        if row and row[0] is not None:
+            return row[0]
+        summary = self._compute(partner)
+        # Сводку, помеченную устаревшей после начала транзакции, снимок может
+        # не видеть целиком, поэтому она не сохраняется
+        if not row or row[1]:
+            self._store(partner, summary)
+        return summary
+
+    @api.model
+    def _compute(self, partner):
+        orders = self.env['sale.order'].sudo().search_fetch(
+            [('partner_id', '=', partner.id), ('state', '!=', 'cancel')],
+            ['name', 'state', 'amount_total', 'currency_id'],
+            order='date_order desc, id desc')
+        return {
+            'total': len(orders),
+            'orders': [
+                [order.name, ORDER_STATE_NAMES.get(order.state, order.state),
+                 f"{order.currency_id.symbol} {order.amount_total:.2f}"]
+                for order in orders[:ORDER_SUMMARY_LIMIT]
+            ],
+        }
+
+    @api.model
+    def _store(self, partner, summary):
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("""
+                    INSERT INTO telegram_order_summary (partner_id, summary)
+                    VALUES (%s, %s)
+                    ON CONFLICT (partner_id) DO UPDATE SET summary = EXCLUDED.summary
+                     WHERE telegram_order_summary.summary IS NULL
+                       AND telegram_order_summary.invalidated_at < now()
+                """, [partner.id, Json(summary)])
+        except errors.SerializationFailure:
+            # Сводку одновременно пометили устаревшей, сохранит следующий запрос
+            pass
+
+    @api.model
+    def _invalidate(self, partner_ids):
+        """Пометить сводки клиентов устаревшими после коммита транзакции"""
+        partner_ids = set(filter(None, partner_ids))
+        if not partner_ids:
+            return
+        pending = self.env.cr.postcommit.data.setdefault('telegram_order_summary.invalidated', set())
+        if not pending:
+            self.env.cr.postcommit.add(self._flush_invalidation)
+        pending.update(partner_ids)
+
+    def _flush_invalidation(self):
+        partner_ids = self.env.cr.postcommit.data.pop('telegram_order_summary.invalidated', set())
+        if not partner_ids:
+            return
+        try:
+            with self.env.registry.cursor() as cr:
+                # Новые строки заводятся только для клиентов с Telegram
+                cr.execute("""
+                    INSERT INTO telegram_order_summary (partner_id, invalidated_at)
+                    SELECT partner.id, clock_timestamp()
+                      FROM res_partner partner
+                     WHERE partner.id = ANY(%s)
+                       AND (partner.has_telegram OR EXISTS (
+                            SELECT 1 FROM telegram_order_summary summary WHERE summary.partner_id = partner.id))
+                    ON CONFLICT (partner_id) DO UPDATE
+                       SET summary = NULL, invalidated_at = EXCLUDED.invalidated_at
+                """, [sorted(partner_ids)])
+        except Exception as e:
+            _logger.error(f"Ошибка сброса сводки заказов Telegram: {str(e)}")
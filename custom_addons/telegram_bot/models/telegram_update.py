@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+from datetime import timedelta
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+INBOX_BATCH_SIZE = 100
+INBOX_TIME_LIMIT = 50
+# Сколько дней хранить обработанные обновления (защита от повторной доставки)
+INBOX_RETENTION_DAYS = 7
+
+
+class TelegramUpdate(models.Model):
+    """Входящие обновления Telegram, полученные через webhook
+
+    Webhook только сохраняет обновление и сразу отвечает Telegram, обработку
+    выполняет cron. Уникальность (бот, update_id) отсекает повторную доставку.
+    """
+    _name = 'telegram.update'
+    _description = 'Входящее обновление Telegram'
+    _order = 'id'
+
+    bot_config_id = fields.Many2one('telegram.bot.config', string='Бот', required=True, ondelete='cascade')
+    update_id = fields.Integer(string='Update ID', required=True)
+    payload = fields.Json(string='Данные обновления', required=True)
+    state = fields.Selection([
+        ('pending', 'Ожидает обработки'),
+        ('done', 'Обработано'),
+        ('failed', 'Ошибка'),
+    ], string='Статус', required=True, default='pending', index=True)
+    received_date = fields.Datetime(string='Получено', default=fields.Datetime.now)
+    processed_date = fields.Datetime(string='Обработано')
+    error = fields.Text(string='Ошибка')
+
+    _sql_constraints = [
+        ('bot_update_unique', 'unique(bot_config_id, update_id)', 'Обновление уже получено'),
+    ]
+
+    @api.model
+    def _receive(self, bot_config_id, update):
+        """Сохранить обновление из webhook (без ORM, чтобы ответить Telegram как можно быстрее)
+
+        :return: True, если обновление новое, False при повторной доставке
+        """
+        self.env.cr.execute("""
+            INSERT INTO telegram_update (bot_config_id, update_id, payload, state, received_date,
+                                         create_date, write_date)
+            VALUES (%s, %s, %s, 'pending', NOW() AT TIME ZONE 'UTC',
+                    NOW() AT TIME ZONE 'UTC', NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT (bot_config_id, update_id) DO NOTHING
+            RETURNING id
+        """, [bot_config_id, update['update_id'], json.dumps(update)])
+        if not self.env.cr.fetchone():
+            return False
+        self.env.ref('telegram_bot.ir_cron_telegram_process_inbox').sudo()._trigger()
+        return True
+
+    @api.model
+    def _cron_process(self, batch_size=INBOX_BATCH_SIZE, time_limit=INBOX_TIME_LIMIT, auto_commit=True):
+        """Обработать накопленные обновления пачками"""
+        started = time.monotonic()
+        processed = 0
+        while time.monotonic() - started < time_limit:
+            self.env.cr.execute("""
+                SELECT id FROM telegram_update
+                 WHERE state = 'pending'
+              ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            """, [batch_size])
+            updates = self.browse([row[0] for row in self.env.cr.fetchall()])
+            if not updates:
+                break
+            updates._process()
+            processed += len(updates)
+            if auto_commit:
+                self.env.cr.commit()
+        if processed:
+            duration = max(time.monotonic() - started, 0.001)
+            _logger.info(
+                f"Telegram: обработано входящих обновлений {processed} "
+                f"за {duration:.2f} с ({processed / duration:.0f} в секунду)")
+
+    def _process(self):
+        from odoo.addons.telegram_bot.models.telegram_message_handler import TelegramMessageHandler
+
+        for bot_config in self.bot_config_id:
+            updates = self.filtered(lambda update: update.bot_config_id == bot_config)
+            errors = TelegramMessageHandler.process_updates_batch(bot_config, updates.mapped('payload'), self.env)
+            failed = updates.filtered(lambda update: update.update_id in errors)
+            for update in failed:
+                update.write({'state': 'failed', 'error': errors[update.update_id]})
+            (updates - failed).write({'state': 'done', 'processed_date': fields.Datetime.now(), 'error': False})
+
+    def action_retry(self):
+        """Повторить обработку вручную"""
+        self.write({'state': 'pending', 'error': False})
+        self.env.ref('telegram_bot.ir_cron_telegram_process_inbox')._trigger()
+
+    @api.autovacuum
+    def _gc_processed(self):
+        """Удалить старые обработанные обновления"""
+        self.env.cr.execute("""
+            DELETE FROM telegram_update
+             WHERE state = 'done' AND received_date < %s
+        """, [fields.Datetime.now() - timedelta(days=INBOX_RETENTION_DAYS)])
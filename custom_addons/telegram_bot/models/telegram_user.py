@@ -1,7 +1,56 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
 from odoo import models, fields, api, _
-from odoo.exceptions import UserError, ValidationError
+from odoo.exceptions import AccessError, UserError, ValidationError
+from odoo.tools import column_exists, table_exists
+
+_logger = logging.getLogger(__name__)
+
+# Поля, от которых зависит кеш TelegramUser._get_cached_user
+USER_CACHE_FIELDS = {'telegram_id', 'bot_config_id', 'partner_id', 'chat_id', 'is_verified'}
+USER_CACHE_SIZE = 8192
+# Переписку, в которой оператор не отвечал столько времени, может взять другой оператор
+CLAIM_TIMEOUT = timedelta(minutes=30)
+
+
+class TelegramUserLRUCache:
+    """Потокобезопасный LRU-кеш пользователей ботов
+
+    Отдельный от ormcache реестра: его сброс не затрагивает кеши других моделей.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, dbname):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == dbname]:
+                del self._data[key]
+
+
+# Общий для всех запросов процесса (воркера) кеш
+user_cache = TelegramUserLRUCache()
 
 
 class TelegramUser(models.Model):
@@ -10,6 +59,10 @@ class TelegramUser(models.Model):
     _rec_name = 'display_name'
 
     telegram_id = fields.Integer(string='Telegram ID', required=True, index=True, help='ID пользователя в Telegram')
+    bot_config_id = fields.Many2one(
+        'telegram.bot.config', string='Бот', index=True, ondelete='restrict',
+        default=lambda self: self.env['telegram.bot.config'].sudo().get_active_bot(),
+        help='Бот, через который пользователь общается с компанией')
     username = fields.Char(string='Username', help='@username в Telegram')
     first_name = fields.Char(string='Имя')
     last_name = fields.Char(string='Фамилия')
@@ -19,13 +72,48 @@ class TelegramUser(models.Model):
     is_verified = fields.Boolean(string='Верифицирован', default=False, index=True)
     verified_date = fields.Datetime(string='Дата верификации')
     chat_id = fields.Integer(string='Chat ID', help='ID чата для отправки сообщений')
-    last_message_date = fields.Datetime(string='Последнее сообщение')
-    message_count = fields.Integer(string='Количество сообщений', compute='_compute_message_count', store=False)
+    telegram_message_ids = fields.One2many('telegram.message', 'telegram_user_id', string='Сообщения')
+    # Счетчики поддерживает telegram.message при создании и прочтении сообщений
+    last_message_date = fields.Datetime(string='Последнее сообщение', readonly=True)
+    last_incoming_date = fields.Datetime(string='Последнее входящее', readonly=True, index=True)
+    last_outgoing_date = fields.Datetime(string='Последнее исходящее', readonly=True)
+    message_count = fields.Integer(string='Количество сообщений', readonly=True,
+                                   help='Без сообщений, перенесенных в архив')
+    unread_count = fields.Integer(string='Непрочитанные', readonly=True)
+    operator_id = fields.Many2one('res.users', string='Оператор', readonly=True, index='btree_not_null',
+                                  help='Оператор, который ведет переписку')
+    claim_date = fields.Datetime(string='В работе с', readonly=True,
+                                 help='Время, когда оператор взял переписку или последний раз ответил')
 
     _sql_constraints = [
-        ('telegram_id_unique', 'unique(telegram_id)', 'Telegram ID должен быть уникальным'),
+        ('telegram_id_unique', 'unique(bot_config_id, telegram_id)', 'Telegram ID должен быть уникальным для бота'),
     ]
 
+    def _auto_init(self):
+        new_counters = not column_exists(self.env.cr, 'telegram_user', 'unread_count')
+        result = super()._auto_init()
+        if new_counters and table_exists(self.env.cr, 'telegram_message'):
+            self.env['telegram.message']._recompute_counters({self._name: None})
+        return result
+
+    def init(self):
+        # Версия кеша _get_cached_user: значение sequence вне транзакций видно всем воркерам сразу
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS telegram_user_cache_version")
+        if not table_exists(self.env.cr, 'telegram_bot_config'):
+            return
+        # Пользователи, созданные до поддержки нескольких ботов, относятся к первому активному боту
+        self.env.cr.execute("""
+            UPDATE telegram_user
+               SET bot_config_id = (SELECT id FROM telegram_bot_config WHERE active ORDER BY id LIMIT 1)
+             WHERE bot_config_id IS NULL
+        """)
+        # Счетчики входящих операторов считаются только по перепискам с непрочитанными
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS telegram_user_unread_idx
+                ON telegram_user (bot_config_id, operator_id)
+             WHERE unread_count > 0
+        """)
+
     @api.depends('first_name', 'last_name', 'username', 'telegram_id')
     def _compute_display_name(self):
         for record in self:
@@ -40,11 +128,73 @@ class TelegramUser(models.Model):
                 name_parts.append(f"ID: {record.telegram_id}")
             record.display_name = ' '.join(name_parts)
 
-    def _compute_message_count(self):
-        for record in self:
-            record.message_count = self.env['telegram.message'].search_count([
-                ('telegram_user_id', '=', record.id)
-            ])
+    @api.model
+    def _get_cache_version(self):
+        """Версия кеша пользователей и признак того, что данные транзакции можно сохранить под ней
+
+        Версия хранится в sequence (время последнего сброса в микросекундах, см.
+        _flush_user_cache) и читается один раз за транзакцию. Если сброс случился
+        после начала транзакции, ее снимок может не видеть изменений, и
+        результат не кешируется.
+        """
+        data = self.env.cr.precommit.data
+        if 'telegram_user.cache_version' not in data:
+            self.env.cr.execute("""
+                SELECT last_value, last_value < (EXTRACT(EPOCH FROM now()) * 1000000)::bigint
+                  FROM telegram_user_cache_version
+            """)
+            data['telegram_user.cache_version'] = self.env.cr.fetchone()
+        return data['telegram_user.cache_version']
+
+    @api.model
+    def _get_cached_user(self, bot_config_id, telegram_id):
+        """Данные пользователя бота по Telegram ID из кеша воркера
+
+        :return: (id, partner_id, chat_id, is_verified) или None
+        """
+        version, cacheable = self._get_cache_version()
+        key = (self.env.cr.dbname, version, bot_config_id, telegram_id)
+        result = user_cache.get(key)
+        if result is not None:
+            return result
+        user = self.sudo().search_fetch([
+            ('bot_config_id', '=', bot_config_id),
+            ('telegram_id', '=', telegram_id),
+        ], ['partner_id', 'chat_id', 'is_verified', 'write_date'], limit=1)
+        if not user:
+            # Промахи не кешируются: пользователя может создать другой воркер
+            return None
+        result = (user.id, user.partner_id.id, user.chat_id, user.is_verified)
+        # Строки, измененные в текущей транзакции, не кешируются: она может откатиться
+        if cacheable and user.write_date != self.env.cr.now():
+            user_cache.set(key, result)
+        return result
+
+    def _invalidate_user_cache(self):
+        """Сбросить кеш _get_cached_user во всех воркерах после коммита транзакции"""
+        postcommit = self.env.cr.postcommit
+        if not postcommit.data.get('telegram_user.invalidate_cache'):
+            postcommit.data['telegram_user.invalidate_cache'] = True
+            postcommit.add(self._flush_user_cache)
+
+    def _flush_user_cache(self):
+        """Сменить версию кеша пользователей после коммита
+
+        Новая версия - время сброса в микросекундах (не меньше предыдущей версии + 1),
+        другие воркеры видят ее при следующей транзакции.
+        """
+        user_cache.discard(self.env.cr.dbname)
+        try:
+            with self.env.registry.cursor() as cr:
+                # Блокировка до конца транзакции: версия не уменьшается при одновременных сбросах
+                cr.execute("SELECT pg_advisory_xact_lock(hashtext('telegram_user_cache_version'))")
+                cr.execute("""
+                    SELECT setval('telegram_user_cache_version', GREATEST(
+                        last_value + 1, (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::bigint))
+                      FROM telegram_user_cache_version
+                """)
+        except Exception as e:
+            _logger.error(f"Ошибка сброса кеша пользователей Telegram: {str(e)}")
 
     @api.model
     def create(self, vals):
@@ -76,8 +226,20 @@ class TelegramUser(models.Model):
             import random
             vals['verification_code'] = ''.join([str(random.randint(0, 9)) for _ in range(6)])
         
+        # Новый пользователь не может быть в кеше: промахи не кешируются
         return super().create(vals)
 
+    def write(self, vals):
+        result = super().write(vals)
+        if USER_CACHE_FIELDS.intersection(vals):
+            self._invalidate_user_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self._invalidate_user_cache()
+        return result
+
     def action_verify(self):
         """Верифицировать пользователя"""
         self.ensure_one()
@@ -120,30 +282,87 @@ class TelegramUser(models.Model):
             }
         }
 
-    def _send_telegram_message(self, text, parse_mode='Markdown'):
-        """Отправить сообщение в Telegram"""
-        bot_config = self.env['telegram.bot.config'].get_active_bot()
+    def _check_operator(self):
+        """Проверить, что текущий пользователь - оператор ботов этих переписок"""
+        if self.env.user.has_group('base.group_system'):
+            return
+        for user in self.sudo():
+            if self.env.user not in user.bot_config_id.operator_user_ids:
+                raise AccessError(_('Вы не оператор бота %s') % user.bot_config_id.name)
+
+    def _claim(self):
+        """Назначить переписки текущему пользователю
+
+        Условие проверяется в UPDATE под блокировкой строки, поэтому из двух
+        операторов, одновременно взявших переписку, ее получает только один.
+
+        :return: переписки, которые ведет другой оператор
+        """
+        if not self:
+            return self
+        now = fields.Datetime.now()
+        self.flush_recordset(['operator_id', 'claim_date'])
+        self.env.cr.execute("""
+            UPDATE telegram_user
+               SET operator_id = %s, claim_date = %s, write_uid = %s, write_date = %s
+             WHERE id IN %s
+               AND (operator_id IS NULL OR operator_id = %s OR claim_date < %s)
+         RETURNING id
+        """, [self.env.uid, now, self.env.uid, now, tuple(self.ids), self.env.uid, now - CLAIM_TIMEOUT])
+        claimed = self.browse([row[0] for row in self.env.cr.fetchall()])
+        self.invalidate_recordset(['operator_id', 'claim_date', 'write_uid', 'write_date'])
+        self.env['telegram.inbox']._collect(claimed)
+        return self - claimed
+
+    def action_claim(self):
+        """Взять переписки в работу"""
+        self._check_operator()
+        busy = self._claim()
+        if busy:
+            raise UserError(_('Переписку с %(name)s уже ведет оператор %(operator)s',
+                              name=busy[0].display_name, operator=busy[0].sudo().operator_id.name))
+
+    def action_release(self):
+        """Вернуть переписки в общую очередь"""
+        self._check_operator()
+        users = self.sudo()
+        if not self.env.user.has_group('base.group_system'):
+            users = users.filtered(lambda user: user.operator_id == self.env.user)
+        users.write({'operator_id': False, 'claim_date': False})
+        self.env['telegram.inbox']._collect(users)
+
+    def action_mark_read(self):
+        """Отметить входящие сообщения переписок прочитанными"""
+        self.env['telegram.message'].search([
+            ('telegram_user_id', 'in', self.ids),
+            ('direction', '=', 'incoming'),
+            ('is_read', '=', False),
+        ]).write({'is_read': True})
+
+    def _get_bot_config(self):
+        """Бот для отправки пользователю: его собственный, если активен, иначе бот по умолчанию"""
+        self.ensure_one()
+        bot_config = self.sudo().bot_config_id
+        if not bot_config.active:
+            bot_config = self.env['telegram.bot.config'].sudo().get_active_bot()
+        return bot_config
+
+    def _send_telegram_message(self, text, parse_mode='Markdown', message=None):
+        """Поставить сообщение в очередь отправки в Telegram
+
+        Сообщение уходит после коммита текущей транзакции.
+
+        :param message: запись telegram.message, в которой отражается статус доставки
+        """
+        self.ensure_one()
+        bot_config = self._get_bot_config()
         if not bot_config:
             raise UserError(_('Активный бот не найден'))
         
         if not self.chat_id:
             raise UserError(_('Chat ID не установлен'))
         
-        import requests
-        try:
-            response = requests.post(
-                f"https://api.telegram.org/bot{bot_config.bot_token}/sendMessage",
-                json={
-                    'chat_id': self.chat_id,
-                    'text': text,
-                    'parse_mode': parse_mode,
-                },
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            raise UserError(_('Ошибка отправки сообщения: %s') % str(e))
+        return self.env['telegram.message.queue']._enqueue(bot_config, self.chat_id, text, parse_mode, message)
 
     def action_view_messages(self):
         """Открыть историю сообщений"""
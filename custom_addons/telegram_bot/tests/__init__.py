@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+from . import test_message_queue
+from . import test_webhook
+from . import test_telegram_user
+from . import test_notification
+from . import test_orders_command
+from . import test_message_archive
+from . import test_message_handler
+from . import test_telegram_message
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import TransactionCase
+
+
+class TelegramBotCase(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bot = cls.env['telegram.bot.config'].create({
+            'bot_name': 'Тестовый бот',
+            'bot_token': '123456:TEST',
+            'webhook_secret': 'test-secret',
+        })
+        cls.partner = cls.env['res.partner'].create({'name': 'Клиент Telegram'})
+
+    @classmethod
+    def _create_telegram_user(cls, telegram_id, partner=None, **vals):
+        return cls.env['telegram.user'].create(dict({
+            'bot_config_id': cls.bot.id,
+            'telegram_id': telegram_id,
+            'chat_id': telegram_id,
+            'partner_id': (partner or cls.partner).id,
+        }, **vals))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import TelegramBotCase
+
+
+@tagged('post_install', '-at_install')
+class TestMessageArchive(TelegramBotCase):
+
+    def test_archive_keeps_lead_link(self):
+        telegram_user = self._create_telegram_user(9001, is_verified=True)
+        lead = self.env['crm.lead'].create({'name': 'Окна на дачу', 'partner_id': self.partner.id})
+        old_date = fields.Datetime.now() - timedelta(days=400)
+        self.env['telegram.message'].create([{
+            'telegram_user_id': telegram_user.id,
+            'crm_lead_id': lead.id,
+            'text': text,
+            'direction': 'incoming',
+            'is_read': True,
+            'message_date': message_date,
+        } for text, message_date in (
+            ('Здравствуйте', old_date),
+            ('Сколько стоит монтаж?', old_date + timedelta(minutes=5)),
+            ('Когда приедет замерщик?', fields.Datetime.now()),
+        )])
+        self.assertEqual(lead.telegram_message_count, 3)
+
+        self.env['telegram.message.archive']._cron_archive(auto_commit=False)
+
+        archive = self.env['telegram.message.archive'].search([('telegram_user_id', '=', telegram_user.id)])
+        self.assertEqual(archive.message_count, 2)
+        self.assertEqual(archive.crm_lead_ids, lead)
+        self.assertEqual([message['crm_lead_id'] for message in archive.messages], [lead.id, lead.id])
+        self.assertEqual(lead.telegram_archive_ids, archive)
+        self.assertEqual(lead.telegram_archive_count, 1)
+        self.assertEqual(lead.action_view_telegram_archive()['domain'], [('crm_lead_ids', 'in', lead.ids)])
+        # Счетчики считают только оперативную историю
+        self.assertEqual(lead.telegram_message_count, 1)
+        self.assertEqual(telegram_user.message_count, 1)
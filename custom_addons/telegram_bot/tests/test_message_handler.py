@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from odoo.addons.telegram_bot.models.telegram_message_handler import TelegramMessageHandler
+
+from .common import TelegramBotCase
+
+HANDLER_LOGGER = 'odoo.addons.telegram_bot.models.telegram_message_handler'
+
+
+@tagged('post_install', '-at_install')
+class TestUpdatesBatch(TelegramBotCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.telegram_user = cls._create_telegram_user(9101, is_verified=True)
+
+    def _message(self, update_id, text, chat_id=9101):
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 1700000000 + update_id, 'text': text,
+            'from': {'id': 9101}, 'chat': {'id': chat_id},
+        }}
+
+    def test_failed_update_rolled_back(self):
+        updates = [self._message(1, '/orders', chat_id=9102), self._message(2, 'Привет')]
+        with patch.object(TelegramMessageHandler, '_process_command', side_effect=ValueError('Сбой команды')), \
+                self.assertLogs(HANDLER_LOGGER, 'ERROR'):
+            errors = TelegramMessageHandler.process_updates_batch(self.bot, updates, self.env)
+
+        self.assertEqual(errors, {1: 'Сбой команды'})
+        # Смена chat_id из упавшего обновления откатилась вместе с его точкой сохранения
+        self.telegram_user.invalidate_recordset()
+        self.assertEqual(self.telegram_user.chat_id, 9101)
+        messages = self.env['telegram.message'].search([('telegram_user_id', '=', self.telegram_user.id)])
+        self.assertEqual(messages.mapped('text'), ['Привет'])
+
+    def test_single_message_logs_error(self):
+        with patch.object(TelegramMessageHandler, '_process_command', side_effect=ValueError('Сбой команды')), \
+                self.assertLogs(HANDLER_LOGGER, 'ERROR') as logs:
+            TelegramMessageHandler.process_message(self.bot, self._message(3, '/help')['message'], self.env)
+        self.assertIn('Сбой команды', logs.output[0])
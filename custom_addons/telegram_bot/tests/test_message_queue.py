@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.telegram_bot.models.telegram_bot_api import TelegramBotApi, TelegramApiError
+from odoo.addons.telegram_bot.models.telegram_message_queue import GLOBAL_RATE_LIMIT, PER_CHAT_INTERVAL
+
+from .common import TelegramBotCase
+
+
+@tagged('post_install', '-at_install')
+class TestMessageQueue(TelegramBotCase):
+
+    def setUp(self):
+        super().setUp()
+        self.Queue = self.env['telegram.message.queue']
+        self.calls = []
+
+    def _dispatch(self, side_effect=None, time_limit=3):
+        def call(api, method, payload=None, read_timeout=None):
+            self.calls.append((time.monotonic(), method, payload))
+            if side_effect:
+                return side_effect(method, payload)
+            return {'message_id': len(self.calls)}
+
+        with patch.object(TelegramBotApi, 'call', autospec=True, side_effect=call):
+            self.Queue._cron_dispatch(time_limit=time_limit, auto_commit=False)
+
+    def test_per_chat_interval(self):
+        first = self.Queue._enqueue(self.bot, 1001, 'Первое')
+        second = self.Queue._enqueue(self.bot, 1001, 'Второе')
+        other = self.Queue._enqueue(self.bot, 1002, 'Другой чат')
+        self._dispatch()
+
+        self.assertEqual((first | second | other).mapped('state'), ['sent'] * 3)
+        # Второе сообщение в тот же чат не уходит сразу после первого
+        self.assertEqual([payload['chat_id'] for _at, _method, payload in self.calls], [1001, 1002, 1001])
+        first_at, second_at = [at for at, _method, payload in self.calls if payload['chat_id'] == 1001]
+        self.assertGreaterEqual(second_at - first_at, PER_CHAT_INTERVAL)
+
+    def test_per_chat_deferred(self):
+        first = self.Queue._enqueue(self.bot, 1003, 'Первое')
+        second = self.Queue._enqueue(self.bot, 1003, 'Второе')
+        before = fields.Datetime.now()
+        # Лимит запуска меньше интервала: второе сообщение остается на следующий запуск
+        self._dispatch(time_limit=0.5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(first.state, 'sent')
+        self.assertEqual(second.state, 'pending')
+        self.assertEqual(second.attempt_count, 0)
+        self.assertGreaterEqual(second.next_attempt_date, before + timedelta(seconds=PER_CHAT_INTERVAL))
+
+    def test_unexpected_error_keeps_sent_state(self):
+        first = self.Queue._enqueue(self.bot, 1004, 'Первое')
+        broken = self.Queue._enqueue(self.bot, 1005, 'Второе')
+        third = self.Queue._enqueue(self.bot, 1006, 'Третье')
+
+        def fail_second(method, payload):
+            if payload['chat_id'] == 1005:
+                raise ValueError('Неожиданный ответ')
+            return {'message_id': len(self.calls)}
+
+        with self.assertLogs('odoo.addons.telegram_bot.models.telegram_message_queue', 'ERROR'):
+            self._dispatch(fail_second)
+
+        self.assertEqual(first.state, 'sent')
+        self.assertEqual(third.state, 'sent')
+        self.assertEqual(broken.state, 'pending')
+        self.assertEqual(broken.attempt_count, 1)
+        self.assertEqual(broken.last_error, 'Неожиданный ответ')
+
+    def test_trigger_once_per_transaction(self):
+        precommit = self.env.cr.precommit
+        precommit.data.pop('telegram_message_queue.trigger', None)
+        with patch.object(type(self.env['ir.cron']), '_trigger', autospec=True) as trigger:
+            for chat_id in range(1101, 1111):
+                self.Queue._enqueue(self.bot, chat_id, 'Сообщение')
+            self.Queue._enqueue_batch([{'bot_config_id': self.bot.id, 'chat_id': 1111, 'text': 'Рассылка'}])
+            self.assertEqual(trigger.call_count, 0)
+            precommit.run()
+        self.assertEqual(trigger.call_count, 1)
+
+    def test_global_rate_limit(self):
+        for chat_id in range(2001, 2006):
+            self.Queue._enqueue(self.bot, chat_id, 'Сообщение')
+        self._dispatch()
+
+        self.assertEqual(len(self.calls), 5)
+        for (previous, *_rest), (current, *_other) in zip(self.calls, self.calls[1:]):
+            # Допуск на округление таймера
+            self.assertGreaterEqual(current - previous, 1.0 / GLOBAL_RATE_LIMIT - 0.005)
+
+    def test_retry_after(self):
+        item = self.Queue._enqueue(self.bot, 3001, 'Сообщение')
+
+        def too_many_requests(method, payload):
+            raise TelegramApiError('Too Many Requests', status_code=429, retry_after=120)
+
+        before = fields.Datetime.now()
+        self._dispatch(too_many_requests)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(item.state, 'pending')
+        self.assertEqual(item.attempt_count, 1)
+        self.assertGreaterEqual(item.next_attempt_date, before + timedelta(seconds=120))
+        self.assertEqual(item.last_error, 'Too Many Requests')
+
+    def test_client_error_fails_message(self):
+        telegram_user = self._create_telegram_user(3002)
+        message = self.env['telegram.message'].create({
+            'telegram_user_id': telegram_user.id,
+            'text': 'Сообщение',
+            'direction': 'outgoing',
+            'message_date': fields.Datetime.now(),
+        })
+        item = self.Queue._enqueue(self.bot, 3002, message.text, message=message)
+
+        def forbidden(method, payload):
+            raise TelegramApiError('Forbidden: bot was blocked by the user', status_code=403)
+
+        self._dispatch(forbidden)
+
+        self.assertEqual(item.state, 'failed')
+        self.assertEqual(message.delivery_state, 'failed')
+        self.assertEqual(message.delivery_error, 'Forbidden: bot was blocked by the user')
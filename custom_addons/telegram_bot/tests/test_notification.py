@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.telegram_bot.models.telegram_notification import (
+    NOTIFICATION_MAX_ITEMS, TELEGRAM_MESSAGE_LIMIT, telegram_length,
+)
+
+
+@tagged('post_install', '-at_install')
+class TestNotificationCombine(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.Notification = self.env['telegram.notification']
+
+    def test_combine_keeps_whole_items(self):
+        texts = [f"📦 **Заказ S{index:05d}**\n" + '🪟' * 700 for index in range(5)]
+        combined = self.Notification._combine(texts)
+        self.assertLessEqual(telegram_length(combined), TELEGRAM_MESSAGE_LIMIT)
+        parts = combined.split('\n\n')
+        shown = parts[1:-1]
+        self.assertTrue(shown)
+        self.assertEqual(shown, texts[:len(shown)])
+        self.assertEqual(parts[-1], f"…и еще {len(texts) - len(shown)}")
+
+    def test_combine_max_items(self):
+        texts = [f"Заказ {index}" for index in range(NOTIFICATION_MAX_ITEMS + 3)]
+        parts = self.Notification._combine(texts).split('\n\n')
+        self.assertEqual(parts[1:-1], texts[:NOTIFICATION_MAX_ITEMS])
+        self.assertEqual(parts[-1], "…и еще 3")
+
+    def test_single_notification_cut_on_line(self):
+        text = '\n'.join(f"Позиция {index}: 🪟" for index in range(1000))
+        truncated = self.Notification._combine([text])
+        self.assertLessEqual(telegram_length(truncated), TELEGRAM_MESSAGE_LIMIT)
+        lines = truncated.split('\n')
+        self.assertEqual(lines[-1], '…')
+        self.assertEqual(lines[:-1], text.split('\n')[:len(lines) - 1])
+        self.assertEqual(self.Notification._combine(['Короткое']), 'Короткое')
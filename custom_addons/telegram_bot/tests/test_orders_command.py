@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from odoo.addons.telegram_bot.models.telegram_message_handler import ORDERS_PAGE_SIZE, TelegramMessageHandler
+
+from .common import TelegramBotCase
+
+
+@tagged('post_install', '-at_install')
+class TestOrdersCommand(TelegramBotCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        product = cls.env['product.product'].create({'name': 'Окно', 'type': 'consu', 'list_price': 100})
+        cls.orders = cls.env['sale.order'].create([{
+            'partner_id': cls.partner.id,
+            'order_line': [(0, 0, {'product_id': product.id, 'product_uom_qty': 1})],
+        } for _index in range(ORDERS_PAGE_SIZE + 2)])
+        cls.telegram_user = cls._create_telegram_user(8001, is_verified=True)
+
+    def _buttons(self, reply_markup):
+        return [(button['text'], button['callback_data']) for button in reply_markup['inline_keyboard'][0]]
+
+    def test_orders_pages(self):
+        text, reply_markup = TelegramMessageHandler._render_orders_page(self.partner, 0)
+        self.assertEqual(text.count('•'), ORDERS_PAGE_SIZE)
+        self.assertEqual(self._buttons(reply_markup), [('1/2', 'noop'), ('▶️', 'orders:1')])
+
+        text, reply_markup = TelegramMessageHandler._render_orders_page(self.partner, 1)
+        self.assertEqual(text.count('•'), 2)
+        self.assertEqual(self._buttons(reply_markup), [('◀️', 'orders:0'), ('2/2', 'noop')])
+
+        # Кнопка со страницей за концом списка показывает первую страницу
+        self.assertEqual(
+            TelegramMessageHandler._render_orders_page(self.partner, 5),
+            TelegramMessageHandler._render_orders_page(self.partner, 0))
+
+    def test_page_tap_reads_summary(self):
+        TelegramMessageHandler._render_orders_page(self.partner, 0)
+        SaleOrder = type(self.env['sale.order'])
+        with patch.object(SaleOrder, '_search', side_effect=AssertionError("sale.order прочитан")), \
+                patch.object(SaleOrder, '_fetch_query', side_effect=AssertionError("sale.order прочитан")):
+            text, _reply_markup = TelegramMessageHandler._render_orders_page(self.partner, 1)
+        self.assertEqual(text.count('•'), 2)
+
+    def test_summary_invalidation(self):
+        Summary = self.env['telegram.order.summary']
+        TelegramMessageHandler._render_orders_page(self.partner, 0)
+        postcommit = self.env.cr.postcommit.data
+        postcommit.pop('telegram_order_summary.invalidated', None)
+
+        # Поля, не попадающие в сводку, ее не сбрасывают
+        self.orders[0].write({'note': 'Позвонить заранее'})
+        self.assertNotIn('telegram_order_summary.invalidated', postcommit)
+
+        self.orders[0].write({'state': 'cancel'})
+        self.assertEqual(postcommit['telegram_order_summary.invalidated'], {self.partner.id})
+        Summary._flush_invalidation()
+        self.assertEqual(Summary._get(self.partner)['total'], ORDERS_PAGE_SIZE + 1)
+
+    def test_no_orders(self):
+        partner = self.env['res.partner'].create({'name': 'Без заказов'})
+        self.assertEqual(TelegramMessageHandler._render_orders_page(partner, 0), ("У вас пока нет заказов.", None))
+
+    def test_callback_query_is_queued(self):
+        Queue = self.env['telegram.message.queue']
+        before = Queue.search([])
+        TelegramMessageHandler._process_callback_query(self.bot, {
+            'id': 'callback-1',
+            'from': {'id': 8001},
+            'message': {'message_id': 55, 'chat': {'id': 8001}},
+            'data': 'orders:1',
+        }, self.env)
+
+        answer, edit = Queue.search([]) - before
+        self.assertEqual(answer.method, 'answerCallbackQuery')
+        self.assertEqual(answer._get_payload(), {'callback_query_id': 'callback-1'})
+        self.assertEqual(edit.method, 'editMessageText')
+        self.assertEqual(edit._get_payload()['message_id'], 55)
+        self.assertEqual(edit._get_payload()['chat_id'], 8001)
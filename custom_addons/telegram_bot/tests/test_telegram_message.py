@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import re
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.telegram_bot.models.telegram_message import SNIPPET_START, SNIPPET_STOP, highlight_snippet
+
+from .common import TelegramBotCase
+
+COUNTERS = ('message_count', 'unread_count', 'last_incoming_date', 'last_outgoing_date', 'last_message_date')
+LEAD_COUNTERS = (
+    'telegram_message_count', 'telegram_unread_count', 'telegram_last_incoming_date', 'telegram_last_outgoing_date',
+)
+
+
+@tagged('post_install', '-at_install')
+class TestMessageCounters(TelegramBotCase):
+
+    def _read(self, record, fnames):
+        record.invalidate_recordset(fnames)
+        return {fname: record[fname] for fname in fnames}
+
+    def test_incremental_matches_recompute(self):
+        telegram_user = self._create_telegram_user(9201)
+        lead = self.env['crm.lead'].create({'name': 'Балконное остекление', 'partner_id': self.partner.id})
+        now = fields.Datetime.now()
+        messages = self.env['telegram.message'].create([{
+            'telegram_user_id': telegram_user.id,
+            'crm_lead_id': lead.id,
+            'text': text,
+            'direction': direction,
+            'message_date': now - timedelta(minutes=minutes),
+        } for text, direction, minutes in (
+            ('Добрый день', 'incoming', 30),
+            ('Здравствуйте!', 'outgoing', 20),
+            ('Нужен замер', 'incoming', 10),
+        )])
+        self.assertEqual(self._read(telegram_user, COUNTERS), {
+            'message_count': 3,
+            'unread_count': 2,
+            'last_incoming_date': now - timedelta(minutes=10),
+            'last_outgoing_date': now - timedelta(minutes=20),
+            'last_message_date': now - timedelta(minutes=10),
+        })
+
+        messages[0].write({'is_read': True})
+        # Повторная отметка не уменьшает счетчик второй раз
+        messages[0].write({'is_read': True})
+        messages[2].unlink()
+
+        incremental = (self._read(telegram_user, COUNTERS), self._read(lead, LEAD_COUNTERS))
+        self.assertEqual(incremental[0]['message_count'], 2)
+        self.assertEqual(incremental[0]['unread_count'], 0)
+        self.env['telegram.message']._recompute_counters({
+            'telegram.user': [telegram_user.id], 'crm.lead': [lead.id],
+        })
+        self.assertEqual((self._read(telegram_user, COUNTERS), self._read(lead, LEAD_COUNTERS)), incremental)
+
+
+@tagged('post_install', '-at_install')
+class TestSearchConversations(TelegramBotCase):
+
+    def test_highlight_snippet_escapes_text(self):
+        self.assertEqual(
+            highlight_snippet(f'<i>{SNIPPET_START}окно{SNIPPET_STOP}</i> & рама'),
+            '&lt;i&gt;<b>окно</b>&lt;/i&gt; &amp; рама')
+        self.assertEqual(highlight_snippet(None), '')
+
+    def test_snippet_is_escaped(self):
+        telegram_user = self._create_telegram_user(9301)
+        self.env['telegram.message'].create({
+            'telegram_user_id': telegram_user.id,
+            'text': 'Окно <script>alert(1)</script> не закрывается',
+            'direction': 'incoming',
+            'message_date': fields.Datetime.now(),
+        })
+        conversations = self.env['telegram.message'].search_conversations('окно')
+        conversation = next(result for result in conversations if result['id'] == telegram_user.id)
+        self.assertIn('<b>Окно</b>', conversation['snippet'])
+        # Кроме выделения совпадений, в фрагменте нет HTML-разметки из текста сообщения
+        self.assertNotIn('<', re.sub(r'</?b>', '', conversation['snippet']))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from odoo.addons.telegram_bot.models.telegram_user import CLAIM_TIMEOUT
+
+from .common import TelegramBotCase
+
+INVALIDATE_KEY = 'telegram_user.invalidate_cache'
+
+
+@tagged('post_install', '-at_install')
+class TestTelegramUserCache(TelegramBotCase):
+
+    def test_miss_not_cached(self):
+        TelegramUser = self.env['telegram.user']
+        self.assertIsNone(TelegramUser._get_cached_user(self.bot.id, 5001))
+        user = self._create_telegram_user(5001)
+        self.assertEqual(TelegramUser._get_cached_user(self.bot.id, 5001), (user.id, self.partner.id, 5001, False))
+
+    def test_uncommitted_changes_visible(self):
+        TelegramUser = self.env['telegram.user']
+        user = self._create_telegram_user(5002)
+        TelegramUser._get_cached_user(self.bot.id, 5002)
+        other_partner = self.env['res.partner'].create({'name': 'Другой клиент'})
+        user.write({'partner_id': other_partner.id, 'is_verified': True})
+        self.assertEqual(TelegramUser._get_cached_user(self.bot.id, 5002), (user.id, other_partner.id, 5002, True))
+
+    def test_invalidation_only_for_identity_fields(self):
+        user = self._create_telegram_user(5003)
+        postcommit = self.env.cr.postcommit
+        postcommit.data.pop(INVALIDATE_KEY, None)
+
+        user.write({'username': 'client', 'first_name': 'Клиент'})
+        self.assertNotIn(INVALIDATE_KEY, postcommit.data)
+
+        user.write({'chat_id': 6003})
+        self.assertTrue(postcommit.data.get(INVALIDATE_KEY))
+
+    def test_committed_user_cached(self):
+        TelegramUser = self.env['telegram.user']
+        user = self._create_telegram_user(5004, chat_id=6004, is_verified=True)
+        # Строка как будто изменена в прошлой транзакции
+        self.env.flush_all()
+        self.env.cr.execute("UPDATE telegram_user SET write_date = write_date - interval '1 day' WHERE id = %s",
+                            [user.id])
+        user.invalidate_recordset(['write_date'])
+        expected = (user.id, self.partner.id, 6004, True)
+        self.assertEqual(TelegramUser._get_cached_user(self.bot.id, 5004), expected)
+        with patch.object(type(TelegramUser), 'search_fetch', side_effect=AssertionError("telegram.user прочитан")):
+            self.assertEqual(TelegramUser._get_cached_user(self.bot.id, 5004), expected)
+
+        # Сброс после коммита меняет версию, и пользователь читается заново
+        TelegramUser._flush_user_cache()
+        self.env.cr.precommit.data.pop('telegram_user.cache_version', None)
+        user.write({'is_verified': False})
+        self.assertEqual(TelegramUser._get_cached_user(self.bot.id, 5004), (user.id, self.partner.id, 6004, False))
+
+
+@tagged('post_install', '-at_install')
+class TestTelegramUserClaim(TelegramBotCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        group_user = cls.env.ref('base.group_user')
+        cls.operator_a, cls.operator_b = cls.env['res.users'].create([
+            {'name': 'Оператор А', 'login': 'telegram_operator_a', 'groups_id': [(6, 0, group_user.ids)]},
+            {'name': 'Оператор Б', 'login': 'telegram_operator_b', 'groups_id': [(6, 0, group_user.ids)]},
+        ])
+        cls.bot.operator_user_ids = cls.operator_a | cls.operator_b
+        cls.conversation = cls._create_telegram_user(7001)
+
+    def test_claim_is_exclusive(self):
+        conversation_a = self.conversation.with_user(self.operator_a)
+        conversation_b = self.conversation.with_user(self.operator_b)
+        self.assertFalse(conversation_a._claim())
+        self.assertEqual(conversation_b._claim(), self.conversation)
+        self.assertEqual(self.conversation.operator_id, self.operator_a)
+        # Повторное взятие своей переписки продлевает ее
+        self.assertFalse(conversation_a._claim())
+
+        with self.assertRaises(UserError):
+            conversation_b.action_claim()
+
+    def test_claim_after_timeout_and_release(self):
+        self.assertFalse(self.conversation.with_user(self.operator_a)._claim())
+        self.conversation.sudo().write({'claim_date': fields.Datetime.now() - CLAIM_TIMEOUT - timedelta(minutes=1)})
+        self.assertFalse(self.conversation.with_user(self.operator_b)._claim())
+        self.assertEqual(self.conversation.operator_id, self.operator_b)
+
+        self.conversation.with_user(self.operator_b).action_release()
+        self.assertFalse(self.conversation.operator_id)
+        self.assertFalse(self.conversation.with_user(self.operator_a)._claim())
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from .common import TelegramBotCase
+
+
+@tagged('post_install', '-at_install')
+class TestWebhookSecret(TelegramBotCase):
+
+    def test_webhook_bot_lookup(self):
+        Bot = self.env['telegram.bot.config']
+        self.assertEqual(Bot._get_webhook_bot_id('test-secret'), self.bot.id)
+        self.assertFalse(Bot._get_webhook_bot_id('wrong-secret'))
+        # Неверные secret не добавляют записей в кеш: кешируется только словарь активных ботов
+        self.assertNotIn('wrong-secret', Bot._get_webhook_bots())
+
+    def test_webhook_secret_change(self):
+        Bot = self.env['telegram.bot.config']
+        self.assertEqual(Bot._get_webhook_bot_id('test-secret'), self.bot.id)
+        self.bot.write({'webhook_secret': 'new-secret'})
+        self.assertFalse(Bot._get_webhook_bot_id('test-secret'))
+        self.assertEqual(Bot._get_webhook_bot_id('new-secret'), self.bot.id)
+        self.bot.write({'active': False})
+        self.assertFalse(Bot._get_webhook_bot_id('new-secret'))
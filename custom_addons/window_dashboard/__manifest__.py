@@ -18,8 +18,10 @@
     'license': 'LGPL-3',
     'depends': [
         'base',
+        'bus',
         'crm',
         'sale',
+        'sale_margin',
         'project',
         'mrp',
         'window_measurement',
@@ -29,6 +31,8 @@
         'window_service',
     ],
     'data': [
+        'security/ir.model.access.csv',
+        'data/dashboard_data.xml',
         'views/dashboard_views.xml',
         'views/menu.xml',
     ],
@@ -1,149 +1,440 @@
 # -*- coding: utf-8 -*-
 
-from odoo import http
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from odoo import api, http
 from odoo.http import request
-from datetime import datetime, timedelta
 from odoo import fields
+from odoo.modules.registry import Registry
+from odoo.tools import SQL
+from odoo.addons.window_installation.models.installation_kpi import KPI_STAGES
+from odoo.addons.window_dashboard.models.dashboard_cache import UncachedResult
+
+PRODUCTION_PLAN_LIMIT = 100
+PRODUCTION_PLAN_MAX_LIMIT = 1000
+PRODUCTION_PLAN_ORDER_FIELDS = ('date_start', 'name', 'product_qty', 'id')
+KPI_WINDOWS = (7, 30, 90, 365)
+CUBE_DIMENSIONS = ('window_profile_type', 'window_glass_unit_type', 'installation_complexity', 'user_id')
+DASHBOARD_WIDGETS = (
+    'sales_funnel', 'production_plan', 'measurer_kpi', 'installer_kpi', 'lead_processing_time',
+    'order_profitability',
+)
+DASHBOARD_MAX_WORKERS = 4
+# Каждый поток виджета открывает свое соединение с БД из пула процесса (db_maxconn,
+# по умолчанию 64) сверх соединения самого запроса. Семафор общий для всех запросов
+# процесса: воркер prefork занимает не больше 1 + DASHBOARD_MAX_WORKERS соединений,
+# а threaded-сервер - не больше DASHBOARD_MAX_WORKERS дополнительных на все запросы.
+# Остальные виджеты ждут освободившегося соединения.
+widget_cursor_semaphore = threading.BoundedSemaphore(DASHBOARD_MAX_WORKERS)
+WIDGET_ERROR_MESSAGE = 'Не удалось получить данные виджета'
+
+_logger = logging.getLogger(__name__)
 
 
 class WindowDashboard(http.Controller):
 
+    @http.route('/window_dashboard/get_dashboard', type='json', auth='user')
+    def get_dashboard(self, widgets=None, params=None, **kwargs):
+        """Получить данные нескольких виджетов одним запросом
+
+        Независимые виджеты считаются параллельно, каждый в своем потоке
+        со своим курсором только для чтения. Число таких курсоров в процессе
+        ограничено widget_cursor_semaphore.
+
+        :param widgets: имена виджетов из DASHBOARD_WIDGETS (по умолчанию все)
+        :param params: параметры виджетов, например ``{'measurer_kpi': {'window': 7}}``
+        :return: ``{'widgets': {имя: данные}, 'errors': {имя: WIDGET_ERROR_MESSAGE}}``
+        """
+        env = request.env
+        widgets = [widget for widget in (widgets or DASHBOARD_WIDGETS) if widget in DASHBOARD_WIDGETS]
+        params = params or {}
+
+        if len(widgets) <= 1 or env.registry.in_test_mode():
+            results = {widget: self._get_widget_safe(env, widget, params.get(widget) or {}) for widget in widgets}
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(widgets), DASHBOARD_MAX_WORKERS)) as executor:
+                futures = {
+                    widget: executor.submit(
+                        self._get_widget_in_thread, env.cr.dbname, env.uid, env.context, widget, params.get(widget) or {})
+                    for widget in widgets
+                }
+                results = {widget: future.result() for widget, future in futures.items()}
+
+        return {
+            'widgets': {widget: data for widget, (data, error) in results.items() if error is None},
+            'errors': {widget: error for widget, (data, error) in results.items() if error is not None},
+        }
+
+    def _get_widget_in_thread(self, dbname, uid, context, widget, widget_params):
+        """Посчитать виджет в отдельном потоке с собственным курсором"""
+        threading.current_thread().dbname = dbname
+        with widget_cursor_semaphore, Registry(dbname).cursor() as cr:
+            cr.execute("SET TRANSACTION READ ONLY")
+            return self._get_widget_safe(api.Environment(cr, uid, context), widget, widget_params)
+
+    def _get_widget_safe(self, env, widget, widget_params):
+        """Данные виджета и текст ошибки (ошибка одного виджета не ломает остальные)
+
+        Клиент получает общий текст, подробности ошибки остаются в логе сервера.
+        """
+        try:
+            return getattr(self, f'_get_{widget}')(env, **widget_params), None
+        except Exception as e:
+            _logger.error(f"Ошибка расчета виджета дашборда {widget}: {str(e)}", exc_info=True)
+            return None, WIDGET_ERROR_MESSAGE
+
     @http.route('/window_dashboard/get_sales_funnel', type='json', auth='user')
     def get_sales_funnel(self, **kwargs):
         """Получить данные воронки продаж"""
-        stages = request.env['crm.stage'].search([], order='sequence')
+        return self._get_sales_funnel(request.env, **kwargs)
+
+    def _get_sales_funnel(self, env, date_from=None, date_to=None, user_id=None, team_id=None, **kwargs):
+        return self._get_cached_widget(
+            env, 'sales_funnel',
+            {'date_from': date_from, 'date_to': date_to, 'user_id': user_id, 'team_id': team_id},
+            lambda: self._compute_sales_funnel(env, date_from, date_to, user_id, team_id),
+        )
+
+    def _compute_sales_funnel(self, env, date_from=None, date_to=None, user_id=None, team_id=None):
+        """Количество, ожидаемая выручка и средний возраст сделок по стадиям
+        одним сгруппированным запросом"""
+        Lead = env['crm.lead']
+        domain = self._get_sales_funnel_domain(date_from, date_to, user_id, team_id)
+        Lead.flush_model(['stage_id', 'type', 'expected_revenue', 'create_date', 'user_id', 'team_id'])
+
+        # _search учитывает правила доступа, группировка выполняется в БД
+        query = Lead._search(domain)
+        stage_column = SQL.identifier(query.table, 'stage_id')
+        query.groupby = stage_column
+        env.cr.execute(query.select(
+            stage_column,
+            SQL('COUNT(*)'),
+            SQL('COALESCE(SUM(%s), 0)', SQL.identifier(query.table, 'expected_revenue')),
+            SQL('AVG(EXTRACT(EPOCH FROM (%s - %s)))', fields.Datetime.now(), SQL.identifier(query.table, 'create_date')),
+        ))
+        stats = {
+            stage_id: (count, revenue, age_seconds)
+            for stage_id, count, revenue, age_seconds in env.cr.fetchall()
+        }
+
+        stages = env['crm.stage'].search_read([], ['name'], order='sequence')
         funnel_data = []
-        
         for stage in stages:
-            leads_count = request.env['crm.lead'].search_count([
-                ('stage_id', '=', stage.id),
-                ('type', '=', 'opportunity')
-            ])
+            count, revenue, age_seconds = stats.get(stage['id'], (0, 0.0, None))
             funnel_data.append({
-                'stage': stage.name,
-                'count': leads_count,
+                'stage_id': stage['id'],
+                'stage': stage['name'],
+                'count': count,
+                'expected_revenue': round(revenue, 2),
+                'avg_age_days': round(age_seconds / 86400, 1) if age_seconds else 0,
             })
-        
+
         return funnel_data
 
+    def _get_sales_funnel_domain(self, date_from=None, date_to=None, user_id=None, team_id=None):
+        """Домен сделок для воронки с учетом фильтров"""
+        domain = [('type', '=', 'opportunity')]
+        if date_from:
+            domain.append(('create_date', '>=', datetime.combine(fields.Date.to_date(date_from), time.min)))
+        if date_to:
+            domain.append(('create_date', '<', datetime.combine(fields.Date.to_date(date_to) + timedelta(days=1), time.min)))
+        if user_id:
+            domain.append(('user_id', '=', int(user_id)))
+        if team_id:
+            domain.append(('team_id', '=', int(team_id)))
+        return domain
+
     @http.route('/window_dashboard/get_production_plan', type='json', auth='user')
     def get_production_plan(self, **kwargs):
-        """Получить производственный план"""
-        productions = request.env['mrp.production'].search([
-            ('state', 'in', ['confirmed', 'progress', 'to_close'])
-        ])
-        
-        plan_data = []
-        for prod in productions:
-            plan_data.append({
-                'name': prod.name,
-                'product': prod.product_id.name,
-                'qty': prod.product_qty,
-                'state': dict(prod._fields['state'].selection).get(prod.state),
-                'date_start': prod.date_start.strftime('%d.%m.%Y') if prod.date_start else '',
-            })
-        
-        return plan_data
+        """Получить производственный план
+
+        :param limit: размер страницы (не больше PRODUCTION_PLAN_MAX_LIMIT)
+        :param order: поле сортировки из PRODUCTION_PLAN_ORDER_FIELDS
+        :param cursor: значение ``next_cursor`` предыдущей страницы
+        :param since: вернуть только заказы, измененные после этой даты
+        """
+        return self._get_production_plan(request.env, **kwargs)
+
+    def _get_production_plan(self, env, limit=PRODUCTION_PLAN_LIMIT, order='date_start', descending=False,
+                             cursor=None, since=None, **kwargs):
+        if order not in PRODUCTION_PLAN_ORDER_FIELDS:
+            order = 'date_start'
+        limit = min(int(limit or PRODUCTION_PLAN_LIMIT), PRODUCTION_PLAN_MAX_LIMIT)
+        params = {
+            'limit': limit, 'order': order, 'descending': bool(descending),
+            'cursor': cursor, 'since': since,
+        }
+        return self._get_cached_widget(
+            env, 'production_plan', params,
+            lambda: self._compute_production_plan(env, limit, order, bool(descending), cursor, since),
+        )
+
+    def _compute_production_plan(self, env, limit=PRODUCTION_PLAN_LIMIT, order='date_start', descending=False,
+                                 cursor=None, since=None):
+        """Страница производственного плана в колоночном формате
+
+        Курсор - пара (значение поля сортировки, id) последней строки страницы,
+        следующая страница выбирается по ключу без OFFSET.
+        """
+        Production = env['mrp.production']
+        open_states = ['confirmed', 'progress', 'to_close']
+        server_time = fields.Datetime.now()
+
+        domain = [('state', 'in', open_states)]
+        removed_ids = []
+        if since:
+            since = fields.Datetime.to_datetime(since)
+            domain.append(('write_date', '>', since))
+            # Заказы, вышедшие из плана после предыдущего обновления
+            removed_ids = Production.search([
+                ('state', 'not in', open_states),
+                ('write_date', '>', since),
+            ]).ids
+        if cursor:
+            value, last_id = cursor
+            operator = '<' if descending else '>'
+            domain += ['|', (order, operator, value), '&', (order, '=', value), ('id', operator, last_id)]
+
+        direction = 'desc' if descending else 'asc'
+        order_spec = f'{order} {direction}' if order == 'id' else f'{order} {direction}, id {direction}'
+        rows = Production.search_read(
+            domain,
+            ['name', 'product_id', 'product_qty', 'state', 'date_start'],
+            order=order_spec,
+            limit=limit,
+        )
+
+        next_cursor = None
+        if len(rows) == limit:
+            last_value = rows[-1][order]
+            if order == 'date_start':
+                last_value = fields.Datetime.to_string(last_value)
+            next_cursor = [last_value, rows[-1]['id']]
+
+        return {
+            'ids': [row['id'] for row in rows],
+            'name': [row['name'] for row in rows],
+            'product': [row['product_id'][1] if row['product_id'] else '' for row in rows],
+            'qty': [row['product_qty'] for row in rows],
+            'state': [row['state'] for row in rows],
+            'date_start': [fields.Date.to_string(row['date_start']) if row['date_start'] else '' for row in rows],
+            'state_labels': dict(Production._fields['state']._description_selection(env)),
+            'removed_ids': removed_ids,
+            'next_cursor': next_cursor,
+            'server_time': fields.Datetime.to_string(server_time),
+        }
+
+    @staticmethod
+    def _parse_window(window):
+        """Период KPI в днях из KPI_WINDOWS, для прочих значений (в т.ч. не чисел) - 30"""
+        try:
+            window = int(window)
+        except (TypeError, ValueError):
+            return 30
+        return window if window in KPI_WINDOWS else 30
 
     @http.route('/window_dashboard/get_measurer_kpi', type='json', auth='user')
     def get_measurer_kpi(self, **kwargs):
-        """Получить KPI замерщиков"""
-        date_from = fields.Datetime.now() - timedelta(days=30)
-        measures = request.env['window.measure'].search([
-            ('date_done', '>=', date_from)
+        """Получить KPI замерщиков
+
+        :param window: период в днях (7, 30, 90 или 365)
+        """
+        return self._get_measurer_kpi(request.env, **kwargs)
+
+    def _get_measurer_kpi(self, env, window=30, **kwargs):
+        window = self._parse_window(window)
+        return self._get_cached_widget(
+            env, 'measurer_kpi', {'window': window},
+            lambda: self._compute_measurer_kpi(env, window),
+        )
+
+    def _compute_measurer_kpi(self, env, window=30):
+        """KPI по замерщикам за период и за предыдущий период такой же длины
+
+        Количество, доля выполненных, среднее, медиана и p90 времени от
+        плановой даты до выполнения (в часах) считаются в одном запросе.
+        """
+        Measure = env['window.measure']
+        now = fields.Datetime.now()
+        date_from = now - timedelta(days=window)
+        prev_date_from = date_from - timedelta(days=window)
+        Measure.flush_model(['measurer_id', 'state', 'date_planned', 'date_done'])
+
+        query = Measure._search([
+            ('date_planned', '>=', prev_date_from),
+            ('date_planned', '<', now),
         ])
-        
+        measurer = SQL.identifier(query.table, 'measurer_id')
+        is_current = SQL('(%s >= %s)', SQL.identifier(query.table, 'date_planned'), date_from)
+        done = SQL("%s = 'done' AND %s IS NOT NULL", SQL.identifier(query.table, 'state'),
+                   SQL.identifier(query.table, 'date_done'))
+        hours = SQL('EXTRACT(EPOCH FROM (%s - %s)) / 3600', SQL.identifier(query.table, 'date_done'),
+                    SQL.identifier(query.table, 'date_planned'))
+        query.groupby = SQL('%s, %s', measurer, is_current)
+        env.cr.execute(query.select(
+            measurer,
+            is_current,
+            SQL('COUNT(*)'),
+            SQL('COUNT(*) FILTER (WHERE %s)', done),
+            SQL('AVG(%s) FILTER (WHERE %s)', hours, done),
+            SQL('PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY %s) FILTER (WHERE %s)', hours, done),
+            SQL('PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY %s) FILTER (WHERE %s)', hours, done),
+        ))
+        rows = env.cr.fetchall()
+
+        users = env['res.users'].sudo().browse({row[0] for row in rows})
+        names = {user.id: user.name for user in users}
         kpi_data = {}
-        for measure in measures:
-            measurer = measure.measurer_id.name
-            if measurer not in kpi_data:
-                kpi_data[measurer] = {
-                    'total': 0,
-                    'done': 0,
-                    'avg_time': 0,
-                }
-            
-            kpi_data[measurer]['total'] += 1
-            if measure.state == 'done':
-                kpi_data[measurer]['done'] += 1
-                if measure.date_planned and measure.date_done:
-                    delta = measure.date_done - measure.date_planned
-                    kpi_data[measurer]['avg_time'] += delta.total_seconds() / 3600
-        
-        # Вычислить среднее время
-        for measurer in kpi_data:
-            if kpi_data[measurer]['done'] > 0:
-                kpi_data[measurer]['avg_time'] = kpi_data[measurer]['avg_time'] / kpi_data[measurer]['done']
-        
-        return kpi_data
+        for measurer_id, current, total, done_count, avg_time, median_time, p90_time in rows:
+            measurer_kpi = kpi_data.setdefault(measurer_id, {
+                'measurer_id': measurer_id,
+                'name': names.get(measurer_id, ''),
+                'current': self._empty_measurer_period(),
+                'previous': self._empty_measurer_period(),
+            })
+            measurer_kpi['current' if current else 'previous'] = {
+                'total': total,
+                'done': done_count,
+                'completion_rate': round(done_count * 100.0 / total, 1) if total else 0,
+                'avg_time': round(avg_time or 0, 1),
+                'median_time': round(median_time or 0, 1),
+                'p90_time': round(p90_time or 0, 1),
+            }
+
+        return {
+            'window': window,
+            'date_from': fields.Datetime.to_string(date_from),
+            'measurers': list(kpi_data.values()),
+        }
+
+    def _empty_measurer_period(self):
+        return {
+            'total': 0,
+            'done': 0,
+            'completion_rate': 0,
+            'avg_time': 0,
+            'median_time': 0,
+            'p90_time': 0,
+        }
 
     @http.route('/window_dashboard/get_installer_kpi', type='json', auth='user')
     def get_installer_kpi(self, **kwargs):
-        """Получить KPI монтажников"""
-        date_from = fields.Datetime.now() - timedelta(days=30)
-        tasks = request.env['project.task'].search([
-            ('is_installation_task', '=', True),
-            ('date_deadline', '>=', date_from)
-        ])
-        
-        kpi_data = {}
-        for task in tasks:
-            installer = task.installer_team_id.name or 'Не назначен'
-            if installer not in kpi_data:
-                kpi_data[installer] = {
-                    'total': 0,
-                    'completed': 0,
-                    'avg_time': 0,
-                }
-            
-            kpi_data[installer]['total'] += 1
-            if task.installation_state == 'act':
-                kpi_data[installer]['completed'] += 1
-        
+        """Получить KPI монтажников
+
+        :param window: период в днях (7, 30, 90 или 365)
+        """
+        return self._get_installer_kpi(request.env, **kwargs)
+
+    def _get_installer_kpi(self, env, window=30, **kwargs):
+        window = self._parse_window(window)
+        return self._get_cached_widget(
+            env, 'installer_kpi', {'window': window},
+            lambda: self._compute_installer_kpi(env, window),
+        )
+
+    def _compute_installer_kpi(self, env, window=30):
+        """KPI монтажников из дневной сводки window.installation.kpi"""
+        Kpi = env['window.installation.kpi']
+        date_from = fields.Date.context_today(Kpi) - timedelta(days=window)
+        aggregates = ['assigned_count:sum', 'completed_count:sum']
+        for stage in KPI_STAGES:
+            aggregates += [f'{stage}_hours:sum', f'{stage}_stage_count:sum']
+
+        kpi_data = []
+        for installer, total, completed, *stage_values in Kpi._read_group(
+                [('date', '>=', date_from)], ['installer_id'], aggregates):
+            stage_avg = {}
+            for index, stage in enumerate(KPI_STAGES):
+                hours, transitions = stage_values[2 * index], stage_values[2 * index + 1]
+                stage_avg[stage] = round(hours / transitions, 1) if transitions else 0
+            kpi_data.append({
+                'installer_id': installer.id,
+                'name': installer.name or 'Не назначен',
+                'total': total,
+                'completed': completed,
+                'avg_time': round(sum(stage_avg.values()), 1),
+                'stage_avg_time': stage_avg,
+            })
+
         return kpi_data
 
     @http.route('/window_dashboard/get_lead_processing_time', type='json', auth='user')
     def get_lead_processing_time(self, **kwargs):
-        """Получить средний срок обработки лида"""
-        date_from = fields.Datetime.now() - timedelta(days=90)
-        leads = request.env['crm.lead'].search([
-            ('create_date', '>=', date_from),
-            ('date_closed', '!=', False),
-        ])
-        
-        total_time = 0
-        count = 0
-        
-        for lead in leads:
-            if lead.create_date and lead.date_closed:
-                delta = lead.date_closed - lead.create_date
-                total_time += delta.total_seconds() / 86400  # дни
-                count += 1
-        
-        avg_time = total_time / count if count > 0 else 0
-        
-        return {
-            'avg_days': round(avg_time, 1),
-            'total_leads': count,
-        }
+        """Получить срок обработки лида
+
+        :param months: количество месяцев закрытия, включая текущий
+        :param won_only: учитывать только выигранные лиды
+        """
+        return self._get_lead_processing_time(request.env, **kwargs)
+
+    def _get_lead_processing_time(self, env, months=3, stage_id=None, source_id=None, won_only=True, **kwargs):
+        params = {'months': int(months), 'stage_id': stage_id, 'source_id': source_id, 'won_only': bool(won_only)}
+        return self._get_cached_widget(
+            env, 'lead_processing_time', params,
+            lambda: self._compute_lead_processing_time(env, **params),
+        )
+
+    def _compute_lead_processing_time(self, env, months=3, stage_id=None, source_id=None, won_only=True):
+        """Статистика срока обработки из window.dashboard.lead.stats"""
+        Stats = env['window.dashboard.lead.stats']
+        today = fields.Date.context_today(Stats)
+        date_from = fields.Date.subtract(today.replace(day=1), months=max(months, 1) - 1)
+        domain = []
+        if stage_id:
+            domain.append(('stage_id', '=', int(stage_id)))
+        if source_id:
+            domain.append(('source_id', '=', int(source_id)))
+        if won_only:
+            domain.append(('is_won', '=', True))
+
+        result = Stats._get_statistics(date_from, domain)
+        result.update({
+            'date_from': fields.Date.to_string(date_from),
+            'by_stage': Stats._get_breakdown(date_from, 'stage_id', domain),
+            'by_source': Stats._get_breakdown(date_from, 'source_id', domain),
+        })
+        return result
 
     @http.route('/window_dashboard/get_order_profitability', type='json', auth='user')
     def get_order_profitability(self, **kwargs):
-        """Получить доходность заказов"""
-        date_from = fields.Datetime.now() - timedelta(days=30)
-        orders = request.env['sale.order'].search([
-            ('is_window_order', '=', True),
-            ('state', 'in', ['sale', 'done']),
-            ('date_order', '>=', date_from)
-        ])
-        
-        total_revenue = sum(orders.mapped('amount_total'))
-        total_count = len(orders)
-        avg_order = total_revenue / total_count if total_count > 0 else 0
-        
-        return {
-            'total_revenue': total_revenue,
-            'total_orders': total_count,
-            'avg_order': round(avg_order, 2),
+        """Получить доходность заказов
+
+        :param groupby: измерения куба, например ``['date:month', 'window_profile_type']``
+        :param filters: значения измерений, например ``{'user_id': 2}``
+        """
+        return self._get_order_profitability(request.env, **kwargs)
+
+    def _get_order_profitability(self, env, date_from=None, date_to=None, groupby=None, filters=None, **kwargs):
+        params = {
+            'date_from': date_from, 'date_to': date_to,
+            'groupby': tuple(groupby or ()), 'filters': tuple(sorted((filters or {}).items())),
         }
+        return self._get_cached_widget(
+            env, 'order_profitability', params,
+            lambda: self._compute_order_profitability(env, date_from, date_to, groupby, filters),
+        )
+
+    def _compute_order_profitability(self, env, date_from=None, date_to=None, groupby=None, filters=None):
+        """Выручка, маржа и цена за м² из куба window.dashboard.sales.cube"""
+        Cube = env['window.dashboard.sales.cube']
+        if date_from:
+            date_from = fields.Date.to_date(date_from)
+        else:
+            date_from = fields.Date.context_today(Cube) - timedelta(days=30)
+        domain = [
+            (dimension, '=', value)
+            for dimension, value in (filters or {}).items()
+            if dimension in CUBE_DIMENSIONS
+        ]
+        result = Cube._query(date_from, fields.Date.to_date(date_to) if date_to else None, groupby or (), domain)
+        totals = result['totals']
+        totals['groups'] = result['groups']
+        # Дни периода еще ждут пересчета в cron: не кэшировать до обновления куба
+        return UncachedResult(totals) if result['stale'] else totals
 
+    def _get_cached_widget(self, env, widget, params, compute):
+        """Вернуть данные виджета из общего кэша дашборда"""
+        return env['window.dashboard.cache']._get_or_compute(widget, params, compute)
@@ -1,2 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from . import dashboard_cache
+from . import dashboard_bus
+from . import dashboard_sources
+from . import lead_cycle_stats
+from . import sales_cube
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+# Не больше стольких id на модель в одном событии, остальное клиент перечитает
+BUS_MAX_IDS = 100
+# Группа меню дашборда: только ее пользователи получают события компаний
+DASHBOARD_GROUP = 'base.group_user'
+
+
+class WindowDashboardBus(models.AbstractModel):
+    """Публикация изменений данных дашборда в шину по компаниям
+
+    Изменения за транзакцию накапливаются и отправляются одним событием
+    'window_dashboard/delta' на компанию перед коммитом.
+    """
+    _name = 'window.dashboard.bus'
+    _description = 'События дашборда в шине'
+
+    @api.model
+    def _collect(self, records, widgets, before=None, after=None):
+        """Добавить изменение записей в событие текущей транзакции
+
+        :param before: снимок записей до изменения (см. _get_dashboard_snapshot)
+        :param after: снимок записей после изменения
+        """
+        if not records or not widgets:
+            return
+        events = self.env.cr.precommit.data.setdefault('window_dashboard.bus_events', {})
+        if not events:
+            self.env.cr.precommit.add(self._publish)
+        before, after = before or {}, after or {}
+        if 'company_id' in records._fields:
+            companies = {record.id: record.company_id.id or self.env.company.id for record in records}
+        else:
+            companies = dict.fromkeys(records.ids, self.env.company.id)
+
+        for record_id, company_id in companies.items():
+            event = events.setdefault(company_id, {'widgets': set(), 'records': {}, 'funnel': {}})
+            event['widgets'].update(widgets)
+            event['records'].setdefault(records._name, set()).add(record_id)
+            for snapshot, sign in ((before.get(record_id), -1), (after.get(record_id), 1)):
+                if snapshot:
+                    stage_id, revenue = snapshot
+                    count_delta, revenue_delta = event['funnel'].get(stage_id, (0, 0.0))
+                    event['funnel'][stage_id] = (count_delta + sign, revenue_delta + sign * revenue)
+
+    def _publish(self):
+        events = self.env.cr.precommit.data.pop('window_dashboard.bus_events', {})
+        for company_id, event in events.items():
+            funnel = {
+                stage_id: {'count': count, 'expected_revenue': round(revenue, 2)}
+                for stage_id, (count, revenue) in event['funnel'].items()
+                if count or revenue
+            }
+            self.env['bus.bus']._sendone(self.env['res.company'].browse(company_id), 'window_dashboard/delta', {
+                'widgets': sorted(event['widgets']),
+                'records': {
+                    model: sorted(ids)[:BUS_MAX_IDS]
+                    for model, ids in event['records'].items()
+                },
+                'funnel': funnel,
+            })
+
+
+class IrWebsocket(models.AbstractModel):
+    _inherit = 'ir.websocket'
+
+    def _build_bus_channel_list(self, channels):
+        """Канал 'window_dashboard' подписывает на события компаний пользователя
+
+        Для пользователей без доступа к дашборду (портал, публичный) список каналов не меняется.
+        """
+        if self.env.uid and 'window_dashboard' in channels and self.env.user.has_group(DASHBOARD_GROUP):
+            channels = list(channels)
+            channels.remove('window_dashboard')
+            channels.extend(self.env.user.company_ids)
+        return super()._build_bus_channel_list(channels)
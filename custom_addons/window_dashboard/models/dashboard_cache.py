@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from odoo import models, api
+
+_logger = logging.getLogger(__name__)
+
+# Источники данных виджетов: модель -> поля, изменение которых влияет на результат.
+# Создание и удаление записей модели сбрасывает виджет независимо от полей.
+WIDGET_SOURCES = {
+    'sales_funnel': {
+        'crm.lead': {'stage_id', 'type', 'expected_revenue', 'user_id', 'team_id', 'active', 'company_id'},
+        'crm.stage': {'name', 'sequence'},
+    },
+    'production_plan': {
+        'mrp.production': {'name', 'state', 'product_id', 'product_qty', 'date_start', 'company_id'},
+    },
+    'measurer_kpi': {
+        'window.measure': {'state', 'date_planned', 'date_done', 'measurer_id'},
+    },
+    'installer_kpi': {
+        'project.task': {'is_installation_task', 'installation_state', 'installer_team_id'},
+    },
+    'lead_processing_time': {
+        'crm.lead': {'date_closed', 'stage_id', 'source_id', 'probability', 'active'},
+        'window.dashboard.lead.stats': set(),
+    },
+    'order_profitability': {
+        'sale.order': {
+            'is_window_order', 'state', 'date_order', 'user_id', 'company_id', 'window_profile_type',
+            'window_glass_unit_type', 'installation_complexity',
+        },
+        'sale.order.line': {
+            'price_unit', 'product_uom_qty', 'discount', 'tax_id', 'order_id', 'purchase_price',
+            'window_width', 'window_height',
+        },
+        'window.dashboard.sales.cube': set(),
+    },
+}
+
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_SIZE = 512
+
+
+class DashboardLRUCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, dbname, widgets):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == dbname and key[1] in widgets]:
+                del self._data[key]
+
+
+# Общий для всех запросов процесса (воркера) кэш
+dashboard_cache = DashboardLRUCache()
+
+
+class UncachedResult:
+    """Результат виджета, который возвращается без сохранения в кэш (например, посчитан по неполным данным)"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class WindowDashboardCache(models.AbstractModel):
+    _name = 'window.dashboard.cache'
+    _description = 'Кэш данных дашборда'
+
+    def init(self):
+        # Версия каждого виджета хранится в sequence: значение вне транзакций видно
+        # всем воркерам сразу, поэтому сброс кэша работает между процессами
+        for widget in WIDGET_SOURCES:
+            self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {self._get_sequence_name(widget)}")
+
+    @api.model
+    def _get_sequence_name(self, widget):
+        return f'window_dashboard_cache_{widget}'
+
+    @api.model
+    def _get_widget_version(self, widget):
+        """Версия виджета и признак того, что данные транзакции можно сохранить под ней
+
+        Версия - время последнего сброса в микросекундах (см. _flush_invalidation).
+        Если сброс случился после начала транзакции, ее снимок может не видеть
+        изменения, из-за которых версия сменилась, и результат не кэшируется.
+        """
+        self.env.cr.execute(f"""
+            SELECT last_value, last_value < (EXTRACT(EPOCH FROM now()) * 1000000)::bigint
+              FROM {self._get_sequence_name(widget)}
+        """)
+        return self.env.cr.fetchone()
+
+    @api.model
+    def _get_or_compute(self, widget, params, compute):
+        """Вернуть данные виджета из кэша или вычислить и сохранить их
+
+        Ключ включает компании, пользователя (правила доступа) и набор фильтров,
+        а также текущую версию виджета. compute может вернуть UncachedResult,
+        тогда значение возвращается без сохранения.
+        """
+        version, cacheable = self._get_widget_version(widget)
+        key = (
+            self.env.cr.dbname,
+            widget,
+            version,
+            tuple(self.env.companies.ids),
+            self.env.uid,
+            tuple(sorted((name, repr(value)) for name, value in params.items())),
+        )
+        ttl = int(self.env['ir.config_parameter'].sudo().get_param(
+            'window_dashboard.cache_ttl', DEFAULT_CACHE_TTL))
+        result = dashboard_cache.get(key, ttl)
+        if result is None:
+            result = compute()
+            if isinstance(result, UncachedResult):
+                return result.value
+            if cacheable:
+                dashboard_cache.set(key, result)
+        return result
+
+    @api.model
+    def _get_affected_widgets(self, model_name, fnames=None):
+        """Виджеты, зависящие от модели (и от указанных полей, если они переданы)"""
+        widgets = set()
+        for widget, sources in WIDGET_SOURCES.items():
+            watched = sources.get(model_name)
+            if watched is None:
+                continue
+            if fnames is None or watched.intersection(fnames):
+                widgets.add(widget)
+        return widgets
+
+    @api.model
+    def _invalidate(self, model_name, fnames=None):
+        """Запланировать сброс кэша виджетов после фиксации транзакции"""
+        widgets = self._get_affected_widgets(model_name, fnames)
+        if not widgets:
+            return
+        pending = self.env.cr.postcommit.data.setdefault('window_dashboard.invalidated_widgets', set())
+        if not pending:
+            self.env.cr.postcommit.add(self._flush_invalidation)
+        pending.update(widgets)
+
+    def _flush_invalidation(self):
+        """Сменить версии виджетов после коммита
+
+        Новая версия - время сброса в микросекундах (не меньше предыдущей версии + 1).
+        Транзакции, начатые раньше сброса, могут не видеть закоммиченных изменений,
+        поэтому _get_or_compute не кэширует их результат под новой версией.
+        """
+        widgets = self.env.cr.postcommit.data.pop('window_dashboard.invalidated_widgets', set())
+        if not widgets:
+            return
+        dashboard_cache.discard(self.env.cr.dbname, widgets)
+        try:
+            with self.env.registry.cursor() as cr:
+                for widget in sorted(widgets):
+                    sequence = self._get_sequence_name(widget)
+                    # Блокировка до конца транзакции: версия не уменьшается при одновременных сбросах
+                    cr.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [sequence])
+                    cr.execute(f"""
+                        SELECT setval(%s, GREATEST(
+                            last_value + 1, (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000)::bigint))
+                          FROM {sequence}
+                    """, [sequence])
+        except Exception as e:
+            _logger.error(f"Ошибка сброса кэша дашборда: {str(e)}")
+
+
+class WindowDashboardSourceMixin(models.AbstractModel):
+    """Сбрасывает кэш зависимых виджетов и публикует изменения в шину"""
+    _name = 'window.dashboard.source.mixin'
+    _description = 'Источник данных дашборда'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        Cache = self.env['window.dashboard.cache']
+        Cache._invalidate(self._name)
+        self.env['window.dashboard.bus']._collect(
+            records, Cache._get_affected_widgets(self._name), after=records._get_dashboard_snapshot())
+        return records
+
+    def write(self, vals):
+        Cache = self.env['window.dashboard.cache']
+        widgets = Cache._get_affected_widgets(self._name, vals)
+        before = self._get_dashboard_snapshot() if widgets else {}
+        result = super().write(vals)
+        if widgets:
+            Cache._invalidate(self._name, vals)
+            self.env['window.dashboard.bus']._collect(self, widgets, before, self._get_dashboard_snapshot())
+        return result
+
+    def unlink(self):
+        Cache = self.env['window.dashboard.cache']
+        Cache._invalidate(self._name)
+        self.env['window.dashboard.bus']._collect(
+            self, Cache._get_affected_widgets(self._name), before=self._get_dashboard_snapshot())
+        return super().unlink()
+
+    def _get_dashboard_snapshot(self):
+        """Вклад записей в воронку продаж: {id: (stage_id, expected_revenue)}"""
+        return {}
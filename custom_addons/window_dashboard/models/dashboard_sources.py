@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+
+
+class CrmLead(models.Model):
+    _name = 'crm.lead'
+    _inherit = ['crm.lead', 'window.dashboard.source.mixin']
+
+    def _get_dashboard_snapshot(self):
+        return {
+            lead.id: (lead.stage_id.id, lead.expected_revenue)
+            for lead in self
+            if lead.type == 'opportunity' and lead.active
+        }
+
+
+class CrmStage(models.Model):
+    _name = 'crm.stage'
+    _inherit = ['crm.stage', 'window.dashboard.source.mixin']
+
+
+class WindowMeasure(models.Model):
+    _name = 'window.measure'
+    _inherit = ['window.measure', 'window.dashboard.source.mixin']
+
+    date_planned = fields.Datetime(index=True)
+
+
+class ProjectTask(models.Model):
+    _name = 'project.task'
+    _inherit = ['project.task', 'window.dashboard.source.mixin']
+
+
+class MrpProduction(models.Model):
+    _name = 'mrp.production'
+    _inherit = ['mrp.production', 'window.dashboard.source.mixin']
+
+
+class SaleOrder(models.Model):
+    _name = 'sale.order'
+    _inherit = ['sale.order', 'window.dashboard.source.mixin']
+
+
+class SaleOrderLine(models.Model):
+    _name = 'sale.order.line'
+    _inherit = ['sale.order.line', 'window.dashboard.source.mixin']
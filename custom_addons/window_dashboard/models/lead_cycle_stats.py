@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+
+from odoo import models, fields, api
+
+# Верхние границы интервалов гистограммы срока обработки лида (в днях),
+# последний интервал открыт справа
+CYCLE_BUCKET_BOUNDS = (1, 2, 3, 5, 7, 10, 14, 21, 30, 45, 60, 90, 180)
+# Поля лида, которые входят в ключ статистики
+CYCLE_STATS_FIELDS = ['date_closed', 'stage_id', 'source_id', 'probability', 'active']
+
+
+def get_cycle_bucket(days):
+    """Номер интервала гистограммы для срока в днях"""
+    return bisect.bisect_right(CYCLE_BUCKET_BOUNDS, days)
+
+
+def get_cycle_percentile(histogram, percentile):
+    """Перцентиль по гистограмме с линейной интерполяцией внутри интервала
+
+    :param histogram: {bucket: (count, sum_days)}
+    """
+    total = sum(count for count, _sum_days in histogram.values())
+    if not total:
+        return 0
+    target = total * percentile
+    seen = 0
+    for bucket in sorted(histogram):
+        count, sum_days = histogram[bucket]
+        if count <= 0:
+            continue
+        if seen + count >= target:
+            if bucket >= len(CYCLE_BUCKET_BOUNDS):
+                # Открытый интервал: используем среднее значение внутри него
+                return sum_days / count
+            lower = CYCLE_BUCKET_BOUNDS[bucket - 1] if bucket else 0
+            upper = CYCLE_BUCKET_BOUNDS[bucket]
+            return lower + (upper - lower) * (target - seen) / count
+        seen += count
+    return 0
+
+
+class WindowDashboardLeadStats(models.Model):
+    """Инкрементальная статистика срока обработки лидов
+
+    Одна строка - месяц закрытия, стадия, источник, результат и интервал
+    гистограммы. Строки обновляются при закрытии и переоткрытии лидов,
+    поэтому чтение статистики не зависит от количества лидов.
+    """
+    _name = 'window.dashboard.lead.stats'
+    _description = 'Статистика срока обработки лидов'
+    _order = 'period desc'
+
+    period = fields.Date(string='Месяц закрытия', required=True, readonly=True, index=True)
+    stage_id = fields.Many2one('crm.stage', string='Стадия', readonly=True)
+    source_id = fields.Many2one('utm.source', string='Источник', readonly=True)
+    is_won = fields.Boolean(string='Выигран', readonly=True)
+    bucket = fields.Integer(string='Интервал гистограммы', readonly=True)
+    lead_count = fields.Integer(string='Количество лидов', readonly=True)
+    sum_days = fields.Float(string='Сумма дней', readonly=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS window_dashboard_lead_stats_key_uniq
+            ON window_dashboard_lead_stats (period, COALESCE(stage_id, 0), COALESCE(source_id, 0), is_won, bucket)
+        """)
+        self.env.cr.execute("SELECT 1 FROM window_dashboard_lead_stats LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _get_lead_key(self, lead):
+        """Ключ и срок обработки закрытого лида или None (архивные лиды не учитываются)"""
+        if not lead.active or not lead.date_closed or not lead.create_date:
+            return None
+        days = max((lead.date_closed - lead.create_date).total_seconds() / 86400, 0)
+        return (
+            lead.date_closed.date().replace(day=1),
+            lead.stage_id.id or None,
+            lead.source_id.id or None,
+            lead.probability >= 100,
+            get_cycle_bucket(days),
+        ), days
+
+    @api.model
+    def _snapshot(self, leads):
+        """Вклад лидов в статистику: {lead_id: (ключ, дни)}"""
+        snapshot = {}
+        for lead in leads:
+            entry = self._get_lead_key(lead)
+            if entry:
+                snapshot[lead.id] = entry
+        return snapshot
+
+    @api.model
+    def _apply_changes(self, before, after):
+        """Обновить статистику по разнице вкладов лидов до и после изменения"""
+        deltas = {}
+        for lead_id in set(before) | set(after):
+            if before.get(lead_id) == after.get(lead_id):
+                continue
+            for entry, sign in ((before.get(lead_id), -1), (after.get(lead_id), 1)):
+                if entry:
+                    key, days = entry
+                    count, sum_days = deltas.get(key, (0, 0.0))
+                    deltas[key] = (count + sign, sum_days + sign * days)
+        for (period, stage_id, source_id, is_won, bucket), (count, sum_days) in deltas.items():
+            if not count and not sum_days:
+                continue
+            self.env.cr.execute("""
+                INSERT INTO window_dashboard_lead_stats (period, stage_id, source_id, is_won, bucket,
+                                                         lead_count, sum_days)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (period, COALESCE(stage_id, 0), COALESCE(source_id, 0), is_won, bucket)
+                DO UPDATE SET lead_count = window_dashboard_lead_stats.lead_count + EXCLUDED.lead_count,
+                              sum_days = window_dashboard_lead_stats.sum_days + EXCLUDED.sum_days
+            """, [period, stage_id, source_id, is_won, bucket, count, sum_days])
+        if deltas:
+            self.invalidate_model()
+
+    @api.model
+    def _rebuild(self):
+        """Пересчитать статистику по всей истории лидов (первичное заполнение)"""
+        self.env['crm.lead'].flush_model(CYCLE_STATS_FIELDS)
+        bounds = list(CYCLE_BUCKET_BOUNDS)
+        self.env.cr.execute("DELETE FROM window_dashboard_lead_stats")
+        self.env.cr.execute("""
+            INSERT INTO window_dashboard_lead_stats (period, stage_id, source_id, is_won, bucket,
+                                                     lead_count, sum_days)
+            SELECT date_trunc('month', date_closed)::date,
+                   stage_id,
+                   source_id,
+                   COALESCE(probability, 0) >= 100,
+                   width_bucket(days, %s::float8[]),
+                   COUNT(*),
+                   SUM(days)
+              FROM (
+                    SELECT date_closed, stage_id, source_id, probability,
+                           GREATEST(EXTRACT(EPOCH FROM (date_closed - create_date)) / 86400, 0) AS days
+                      FROM crm_lead
+                     WHERE date_closed IS NOT NULL AND create_date IS NOT NULL AND active
+                   ) AS closed_leads
+          GROUP BY 1, 2, 3, 4, 5
+        """, [bounds])
+        self.invalidate_model()
+        self.env['window.dashboard.cache']._invalidate(self._name)
+
+    @api.model
+    def _get_statistics(self, date_from, domain=None):
+        """Среднее, медиана, p90 и гистограмма срока обработки за период"""
+        domain = [('period', '>=', date_from)] + (domain or [])
+        histogram = {
+            bucket: (count, sum_days)
+            for bucket, count, sum_days in self._read_group(domain, ['bucket'], ['lead_count:sum', 'sum_days:sum'])
+        }
+        total = sum(count for count, _sum_days in histogram.values())
+        total_days = sum(sum_days for _count, sum_days in histogram.values())
+        return {
+            'total_leads': total,
+            'avg_days': round(total_days / total, 1) if total else 0,
+            'median_days': round(get_cycle_percentile(histogram, 0.5), 1),
+            'p90_days': round(get_cycle_percentile(histogram, 0.9), 1),
+            'histogram': [
+                {
+                    'bucket': bucket,
+                    'upper_bound': CYCLE_BUCKET_BOUNDS[bucket] if bucket < len(CYCLE_BUCKET_BOUNDS) else None,
+                    'count': histogram[bucket][0],
+                }
+                for bucket in sorted(histogram) if histogram[bucket][0]
+            ],
+        }
+
+    @api.model
+    def _get_breakdown(self, date_from, groupby, domain=None):
+        """Количество и средний срок в разрезе стадий или источников"""
+        domain = [('period', '>=', date_from)] + (domain or [])
+        breakdown = []
+        for group, count, sum_days in self._read_group(domain, [groupby], ['lead_count:sum', 'sum_days:sum']):
+            if not count:
+                continue
+            breakdown.append({
+                'id': group.id,
+                'name': group.name or 'Не указано',
+                'count': count,
+                'avg_days': round(sum_days / count, 1),
+            })
+        return breakdown
+
+
+class CrmLead(models.Model):
+    _inherit = 'crm.lead'
+
+    def _get_cycle_stats_triggers(self):
+        """Поля, изменение которых может поменять ключ статистики
+
+        Кроме полей ключа это зависимости вычисляемой вероятности (стадия,
+        команда и т.п.): их запись меняет probability без ее явной записи.
+        """
+        depends = self.pool.field_depends[self._fields['probability']]
+        return set(CYCLE_STATS_FIELDS) | {path.split('.')[0] for path in depends}
+
+    def write(self, vals):
+        if not self._get_cycle_stats_triggers().intersection(vals):
+            return super().write(vals)
+        Stats = self.env['window.dashboard.lead.stats']
+        before = Stats._snapshot(self)
+        result = super().write(vals)
+        # Снимок после записи - по пересчитанным значениям (вероятность после смены стадии)
+        self.flush_recordset(CYCLE_STATS_FIELDS)
+        Stats._apply_changes(before, Stats._snapshot(self))
+        return result
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        leads = super().create(vals_list)
+        leads.flush_recordset(CYCLE_STATS_FIELDS)
+        Stats = self.env['window.dashboard.lead.stats']
+        Stats._apply_changes({}, Stats._snapshot(leads))
+        return leads
+
+    def unlink(self):
+        Stats = self.env['window.dashboard.lead.stats']
+        Stats._apply_changes(Stats._snapshot(self), {})
+        return super().unlink()
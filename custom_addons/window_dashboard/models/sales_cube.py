@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+
+# Поля заказа, от которых зависят строки куба
+CUBE_ORDER_FIELDS = {
+    'date_order', 'state', 'is_window_order', 'window_profile_type', 'window_glass_unit_type',
+    'installation_complexity', 'user_id', 'company_id',
+}
+# Поля строк заказа, от которых зависят площадь и суммы заказа в кубе
+CUBE_LINE_FIELDS = {
+    'order_id', 'product_id', 'product_uom', 'product_uom_qty', 'price_unit', 'discount', 'tax_id',
+    'purchase_price', 'window_width', 'window_height', 'display_type',
+}
+CUBE_GROUPBY = (
+    'date:day', 'date:week', 'date:month', 'window_profile_type', 'window_glass_unit_type',
+    'installation_complexity', 'user_id',
+)
+CUBE_AGGREGATES = ['order_count:sum', 'amount_untaxed:sum', 'amount_total:sum', 'margin:sum', 'window_area:sum']
+
+
+class WindowDashboardSalesCube(models.Model):
+    """Предагрегированный куб продаж оконных заказов
+
+    Строка - день, тип профиля, тип стеклопакета, сложность монтажа,
+    продавец и компания. Измененные заказы помечают свой день как
+    устаревший, и cron пересчитывает только эти дни. Чтение куба ничего
+    не пересчитывает: срез, в который попал устаревший день, возвращается
+    с признаком stale и не кэшируется.
+    """
+    _name = 'window.dashboard.sales.cube'
+    _description = 'Куб продаж оконных заказов'
+    _order = 'date desc'
+
+    date = fields.Date(string='Дата', required=True, readonly=True, index=True)
+    window_profile_type = fields.Selection(
+        selection=lambda self: self.env['sale.order']._fields['window_profile_type'].selection,
+        string='Тип профиля', readonly=True)
+    window_glass_unit_type = fields.Selection(
+        selection=lambda self: self.env['sale.order']._fields['window_glass_unit_type'].selection,
+        string='Тип стеклопакета', readonly=True)
+    installation_complexity = fields.Selection(
+        selection=lambda self: self.env['sale.order']._fields['installation_complexity'].selection,
+        string='Сложность монтажа', readonly=True)
+    user_id = fields.Many2one('res.users', string='Продавец', readonly=True)
+    company_id = fields.Many2one('res.company', string='Компания', readonly=True, index=True)
+    order_count = fields.Integer(string='Количество заказов', readonly=True)
+    amount_untaxed = fields.Float(string='Выручка без налогов', readonly=True)
+    amount_total = fields.Float(string='Выручка', readonly=True)
+    margin = fields.Float(string='Маржа', readonly=True)
+    window_area = fields.Float(string='Площадь (м²)', readonly=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS window_dashboard_sales_cube_dirty (
+                date date PRIMARY KEY
+            )
+        """)
+        self.env.cr.execute("SELECT 1 FROM window_dashboard_sales_cube LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _mark_dirty(self, orders):
+        """Пометить дни заказов как требующие пересчета"""
+        dates = {order.date_order.date() for order in orders if order.date_order}
+        if dates:
+            self.env.cr.execute("""
+                INSERT INTO window_dashboard_sales_cube_dirty (date)
+                SELECT unnest(%s::date[])
+                ON CONFLICT DO NOTHING
+            """, [list(dates)])
+            if self.env.cr.rowcount:
+                # Cron может еще не существовать (заказы, созданные при установке модуля до загрузки данных)
+                cron = self.env.ref('window_dashboard.ir_cron_refresh_sales_cube', raise_if_not_found=False)
+                if cron:
+                    cron.sudo()._trigger()
+
+    @api.model
+    def _refresh(self):
+        """Пересчитать строки куба за дни, помеченные как устаревшие
+
+        Вызывается только из cron: пересчет пишет в БД и блокирует дни.
+        """
+        self.env['sale.order'].flush_model()
+        self.env['sale.order.line'].flush_model(['order_id', 'window_area', 'product_uom_qty'])
+        # SKIP LOCKED: параллельный пересчет не ждет и не пересчитывает те же дни
+        self.env.cr.execute("""
+            DELETE FROM window_dashboard_sales_cube_dirty
+             WHERE date IN (SELECT date FROM window_dashboard_sales_cube_dirty FOR UPDATE SKIP LOCKED)
+         RETURNING date
+        """)
+        dates = [row[0] for row in self.env.cr.fetchall()]
+        if dates:
+            self.env.cr.execute("DELETE FROM window_dashboard_sales_cube WHERE date = ANY(%s)", [dates])
+            self._insert_rows("so.date_order::date = ANY(%s)", [dates])
+            self.invalidate_model()
+        return dates
+
+    @api.model
+    def _rebuild(self):
+        """Полностью пересобрать куб"""
+        self.env['sale.order'].flush_model()
+        self.env['sale.order.line'].flush_model(['order_id', 'window_area', 'product_uom_qty'])
+        self.env.cr.execute("DELETE FROM window_dashboard_sales_cube_dirty")
+        self.env.cr.execute("DELETE FROM window_dashboard_sales_cube")
+        self._insert_rows("TRUE", [])
+        self.invalidate_model()
+
+    @api.model
+    def _insert_rows(self, where, params):
+        self.env.cr.execute(f"""
+            INSERT INTO window_dashboard_sales_cube (
+                date, window_profile_type, window_glass_unit_type, installation_complexity,
+                user_id, company_id, order_count, amount_untaxed, amount_total, margin, window_area)
+            SELECT so.date_order::date,
+                   so.window_profile_type,
+                   so.window_glass_unit_type,
+                   so.installation_complexity,
+                   so.user_id,
+                   so.company_id,
+                   COUNT(*),
+                   COALESCE(SUM(so.amount_untaxed), 0),
+                   COALESCE(SUM(so.amount_total), 0),
+                   COALESCE(SUM(so.margin), 0),
+                   COALESCE(SUM(area.window_area), 0)
+              FROM sale_order so
+         LEFT JOIN LATERAL (
+                    SELECT SUM(sol.window_area * sol.product_uom_qty) AS window_area
+                      FROM sale_order_line sol
+                     WHERE sol.order_id = so.id
+                   ) area ON TRUE
+             WHERE so.is_window_order
+               AND so.state IN ('sale', 'done')
+               AND {where}
+          GROUP BY 1, 2, 3, 4, 5, 6
+        """, params)
+
+    @api.model
+    def _query(self, date_from, date_to=None, groupby=(), domain=None):
+        """Срез куба: итоги и группы по выбранным измерениям
+
+        :param groupby: измерения из CUBE_GROUPBY
+        :param domain: дополнительный фильтр по измерениям куба
+        :return: {'totals': ..., 'groups': [...], 'stale': в периоде есть еще не пересчитанные дни}
+        """
+        domain = [('date', '>=', date_from), ('company_id', 'in', self.env.companies.ids)] + (domain or [])
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        groupby = [spec for spec in groupby if spec in CUBE_GROUPBY]
+
+        totals = self._format_measures(*self._read_group(domain, [], CUBE_AGGREGATES)[0])
+        groups = []
+        if groupby:
+            for row in self._read_group(domain, groupby, CUBE_AGGREGATES):
+                keys, measures = row[:len(groupby)], row[len(groupby):]
+                group = self._format_measures(*measures)
+                for spec, value in zip(groupby, keys):
+                    group[spec] = self._format_group_value(spec, value)
+                groups.append(group)
+        return {'totals': totals, 'groups': groups, 'stale': self._has_dirty_days(date_from, date_to)}
+
+    @api.model
+    def _has_dirty_days(self, date_from, date_to=None):
+        """Есть ли в периоде дни, ожидающие пересчета
+
+        Пересчет удаляет отметку и обновляет строки дня в одной транзакции,
+        поэтому в снимке чтения без отметок строки куба актуальны.
+        """
+        self.env.cr.execute("""
+            SELECT EXISTS(
+                SELECT 1 FROM window_dashboard_sales_cube_dirty
+                 WHERE date >= %s AND (%s::date IS NULL OR date <= %s::date)
+            )
+        """, [date_from, date_to, date_to])
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _format_measures(self, order_count, amount_untaxed, amount_total, margin, window_area):
+        return {
+            'total_orders': order_count or 0,
+            'total_revenue': round(amount_total or 0, 2),
+            'revenue_untaxed': round(amount_untaxed or 0, 2),
+            'margin': round(margin or 0, 2),
+            'margin_percent': round((margin or 0) * 100 / amount_untaxed, 1) if amount_untaxed else 0,
+            'avg_order': round(amount_total / order_count, 2) if order_count else 0,
+            'window_area': round(window_area or 0, 2),
+            'avg_price_m2': round(amount_untaxed / window_area, 2) if window_area else 0,
+        }
+
+    @api.model
+    def _format_group_value(self, spec, value):
+        if spec == 'user_id':
+            return {'id': value.id, 'name': value.name or 'Не назначен'}
+        if spec.startswith('date'):
+            return fields.Date.to_string(value) if value else False
+        return value or False
+
+    @api.model
+    def _cron_refresh(self):
+        if self._refresh():
+            self.env['window.dashboard.cache']._invalidate(self._name)
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        self.env['window.dashboard.sales.cube']._mark_dirty(orders)
+        return orders
+
+    def write(self, vals):
+        Cube = self.env['window.dashboard.sales.cube']
+        if CUBE_ORDER_FIELDS.intersection(vals):
+            Cube._mark_dirty(self)
+        result = super().write(vals)
+        if CUBE_ORDER_FIELDS.intersection(vals):
+            Cube._mark_dirty(self)
+        return result
+
+    def unlink(self):
+        self.env['window.dashboard.sales.cube']._mark_dirty(self)
+        return super().unlink()
+
+
+class SaleOrderLine(models.Model):
+    _inherit = 'sale.order.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        self.env['window.dashboard.sales.cube']._mark_dirty(lines.order_id)
+        return lines
+
+    def write(self, vals):
+        if not CUBE_LINE_FIELDS.intersection(vals):
+            return super().write(vals)
+        Cube = self.env['window.dashboard.sales.cube']
+        if 'order_id' in vals:
+            Cube._mark_dirty(self.order_id)
+        result = super().write(vals)
+        Cube._mark_dirty(self.order_id)
+        return result
+
+    def unlink(self):
+        self.env['window.dashboard.sales.cube']._mark_dirty(self.order_id)
+        return super().unlink()
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from . import test_lead_cycle_stats
+from . import test_sales_cube
+from . import test_dashboard_controller
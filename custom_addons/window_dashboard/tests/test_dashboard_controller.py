@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.window_dashboard.controllers.dashboard import WIDGET_ERROR_MESSAGE, WindowDashboard
+
+
+@tagged('post_install', '-at_install')
+class TestDashboardController(TransactionCase):
+
+    def test_parse_window(self):
+        self.assertEqual(WindowDashboard._parse_window('90'), 90)
+        self.assertEqual(WindowDashboard._parse_window(7), 7)
+        # Неизвестные и нечисловые значения дают период по умолчанию
+        for window in (45, 'week', None, '', [7]):
+            self.assertEqual(WindowDashboard._parse_window(window), 30)
+
+    def test_widget_error_is_generic(self):
+        error = ValueError('relation "secret_table" does not exist')
+        with patch.object(WindowDashboard, '_get_sales_funnel', side_effect=error), \
+                self.assertLogs('odoo.addons.window_dashboard.controllers.dashboard', 'ERROR') as logs:
+            data, message = WindowDashboard()._get_widget_safe(self.env, 'sales_funnel', {})
+        self.assertIsNone(data)
+        self.assertEqual(message, WIDGET_ERROR_MESSAGE)
+        self.assertIn('secret_table', logs.output[0])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.window_dashboard.models.lead_cycle_stats import get_cycle_bucket, get_cycle_percentile
+
+
+@tagged('post_install', '-at_install')
+class TestLeadCycleStats(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Stats = cls.env['window.dashboard.lead.stats']
+        cls.source = cls.env['utm.source'].create({'name': 'Сайт'})
+        cls.stage_new, cls.stage_won = cls.env['crm.stage'].create([
+            {'name': 'Новый', 'sequence': 1},
+            {'name': 'Выигран', 'sequence': 2, 'is_won': True},
+        ])
+        # Исходное состояние статистики согласовано с лидами базы
+        cls.Stats._rebuild()
+
+    def _read_stats(self):
+        """Ненулевые строки статистики в сравнимом виде"""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT period, stage_id, source_id, is_won, bucket, lead_count, ROUND(sum_days::numeric, 6)
+              FROM window_dashboard_lead_stats
+             WHERE lead_count != 0
+          ORDER BY 1, 2, 3, 4, 5
+        """)
+        return self.env.cr.fetchall()
+
+    def _close(self, leads, days, **vals):
+        for lead in leads:
+            lead.write(dict(vals, date_closed=lead.create_date + timedelta(days=days)))
+
+    def test_incremental_matches_rebuild(self):
+        leads = self.env['crm.lead'].create([
+            {'name': f'Лид {index}', 'type': 'opportunity', 'stage_id': self.stage_new.id,
+             'source_id': self.source.id}
+            for index in range(6)
+        ])
+        self._close(leads[:2], 0.5, stage_id=self.stage_won.id, probability=100)
+        self._close(leads[2:4], 12, probability=0)
+        self._close(leads[4:], 200)
+
+        # Переоткрытие, смена источника и удаление меняют уже учтенные вклады
+        leads[2].write({'date_closed': False})
+        leads[3].write({'source_id': False})
+        leads[4].unlink()
+
+        incremental = self._read_stats()
+        self.Stats._rebuild()
+        self.assertEqual(incremental, self._read_stats())
+
+    def test_archive_and_computed_probability(self):
+        leads = self.env['crm.lead'].create([
+            {'name': f'Лид {index}', 'type': 'opportunity', 'stage_id': self.stage_new.id,
+             'source_id': self.source.id}
+            for index in range(3)
+        ])
+        self._close(leads, 3)
+        # Вероятность пересчитывается из стадии, а не передается в write
+        leads[0].write({'stage_id': self.stage_won.id})
+        self.assertEqual(leads[0].probability, 100)
+        leads[1].action_archive()
+        self.assertEqual(self.Stats._get_lead_key(leads[1]), None)
+
+        incremental = self._read_stats()
+        self.Stats._rebuild()
+        self.assertEqual(incremental, self._read_stats())
+
+        leads[1].action_unarchive()
+        incremental = self._read_stats()
+        self.Stats._rebuild()
+        self.assertEqual(incremental, self._read_stats())
+
+    def test_statistics(self):
+        leads = self.env['crm.lead'].create([
+            {'name': f'Лид {index}', 'type': 'opportunity', 'source_id': self.source.id}
+            for index in range(4)
+        ])
+        for lead, days in zip(leads, (1.5, 1.5, 4, 100)):
+            self._close(lead, days)
+        period = fields.Date.to_date(leads[0].date_closed).replace(day=1)
+        stats = self.Stats._get_statistics(period, [('source_id', '=', self.source.id)])
+        self.assertEqual(stats['total_leads'], 4)
+        self.assertEqual(stats['avg_days'], round((1.5 + 1.5 + 4 + 100) / 4, 1))
+        self.assertEqual(
+            {row['bucket']: row['count'] for row in stats['histogram']},
+            {get_cycle_bucket(1.5): 2, get_cycle_bucket(4): 1, get_cycle_bucket(100): 1})
+
+    def test_cycle_percentile(self):
+        self.assertEqual(get_cycle_percentile({}, 0.5), 0)
+        # Все лиды в интервале (1, 2]: медиана посередине интервала
+        self.assertAlmostEqual(get_cycle_percentile({get_cycle_bucket(1.5): (10, 15.0)}, 0.5), 1.5)
+        # Открытый последний интервал дает среднее значение
+        self.assertAlmostEqual(get_cycle_percentile({get_cycle_bucket(400): (2, 800.0)}, 0.9), 400)
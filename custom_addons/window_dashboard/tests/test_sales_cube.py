@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.window_dashboard.models.dashboard_cache import UncachedResult
+
+
+@tagged('post_install', '-at_install')
+class TestSalesCube(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Cube = cls.env['window.dashboard.sales.cube']
+        cls.partner = cls.env['res.partner'].create({'name': 'Клиент куба'})
+        cls.product = cls.env['product.product'].create({'name': 'Окно', 'type': 'consu', 'list_price': 1000})
+        cls.day = date(2024, 3, 5)
+        cls.Cube._rebuild()
+
+    def _create_order(self, qty=2):
+        return self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'date_order': datetime(2024, 3, 5, 10, 0),
+            'state': 'sale',
+            'is_window_order': True,
+            'window_profile_type': 'pvc_5',
+            'order_line': [(0, 0, {
+                'product_id': self.product.id,
+                'product_uom_qty': qty,
+                'price_unit': 1000,
+                'window_width': 1000,
+                'window_height': 1500,
+            })],
+        })
+
+    def _dirty_dates(self):
+        self.env.flush_all()
+        self.env.cr.execute("SELECT date FROM window_dashboard_sales_cube_dirty")
+        return {row[0] for row in self.env.cr.fetchall()}
+
+    def test_line_write_marks_dirty_only_for_cube_fields(self):
+        order = self._create_order()
+        self.assertIn(self.day, self._dirty_dates())
+        self.Cube._refresh()
+        self.assertFalse(self._dirty_dates())
+
+        order.order_line.write({'name': 'Окно в спальню'})
+        self.assertFalse(self._dirty_dates())
+
+        order.order_line.write({'product_uom_qty': 3})
+        self.assertEqual(self._dirty_dates(), {self.day})
+
+    def test_query_stale_until_refresh(self):
+        self._create_order(qty=2)
+        # Чтение не пересчитывает куб, а помечает срез устаревшим
+        self.assertTrue(self.Cube._query(self.day, self.day)['stale'])
+
+        self.Cube._refresh()
+        result = self.Cube._query(self.day, self.day, ['window_profile_type'])
+        self.assertFalse(result['stale'])
+        self.assertEqual(result['totals']['total_orders'], 1)
+        self.assertAlmostEqual(result['totals']['window_area'], 3.0)
+
+        self.Cube._rebuild()
+        self.assertEqual(self.Cube._query(self.day, self.day, ['window_profile_type']), result)
+
+    def test_uncached_result_not_stored(self):
+        Cache = self.env['window.dashboard.cache']
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return UncachedResult({'calls': len(calls)})
+
+        params = {'test': 'uncached'}
+        self.assertEqual(Cache._get_or_compute('order_profitability', params, compute), {'calls': 1})
+        self.assertEqual(Cache._get_or_compute('order_profitability', params, compute), {'calls': 2})
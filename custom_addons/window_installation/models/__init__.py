@@ -2,4 +2,5 @@
 
 from . import project_task
 from . import sale_order
+from . import installation_kpi
 
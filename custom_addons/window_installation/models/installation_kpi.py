@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.tools import column_exists
+
+# Этапы монтажа, для которых накапливается длительность (акт - конечный статус)
+KPI_STAGES = ('assigned', 'delivery', 'installation', 'cleaning')
+
+
+class WindowInstallationKpi(models.Model):
+    """Дневная сводка KPI монтажника
+
+    Таблица пополняется инкрементально при смене статуса задач монтажа,
+    дашборд читает ее вместо перебора задач.
+    """
+    _name = 'window.installation.kpi'
+    _description = 'KPI монтажников по дням'
+    _order = 'date desc, installer_id'
+
+    installer_id = fields.Many2one('res.users', string='Бригада монтажников', readonly=True, index=True)
+    date = fields.Date(string='Дата', required=True, readonly=True, index=True)
+    assigned_count = fields.Integer(string='Назначено задач', readonly=True)
+    completed_count = fields.Integer(string='Завершено (акт)', readonly=True)
+    assigned_hours = fields.Float(string='Назначено, ч', readonly=True)
+    assigned_stage_count = fields.Integer(string='Назначено, переходов', readonly=True)
+    delivery_hours = fields.Float(string='Доставка, ч', readonly=True)
+    delivery_stage_count = fields.Integer(string='Доставка, переходов', readonly=True)
+    installation_hours = fields.Float(string='Монтаж, ч', readonly=True)
+    installation_stage_count = fields.Integer(string='Монтаж, переходов', readonly=True)
+    cleaning_hours = fields.Float(string='Уборка, ч', readonly=True)
+    cleaning_stage_count = fields.Integer(string='Уборка, переходов', readonly=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS window_installation_kpi_installer_date_uniq
+            ON window_installation_kpi (COALESCE(installer_id, 0), date)
+        """)
+        self.env.cr.execute("SELECT 1 FROM window_installation_kpi LIMIT 1")
+        if not self.env.cr.fetchone() and column_exists(self.env.cr, 'project_task', 'is_installation_task'):
+            self._backfill()
+
+    @api.model
+    def _add(self, installer_id, date, **increments):
+        """Прибавить значения к сводке монтажника за день (upsert без гонок)"""
+        columns = list(increments)
+        self.env.cr.execute(f"""
+            INSERT INTO window_installation_kpi (installer_id, date, {', '.join(columns)},
+                                                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, {', '.join(['%s'] * len(columns))},
+                    %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT (COALESCE(installer_id, 0), date) DO UPDATE SET
+                {', '.join(f'{column} = COALESCE(window_installation_kpi.{column}, 0) + EXCLUDED.{column}' for column in columns)},
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """, [installer_id or None, date, *increments.values(), self.env.uid, self.env.uid])
+        self.invalidate_model()
+
+    @api.model
+    def _register_assignment(self, tasks):
+        """Учесть назначение задач монтажникам в день назначения (installer_assigned_date)"""
+        for task in tasks:
+            # Задачи без монтажника не считаются назначенными
+            if task.installer_team_id and task.installer_assigned_date:
+                self._add(task.installer_team_id.id, task.installer_assigned_date, assigned_count=1)
+
+    @api.model
+    def _unregister_assignment(self, assignments):
+        """Списать назначения задач в тот день, в который они были учтены
+
+        :param assignments: [(id монтажника, дата назначения)]
+        """
+        today = fields.Date.context_today(self)
+        for installer_id, assigned_date in assignments:
+            self._add(installer_id, assigned_date or today, assigned_count=-1)
+
+    @api.model
+    def _register_transition(self, installer_id, old_state, new_state, state_date):
+        """Учесть переход задачи из old_state в new_state"""
+        now = fields.Datetime.now()
+        increments = {}
+        if old_state in KPI_STAGES and state_date:
+            increments[f'{old_state}_hours'] = (now - state_date).total_seconds() / 3600
+            increments[f'{old_state}_stage_count'] = 1
+        if new_state == 'act' and old_state != 'act':
+            increments['completed_count'] = 1
+        if increments:
+            self._add(installer_id, fields.Date.context_today(self), **increments)
+
+    @api.model
+    def _backfill(self):
+        """Первичное заполнение сводки по существующим задачам
+
+        Длительности этапов исторически не сохранялись, поэтому переносятся
+        только количества: назначения - по дате назначения (для старых задач -
+        по дате создания), завершения - по дате перехода в статус «Акт».
+        """
+        self.env['project.task'].flush_model([
+            'is_installation_task', 'installer_team_id', 'installation_state',
+            'installation_state_date', 'installer_assigned_date',
+        ])
+        self.env.cr.execute("""
+            INSERT INTO window_installation_kpi (installer_id, date, assigned_count, completed_count)
+            SELECT installer_id, date, SUM(assigned), SUM(completed)
+              FROM (
+                    SELECT installer_team_id AS installer_id,
+                           COALESCE(installer_assigned_date, create_date::date) AS date,
+                           1 AS assigned, 0 AS completed
+                      FROM project_task
+                     WHERE is_installation_task AND installer_team_id IS NOT NULL
+                 UNION ALL
+                    SELECT installer_team_id, COALESCE(installation_state_date, write_date)::date, 0, 1
+                      FROM project_task
+                     WHERE is_installation_task AND installation_state = 'act'
+                   ) AS task_events
+          GROUP BY installer_id, date
+        """)
+        self.invalidate_model()
@@ -44,6 +44,17 @@ class ProjectTask(models.Model):
         default='assigned',
         tracking=True,
     )
+    installation_state_date = fields.Datetime(
+        string='Дата смены статуса монтажа',
+        readonly=True,
+        copy=False,
+    )
+    installer_assigned_date = fields.Date(
+        string='Дата назначения бригады',
+        readonly=True,
+        copy=False,
+        help='День, в который назначение учтено в KPI монтажников',
+    )
     sale_order_id = fields.Many2one(
         'sale.order',
         string='Заказ',
@@ -57,22 +68,96 @@ class ProjectTask(models.Model):
         readonly=True,
     )
 
+    def init(self):
+        super().init()
+        # Назначения задач, созданных до появления даты назначения, учтены по дате создания (см. _backfill)
+        self.env.cr.execute("""
+            UPDATE project_task
+               SET installer_assigned_date = create_date::date
+             WHERE is_installation_task AND installer_team_id IS NOT NULL AND installer_assigned_date IS NULL
+        """)
+
     @api.model_create_multi
     def create(self, vals_list):
+        today = fields.Date.context_today(self)
+        for vals in vals_list:
+            if vals.get('is_installation_task'):
+                vals.setdefault('installation_state_date', fields.Datetime.now())
+                if vals.get('installer_team_id'):
+                    vals.setdefault('installer_assigned_date', today)
         tasks = super().create(vals_list)
         for task in tasks:
             if task.is_installation_task:
                 task._set_installation_defaults()
+        self.env['window.installation.kpi']._register_assignment(tasks.filtered('is_installation_task'))
         return tasks
 
     def write(self, vals):
+        previous_states = {}
+        if 'installation_state' in vals:
+            previous_states = {
+                task.id: (task.installation_state, task.installation_state_date)
+                for task in self if task.is_installation_task
+            }
+            vals = dict(vals, installation_state_date=fields.Datetime.now())
+        assignment_changed = bool({'installer_team_id', 'is_installation_task'}.intersection(vals))
+        previous_assignments = {}
+        if assignment_changed:
+            previous_assignments = {
+                task.id: (task.installer_team_id.id, task.installer_assigned_date)
+                for task in self if task.is_installation_task and task.installer_team_id
+            }
         result = super().write(vals)
+        if assignment_changed:
+            self._update_installer_assignment(previous_assignments)
         if 'installation_state' in vals:
             for task in self:
                 if task.is_installation_task:
+                    if task.id in previous_states:
+                        old_state, state_date = previous_states[task.id]
+                        if old_state != task.installation_state:
+                            self.env['window.installation.kpi']._register_transition(
+                                task.installer_team_id.id, old_state, task.installation_state, state_date)
                     task._update_installation_state()
         return result
 
+    def unlink(self):
+        self.env['window.installation.kpi']._unregister_assignment([
+            (task.installer_team_id.id, task.installer_assigned_date)
+            for task in self if task.is_installation_task and task.installer_team_id
+        ])
+        return super().unlink()
+
+    def _update_installer_assignment(self, previous_assignments):
+        """Перенести назначения в KPI после смены бригады или признака задачи монтажа
+
+        Прежнее назначение списывается в тот день, в который было учтено.
+
+        :param previous_assignments: {id задачи: (id монтажника, дата назначения)} до записи
+        """
+        Kpi = self.env['window.installation.kpi']
+        removed = []
+        assigned = self.browse()
+        for task in self:
+            previous = previous_assignments.get(task.id)
+            current = task.is_installation_task and task.installer_team_id.id
+            if previous and previous[0] == current:
+                continue
+            if previous:
+                removed.append(previous)
+            if current:
+                assigned |= task
+        Kpi._unregister_assignment(removed)
+        unassigned = self.filtered(lambda task: task.id in previous_assignments) - assigned
+        unassigned.filtered('installer_assigned_date').write({'installer_assigned_date': False})
+        if assigned:
+            assigned.write({'installer_assigned_date': fields.Date.context_today(self)})
+            Kpi._register_assignment(assigned)
+        # Задача могла стать задачей монтажа после создания
+        self.filtered(lambda task: task.is_installation_task and not task.installation_state_date).write({
+            'installation_state_date': fields.Datetime.now(),
+        })
+
     def _set_installation_defaults(self):
         """Установить значения по умолчанию для задачи монтажа"""
         if not self.planned_date:
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestInstallationKpi(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Kpi = cls.env['window.installation.kpi']
+        cls.installer_a = cls.env['res.users'].create({'name': 'Бригада А', 'login': 'installer_a_kpi_test'})
+        cls.installer_b = cls.env['res.users'].create({'name': 'Бригада Б', 'login': 'installer_b_kpi_test'})
+        cls.project = cls.env['project.project'].create({'name': 'Монтаж', 'is_installation_project': True})
+
+    def _assigned(self, installer, date=None):
+        rows = self.Kpi._read_group(
+            [('installer_id', '=', installer.id if installer else False),
+             ('date', '=', date or fields.Date.context_today(self.Kpi))],
+            [], ['assigned_count:sum'])
+        return rows[0][0] or 0
+
+    def _create_task(self, installer=None, is_installation_task=True):
+        return self.env['project.task'].create({
+            'name': 'Монтаж окон',
+            'project_id': self.project.id,
+            'is_installation_task': is_installation_task,
+            'installer_team_id': installer.id if installer else False,
+        })
+
+    def test_create_counts_assignment(self):
+        self._create_task(self.installer_a)
+        self.assertEqual(self._assigned(self.installer_a), 1)
+
+    def test_reassignment_moves_assignment(self):
+        task = self._create_task(self.installer_a)
+        task.write({'installer_team_id': self.installer_b.id})
+        self.assertEqual(self._assigned(self.installer_a), 0)
+        self.assertEqual(self._assigned(self.installer_b), 1)
+
+        # Повторная запись того же монтажника ничего не меняет
+        task.write({'installer_team_id': self.installer_b.id})
+        self.assertEqual(self._assigned(self.installer_b), 1)
+
+    def test_unassigned_tasks_not_counted(self):
+        before = self._assigned(None)
+        task = self._create_task()
+        self.assertEqual(self._assigned(None), before)
+
+        task.write({'installer_team_id': self.installer_a.id})
+        task.write({'installer_team_id': False})
+        self.assertEqual(self._assigned(self.installer_a), 0)
+        self.assertEqual(self._assigned(None), before)
+
+    def test_reassignment_uses_assignment_date(self):
+        task = self._create_task(self.installer_a)
+        # Назначение учтено вчера
+        yesterday = fields.Date.context_today(self.Kpi) - timedelta(days=1)
+        self.Kpi._add(self.installer_a.id, task.installer_assigned_date, assigned_count=-1)
+        self.Kpi._add(self.installer_a.id, yesterday, assigned_count=1)
+        task.write({'installer_assigned_date': yesterday})
+
+        task.write({'installer_team_id': self.installer_b.id})
+        self.assertEqual(self._assigned(self.installer_a, yesterday), 0)
+        self.assertEqual(self._assigned(self.installer_a), 0)
+        self.assertEqual(self._assigned(self.installer_b), 1)
+        self.assertEqual(task.installer_assigned_date, fields.Date.context_today(self.Kpi))
+
+    def test_unlink_and_late_flag(self):
+        task = self._create_task(self.installer_a)
+        task.unlink()
+        self.assertEqual(self._assigned(self.installer_a), 0)
+
+        task = self._create_task(self.installer_a, is_installation_task=False)
+        self.assertEqual(self._assigned(self.installer_a), 0)
+        task.write({'is_installation_task': True})
+        self.assertEqual(self._assigned(self.installer_a), 1)
+        self.assertTrue(task.installation_state_date)
+
+        task.write({'is_installation_task': False})
+        self.assertEqual(self._assigned(self.installer_a), 0)
+        self.assertFalse(task.installer_assigned_date)
+
+    def test_backfill_completed_by_completion_date(self):
+        task = self._create_task(self.installer_a)
+        task.write({'installation_state': 'act'})
+        completed_at = fields.Datetime.now() + timedelta(days=3)
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE project_task
+               SET create_date = %s, installation_state_date = %s, installer_assigned_date = NULL
+             WHERE id = %s
+        """, [completed_at - timedelta(days=10), completed_at, task.id])
+        self.env.cr.execute("DELETE FROM window_installation_kpi")
+        self.Kpi._backfill()
+
+        def totals(date):
+            rows = self.Kpi._read_group(
+                [('installer_id', '=', self.installer_a.id), ('date', '=', date)],
+                [], ['assigned_count:sum', 'completed_count:sum'])
+            return tuple(value or 0 for value in rows[0])
+
+        self.assertEqual(totals((completed_at - timedelta(days=10)).date()), (1, 0))
+        self.assertEqual(totals(completed_at.date()), (0, 1))